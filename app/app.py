@@ -17,13 +17,15 @@
 #   Contributors: See the CONTRIBUTORS file for details of contributions.
 #
 
+import os
 import sys
 import time
+import traceback
 
 # Get globals setup out of the way early as other modules depend on it.
 from casemgr import globals
-from cocklebur import dbobj
-from casemgr import albasetup, handle_exception, persondupestat
+from cocklebur import dbobj, prefork
+from casemgr import albasetup, handle_exception, persondupestat, fuzzyperson
 from casemgr.notification.client import connect as notify_connect
 import config
 
@@ -31,6 +33,7 @@ config_vars = (
     'appname',
     'apptitle',
     'debug',
+    'exec_timing',
     'helpdesk_contact',
     'html_target',
     'session_timeout',
@@ -38,6 +41,11 @@ config_vars = (
 
 dbobj.execute_debug(config.tracedb)
 dbobj.execute_timing(config.exec_timing)
+dbobj.execute_prepare(config.prepared_statements)
+dbobj.where_in_array(config.where_in_array)
+if config.exec_timing:
+    from cocklebur.dbobj.exec_timing import exec_timing
+    exec_timing.nplus1 = config.exec_timing_nplus1
 
 globals.notify = notify_connect(config.cgi_target,
                                 config.notification_host,
@@ -53,8 +61,58 @@ app = albasetup.get_app(config, config_vars,
                         start_page = 'login')
 
 
-if __name__ == '__main__':
+def prewarm_phonetics():
+    """
+    Pre-warm the phonetic encoding memo (persistent servers only - the
+    queries scan the persons table)
+    """
+    try:
+        try:
+            fuzzyperson.phonetic_cache.prewarm(globals.db)
+        except dbobj.DatabaseError:
+            # Names are simply encoded as they are seen
+            traceback.print_exc()
+    finally:
+        globals.db.rollback()
+
+
+def warm_caches():
+    """
+    Load the caches that do not go stale (form definitions are
+    immutable once versioned, and phonetic encodings never change) and
+    import the pages, so preforked workers start warm. Caches refreshed
+    on change notification are left for the workers to load, as the
+    parent no longer receives notifications once it starts forking.
+    """
+    try:
+        for form in globals.formlib.latest():
+            form.load()
+    finally:
+        globals.db.rollback()
+    prewarm_phonetics()
+    # Import the page modules (and everything they import)
+    pages_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 
+                             'pages')
+    for fn in os.listdir(pages_dir):
+        name, ext = os.path.splitext(fn)
+        if ext == '.py' and name != '__init__':
+            try:
+                __import__('pages.' + name)
+            except Exception:
+                # The page will report the error when used
+                traceback.print_exc()
+    # Each worker makes its own connections
+    globals.db.close()
+    globals.notify.reset()
 
+
+def serve(max_requests=config.max_requests):
+    if config.exec_timing:
+        exec_timing.reset()
+        if config.exec_timing_dir:
+            exec_timing_file = os.path.join(config.exec_timing_dir, 
+                                            '%s-%d.prom' % (config.appname, 
+                                                            os.getpid()))
     req_count = 0
     for req in albasetup.next_request():
         if req.get_method() == 'OPTIONS':
@@ -67,6 +125,8 @@ if __name__ == '__main__':
             continue
         req_count += 1
         globals.remote_host = req.get_remote_host()
+        if config.exec_timing:
+            exec_timing.begin_request()
         try:
             globals.db.load_describer()         # Pick up any schema changes
             app.run(req)
@@ -74,9 +134,49 @@ if __name__ == '__main__':
         finally:
             globals.db.rollback()
         if config.exec_timing:
-            from cocklebur.dbobj import exec_timing
-            exec_timing.show()
-        if config.max_requests and req_count >= config.max_requests:
+            exec_timing.end_request(app.request_page())
+            if (config.exec_timing_dir 
+                    and req_count % config.exec_timing_interval == 0):
+                exec_timing.dump(exec_timing_file, app=config.appname, 
+                                 pid=os.getpid())
+        if max_requests and req_count >= max_requests:
             # After servicing this many requests, we exit gracefully to
             # minimise the impact of memory fragmentation and object leaks.
             break
+        if config.max_rss and prefork.rss_mb() > config.max_rss:
+            break
+    if config.exec_timing and config.exec_timing_dir:
+        try:
+            os.unlink(exec_timing_file)
+        except OSError:
+            pass
+
+
+def invalidate_caches():
+    """
+    The parent receives no change notifications after warm_caches(), so
+    in case anything it imported loaded them, a worker (particularly one
+    forked to replace a retired worker) must not trust the notification
+    caches it inherits.
+    """
+    from casemgr import syndrome, demogfields, casetags
+    syndrome.syndromes.cache_invalidate()
+    syndrome.unit_syndromes.cache_invalidate()
+    casetags.tag_cache.cache_invalidate()
+    demogfields.flush()
+
+
+def serve_worker():
+    invalidate_caches()
+    # Stagger the retirement of workers
+    serve(prefork.jitter(config.max_requests))
+
+
+if __name__ == '__main__':
+    if config.prefork_workers and albasetup.deploy_mode == 'fcgi':
+        warm_caches()
+        prefork.Supervisor(config.prefork_workers, serve_worker).run()
+    else:
+        if albasetup.deploy_mode == 'fcgi':
+            prewarm_phonetics()
+        serve()
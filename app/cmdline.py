@@ -32,6 +32,9 @@ NetEpi Collection, command line interface.
     report              Run a report
 
 Maintenance and debugging commands (you probably won't need to use these):
+    casevisibility      Rebuild the case visibility table (only needed if
+                        case access or tasks were changed outside the
+                        application).
     notifymon           Monitor change notification bus.
     personindex         Rebuild fuzzy person index (typically this is only
                         needed if the indexing algorithm has changed).
@@ -284,9 +284,17 @@ def get_app(config, config_vars, profiler=None, ctx_mixins=None, **kwargs):
     ctx_cls = new.classobj('AlbaCtx', tuple(ctx_bases), 
                            dict(__init__=call_all('__init__')))
     def create_context(self):
-        return ctx_cls(self)
+        # The context of the last request is retained for request_page()
+        self.request_ctx = ctx_cls(self)
+        return self.request_ctx
+    def request_page(self):
+        # Name of the page displayed by the last request
+        ctx = getattr(self, 'request_ctx', None)
+        if ctx is not None:
+            return getattr(ctx.locals, '__page__', None)
     app_cls = new.classobj('AlbaApp', tuple(app_bases), 
-                           dict(create_context=create_context))
+                           dict(create_context=create_context,
+                                request_page=request_page))
     app = app_cls(**kwargs)
     if profiler:
         app.profiler = profiler
@@ -60,3 +60,30 @@ class NotifyCache(Cached):
             globals.notify.subscribe(self.notification_target, 
                                      self.cache_invalidate)):
             self.time_to_live *= 10
+
+
+class CommitNotify(object):
+    """
+    Change notifications sent immediately (so other processes stop
+    caching the affected objects), and sent again when the current
+    transaction is committed, as objects loaded by other processes
+    before the commit do not reflect the change. This matters for long
+    transactions, such as data imports.
+    """
+    def __init__(self):
+        self.events = set()
+
+    def notify(self, *event):
+        globals.notify.notify(*event)
+        self.events.add(event)
+        globals.db.add_pending(self)
+
+    def db_commit(self):
+        events, self.events = self.events, set()
+        for event in events:
+            globals.notify.notify(*event)
+
+    def db_rollback(self):
+        self.events = set()
+
+commit_notify = CommitNotify()
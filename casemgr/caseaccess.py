@@ -16,6 +16,27 @@
 #   Contributors: See the CONTRIBUTORS file for details of contributions.
 #
 
+"""
+Case access control.
+
+A unit sees the cases it has been granted access to (case_acl), or the
+cases of the syndromes of its groups (the ACCESSSYND right), and units
+and users see the cases of tasks in their work queues (those they own,
+or are members of).
+
+The case_acl and task components are also materialised in the
+case_visibility table, a (unit_id or user_id, case_id) row per grant,
+so acl_query can test a single indexed table rather than subselects
+over case_acl, tasks, workqueues and workqueue_members. Code changing
+case_acl, tasks or queue membership must call refresh_cases() or
+refresh_queue() within the same transaction.
+"""
+
+from cocklebur import dbobj
+
+import config
+
+
 def acl_query(query, credentials, deleted=False):
     """
     This adds a "where" clause to the given /query/ to limit the query to
@@ -26,27 +47,126 @@ def acl_query(query, credentials, deleted=False):
     visible case_id's.
     """
     if 'ACCESSALL' not in credentials.rights:
-        or_query = query.sub_expr('OR')
-        if 'ACCESSSYND' in credentials.rights:
-            accessquery = or_query.in_select('syndrome_id', 'group_syndromes')
-            accessquery.join('JOIN unit_groups USING (group_id)')
-            accessquery.where('unit_id = %s', credentials.unit.unit_id)
+        unit_id = credentials.unit.unit_id
+        user_id = credentials.user.user_id
+        if config.case_visibility:
+            if 'ACCESSSYND' in credentials.rights:
+                or_query = query.sub_expr('OR')
+                accessquery = or_query.in_select('syndrome_id', 
+                                                 'group_syndromes')
+                accessquery.join('JOIN unit_groups USING (group_id)')
+                accessquery.where('unit_id = %s', unit_id)
+                visquery = or_query.in_select('case_id', 'case_visibility')
+                visquery.where('(unit_id = %s AND via_task) OR user_id = %s',
+                               unit_id, user_id)
+            else:
+                visquery = query.in_select('case_id', 'case_visibility')
+                visquery.where('unit_id = %s OR user_id = %s', 
+                               unit_id, user_id)
         else:
-            accessquery = or_query.in_select('case_id', 'case_acl')
-            accessquery.where('unit_id = %s', credentials.unit.unit_id)
-        taskquery = or_query.in_select('case_id', 'tasks', 
-                                        columns=['case_id'])
-        queuequery = taskquery.in_select('queue_id', 'workqueues')
-        queuequery.where('user_id = %s OR unit_id = %s',
-                         credentials.user.user_id, credentials.unit.unit_id)
-        memberquery = queuequery.union_query('workqueue_members')
-        memberquery.where('user_id = %s OR unit_id = %s',
-                          credentials.user.user_id, credentials.unit.unit_id)
+            or_query = query.sub_expr('OR')
+            if 'ACCESSSYND' in credentials.rights:
+                accessquery = or_query.in_select('syndrome_id', 
+                                                 'group_syndromes')
+                accessquery.join('JOIN unit_groups USING (group_id)')
+                accessquery.where('unit_id = %s', unit_id)
+            else:
+                accessquery = or_query.in_select('case_id', 'case_acl')
+                accessquery.where('unit_id = %s', unit_id)
+            taskquery = or_query.in_select('case_id', 'tasks', 
+                                            columns=['case_id'])
+            queuequery = taskquery.in_select('queue_id', 'workqueues')
+            queuequery.where('user_id = %s OR unit_id = %s',
+                             user_id, unit_id)
+            memberquery = queuequery.union_query('workqueue_members')
+            memberquery.where('user_id = %s OR unit_id = %s',
+                              user_id, unit_id)
     if deleted in ('y', True, 'True'):
         query.where('cases.deleted')
     elif deleted in ('n', False, 'False'):
         query.where('not cases.deleted')
 
+
+# The visibility rows of the cases matching a condition (repeated for
+# each half of the union)
+visibility_select = """\
+SELECT unit_id, NULL, case_id, false
+ FROM case_acl
+ WHERE case_id IN (%s)
+UNION
+SELECT queues.unit_id, queues.user_id, case_id, true
+ FROM tasks
+ JOIN (SELECT queue_id, unit_id, user_id FROM workqueues
+       UNION
+       SELECT queue_id, unit_id, user_id FROM workqueue_members) AS queues
+  USING (queue_id)
+ WHERE case_id IN (%s)
+  AND (queues.unit_id IS NOT NULL OR queues.user_id IS NOT NULL)"""
+
+
+def _refresh(db, query):
+    """
+    Recompute the case_visibility rows of the cases selected by /query/
+    (a "cases" query).
+    """
+    # Locking the cases serialises refreshes of the same case, so each
+    # sees the changes committed by the last.
+    lock_query = query.copy()
+    lock_query.for_update = True
+    lock_expr, lock_args = lock_query.build_expr(['case_id'])
+    case_expr, case_args = query.build_expr(['case_id'])
+    curs = db.cursor()
+    try:
+        dbobj.execute(curs, lock_expr, lock_args)
+        dbobj.execute(curs, 'DELETE FROM case_visibility'
+                            ' WHERE case_id IN (%s)' % case_expr, case_args)
+        dbobj.execute(curs, 'INSERT INTO case_visibility'
+                            ' (unit_id, user_id, case_id, via_task) ' +
+                            visibility_select % (case_expr, case_expr),
+                      case_args + case_args)
+    finally:
+        curs.close()
+
+
+def refresh_cases(db, case_ids):
+    """
+    Recompute the visibility of /case_ids/, after their case_acl or
+    tasks have changed.
+    """
+    case_ids = [case_id for case_id in case_ids if case_id is not None]
+    if case_ids:
+        query = db.query('cases')
+        query.where_in('case_id', case_ids)
+        _refresh(db, query)
+
+
+def refresh_queue(db, queue_id):
+    """
+    Recompute the visibility of the cases of the tasks in /queue_id/,
+    after the queue's members have changed.
+    """
+    query = db.query('cases')
+    taskquery = query.in_select('case_id', 'tasks')
+    taskquery.where('queue_id = %s', queue_id)
+    _refresh(db, query)
+
+
+def rebuild(db):
+    """
+    Recompute the case_visibility table from scratch.
+    """
+    db.lock_table('case_visibility', 'EXCLUSIVE')
+    curs = db.cursor()
+    try:
+        dbobj.execute(curs, 'DELETE FROM case_visibility')
+        dbobj.execute(curs, 'INSERT INTO case_visibility'
+                            ' (unit_id, user_id, case_id, via_task) ' +
+                            visibility_select % ('SELECT case_id FROM cases',
+                                                 'SELECT case_id FROM cases'))
+    finally:
+        curs.close()
+
+
 def contact_query(query, case_id):
     inq = query.in_select('case_id', 'case_contacts')
     inq.where('contact_id = %s', case_id)
@@ -18,7 +18,8 @@
 
 import copy
 from cocklebur import dbobj, datetime
-from casemgr import globals, caseaccess, demogfields, syndrome, person, casetags
+from casemgr import globals, caseaccess, demogfields, syndrome, person, \
+                    casetags, cached
 import config
 
 class MergeError(globals.Error): pass
@@ -304,10 +305,13 @@ class CaseMerge:
         update_case.db_update()
         tag_desc = casetags.set_case_tags(update_case.case_id, update_case.tags)
         delete_case.db_update()
+        caseaccess.refresh_cases(globals.db, 
+                                 [update_case.case_id, delete_case.case_id])
         desc = 'Merge System ID %s into %s, UPDATED %s %s, DELETED %s' %\
                     (delete_case.case_id, update_case.case_id, 
                      update_desc, tag_desc, delete_desc)
         credentials.user_log(globals.db, desc, case_id=update_case.case_id)
+        cached.commit_notify.notify('casedata', update_case.syndrome_id)
         return update_case, delete_case
 
 
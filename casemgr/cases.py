@@ -17,9 +17,10 @@
 #
 import time
 import re
+from cocklebur.compat import *
 from cocklebur import dbobj, datetime, pt
 from casemgr import globals, person, form_summary, demogfields, \
-                    syndrome, casestatus, caseaccess, casetags
+                    syndrome, casestatus, caseaccess, casetags, cached
 
 import config
 
@@ -36,6 +37,7 @@ def local_case_id_validate(local_case_id):
 class ACL(pt.SearchPT):
     def __init__(self, credentials, case_row):
         self.credentials = credentials
+        self.case_id = case_row.case_id
         ptable = globals.db.participation_table('case_acl','case_id','unit_id')
         ptable.preload_from_result([case_row])
         pt.SearchPT.__init__(self, ptable[case_row.case_id], 'name',
@@ -47,10 +49,15 @@ class ACL(pt.SearchPT):
             return
         pt.SearchPT.remove(self, index)
 
+    def db_update(self):
+        pt.SearchPT.db_update(self)
+        caseaccess.refresh_cases(globals.db, [self.case_id])
+
 
 class Case(form_summary.FormsListMixin):
 
-    def __init__(self, credentials, case_row, seed_person=None):
+    def __init__(self, credentials, case_row, seed_person=None,
+                 edit_person=None, tags=None):
         if case_row is None:
             raise dbobj.DatabaseError('Access denied')
         self.acl = None
@@ -60,11 +67,13 @@ class Case(form_summary.FormsListMixin):
         self.delete_timestamp = self.case_row.delete_timestamp
         self.syndrome = syndrome.syndromes[case_row.syndrome_id]
         self.credentials = credentials
-        self.tags = casetags.CaseTags(self.case_row.case_id)
+        self.tags = casetags.CaseTags(self.case_row.case_id, tags)
         self._contact_count = None
         form_summary.FormsListMixin.__init__(self, case_row.syndrome_id)
         if self.case_row.is_new():
             self.person = person.edit_new(seed_person)
+        elif edit_person is not None:
+            self.person = edit_person
         else:
             self.person = person.edit_id(self.case_row.person_id)
         self.forms.set_case(self.case_row.case_id)
@@ -235,6 +244,12 @@ class Case(form_summary.FormsListMixin):
         """
         globals.notify.notify('syndromecasecount', self.case_row.syndrome_id)
 
+    def data_notify(self):
+        """
+        Case (or form) data has changed, send notification
+        """
+        cached.commit_notify.notify('casedata', self.case_row.syndrome_id)
+
     def update(self):
         self.assert_not_viewonly()
         self.validate()
@@ -251,7 +266,9 @@ class Case(form_summary.FormsListMixin):
             case_acl.case_id = self.case_row.case_id
             case_acl.unit_id = self.credentials.unit.unit_id
             case_acl.db_update()
+            caseaccess.refresh_cases(globals.db, [self.case_row.case_id])
             self.cc_notify()
+        self.data_notify()
         self.forms.set_case(self.case_row.case_id)
 
     def revert(self):
@@ -316,6 +333,7 @@ class Case(form_summary.FormsListMixin):
         self.deleted = delete
         self.delete_reason = reason
         self.delete_timestamp = timestamp
+        self.data_notify()
 
 
 def edit_case(credentials, case_id):
@@ -327,6 +345,66 @@ def edit_case(credentials, case_id):
 new_case = Case.new
 
 
+def edit_cases(credentials, case_rows):
+    """
+    Case objects for a list of case rows (access must already have been
+    checked), loading their persons and tags with a query each, rather
+    than a query per case. Cases of the same person share one person
+    object, so edits to it accumulate as they would if the cases were
+    edited in turn.
+    """
+    query = globals.db.query('persons')
+    query.where_in('person_id', [case_row.person_id for case_row in case_rows])
+    persons = {}
+    for person_row in query.fetchall():
+        persons[person_row.person_id] = person.edit_row(person_row)
+    cases_tags = casetags.CasesTags([case_row.case_id 
+                                     for case_row in case_rows])
+    case_list = []
+    for case_row in case_rows:
+        case = Case(credentials, case_row, 
+                    edit_person=persons[case_row.person_id],
+                    tags=cases_tags.get(case_row.case_id, casetags.Tags()))
+        case_list.append(case)
+    return case_list
+
+
+def update_many(cases):
+    """
+    Write a list of (validated) Cases as their update() methods would, but
+    batching statements.
+    """
+    if not cases:
+        return
+    for case in cases:
+        case.assert_not_viewonly()
+    new_cases = [case for case in cases if case.is_new()]
+    person.update_many([case.person for case in cases])
+    for case in cases:
+        case.case_row.person_id = case.person.person_id
+    try:
+        globals.db.update_rows([case.case_row for case in cases])
+    except dbobj.RecordDeleted:
+        raise dbobj.RecordDeleted('Record has been deleted (or merged) by '
+                                  'another user')
+    acl_rows = []
+    for case in cases:
+        case.tags.update(case.case_row.case_id)
+        case.forms.set_case(case.case_row.case_id)
+    for case in new_cases:
+        case_acl = globals.db.new_row('case_acl')
+        case_acl.case_id = case.case_row.case_id
+        case_acl.unit_id = case.credentials.unit.unit_id
+        acl_rows.append(case_acl)
+    globals.db.update_rows(acl_rows, refetch=False)
+    caseaccess.refresh_cases(globals.db, 
+                             [case.case_row.case_id for case in new_cases])
+    for syndrome_id in set([case.case_row.syndrome_id for case in new_cases]):
+        globals.notify.notify('syndromecasecount', syndrome_id)
+    for syndrome_id in set([case.case_row.syndrome_id for case in cases]):
+        cached.commit_notify.notify('casedata', syndrome_id)
+
+
 def case_query(credentials, **kwargs):
     """
     Look up a (single) case via kwargs (local_case_id, etc)
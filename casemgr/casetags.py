@@ -158,8 +158,10 @@ class CasesTags(dict):
     producing a dict of Tags indexed by case id.
     """
 
-    def __init__(self, case_ids):
-        query = globals.db.query('case_tags')
+    def __init__(self, case_ids, db=None):
+        if db is None:
+            db = globals.db
+        query = db.query('case_tags')
         query.join('JOIN tags USING (tag_id)')
         query.where_in('case_id', case_ids)
         for case_id, tag in query.fetchcols(('case_id', 'tag')):
@@ -197,11 +199,13 @@ def set_case_tags(case_id, tags):
         query.delete()
     add_tags = tags - cur_tags
     if add_tags:
+        rows = []
         for id in add_tags.ids():
             row = globals.db.new_row('case_tags')
             row.case_id = case_id
             row.tag_id = id
-            row.db_update(refetch=False)
+            rows.append(row)
+        globals.db.update_rows(rows, refetch=False)
     return desc_changes(cur_tags, tags)
 
 
@@ -211,8 +215,10 @@ class CaseTags:
     a list of field edits (desc).
     """
 
-    def __init__(self, case_id):
-        self.initial = self.cur = case_tags(case_id)
+    def __init__(self, case_id, tags=None):
+        if tags is None:
+            tags = case_tags(case_id)
+        self.initial = self.cur = tags
 
     def normalise(self):
         if not isinstance(self.cur, Tags):
@@ -0,0 +1,34 @@
+#
+#   The contents of this file are subject to the HACOS License Version 1.2
+#   (the "License"); you may not use this file except in compliance with
+#   the License.  Software distributed under the License is distributed
+#   on an "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, either express or
+#   implied. See the LICENSE file for the specific language governing
+#   rights and limitations under the License.  The Original Software
+#   is "NetEpi Collection". The Initial Developer of the Original
+#   Software is the Health Administration Corporation, incorporated in
+#   the State of New South Wales, Australia.
+#
+#   Copyright (C) 2004-2011 Health Administration Corporation, Australian
+#   Government Department of Health and Ageing, and others.
+#   All Rights Reserved.
+#
+#   Contributors: See the CONTRIBUTORS file for details of contributions.
+#
+import sys
+from optparse import OptionParser
+from casemgr import caseaccess
+from casemgr import globals
+
+usage = '%prog [options]'
+
+def main(args):
+    optp = OptionParser(usage=usage)
+    options, args = optp.parse_args(args)
+    if args:
+        optp.error('no arguments expected')
+    caseaccess.rebuild(globals.db)
+    globals.db.commit()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
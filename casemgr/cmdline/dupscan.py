@@ -17,6 +17,7 @@
 #   Contributors: See the CONTRIBUTORS file for details of contributions.
 #
 
+import os
 import sys
 from optparse import OptionParser
 
@@ -28,7 +29,7 @@ else:
     psyco.full()
 
 import config
-from casemgr import globals, persondupe
+from casemgr import globals, persondupe, persondupecfg
 from casemgr.notification.client import connect as notify_connect
 from casemgr.cmdline import cmdcommon
 
@@ -38,6 +39,16 @@ def main(args):
     optp = OptionParser(usage=usage)
     cmdcommon.opt_user(optp)
     cmdcommon.opt_verbose(optp)
+    optp.add_option('--stopgram-freq', type='float',
+            default=persondupecfg.PersonDupeCfg.stopgram_freq,
+            help='n-grams appearing in more than this fraction of persons '
+                 'are not used to find candidates (default %default, '
+                 '0 disables)')
+    optp.add_option('--updated', action='store_true',
+            help='only check persons updated since the last scan')
+    optp.add_option('-j', '--jobs', type='int', default=config.dupscan_jobs,
+            help='score candidate pairs using JOBS worker processes '
+                 '(default %default)', metavar='JOBS')
     options, args = optp.parse_args(args)
 
     cred = cmdcommon.user_cred(options)
@@ -46,8 +57,13 @@ def main(args):
                                     config.notification_host,
                                     config.notification_port)
 
+    dupecfg = persondupecfg.new_persondupecfg()
+    dupecfg.stopgram_freq = options.stopgram_freq
+
     try:
-        mp = persondupe.MatchPersons(globals.db, None)
+        mp = persondupe.MatchPersons(globals.db, dupecfg,
+                        updated_only=options.updated, jobs=options.jobs,
+                        index_dir=os.path.join(config.cgi_target, 'db'))
         mp.save(globals.db)
         if options.verbose:
             print mp.stats()
@@ -17,6 +17,7 @@
 #
 import sys, os
 import fnmatch
+import gzip
 
 from optparse import OptionParser
 
@@ -36,7 +37,8 @@ def get_option_parser():
     cmdcommon.opt_outfile(optp)
     cmdcommon.opt_syndrome(optp)
     optp.set_defaults(export_scheme="classic", 
-                      deleted='n', strip_newlines=False)
+                      deleted='n', strip_newlines=False, gzip=False,
+                      colfile=False)
     optp.add_option("-x", "--exclude-deleted", dest="deleted",
             action="store_const", const='n',
             help="exclude deleted records from output")
@@ -52,6 +54,13 @@ def get_option_parser():
     optp.add_option("-S", "--scheme", dest="export_scheme",
             help="export using EXPORTSCHEME, default 'classic'. Use '\\?' "
                  "to see a list of available schemes.", metavar="EXPORTSCHEME")
+    optp.add_option("-z", "--gzip", dest="gzip",
+            action="store_true",
+            help="gzip compress the output as it is written")
+    optp.add_option("-c", "--colfile", dest="colfile",
+            action="store_true",
+            help="write a typed, compressed column file rather than CSV "
+                 "(see cocklebur/colfile.py for the format)")
     return optp
 
 def print_indexed_list(indexed_list):
@@ -69,6 +78,12 @@ def print_export_schemes(es):
     """
 
 
+def gzip_write(write, include_forms, f):
+    gzf = gzip.GzipFile('', 'wb', 6, f)
+    write(include_forms, gzf)
+    gzf.close()
+
+
 def main(args):
     """
     Parse arguments and simulate the use of the export page
@@ -110,8 +125,17 @@ def main(args):
     include_forms = args
 
     # load the data and export
-    cmdcommon.safe_overwrite(options, exporter.csv_write, 
-                             include_forms, cmdcommon.OUTFILE)
+    if options.colfile:
+        if options.gzip:
+            optp.error('--colfile output is already compressed')
+        cmdcommon.safe_overwrite(options, exporter.colfile_write, 
+                                 include_forms, cmdcommon.OUTFILE)
+    elif options.gzip:
+        cmdcommon.safe_overwrite(options, gzip_write, exporter.csv_write,
+                                 include_forms, cmdcommon.OUTFILE)
+    else:
+        cmdcommon.safe_overwrite(options, exporter.csv_write, 
+                                 include_forms, cmdcommon.OUTFILE)
 
 
 if __name__ == '__main__':
@@ -16,14 +16,40 @@
 #   Contributors: See the CONTRIBUTORS file for details of contributions.
 #
 
+"""
+Import cases and persons from XML.
+
+Without --checkpoint, the import is committed once, at the end, so a
+failed import leaves no records behind.
+
+With --checkpoint, records (<Case> elements within <Cases>, or
+<Person> elements within <Persons>) are committed every --commit-every
+records, and the number of records committed by each worker is saved
+to a file. A failed import run again with the same options skips the
+records already imported (they must still be parsed, as parsing cannot
+start mid-document). The checkpoint file is removed when the import
+completes. Every record creates new persons and cases, so intermediate
+commits without a checkpoint would duplicate records on re-import.
+
+With --jobs (which requires --checkpoint), records are dealt in turn
+to worker processes, each with its own database connection. As every
+record creates its own persons and cases, the workers never touch the
+same cases.
+"""
+
 import sys
 import os
 import re
 import time
+import errno
+import select
+import cPickle
+import tempfile
 import optparse
+import traceback
 
 try:
-    from lxml.etree import iterparse, dump
+    from lxml.etree import iterparse, dump, tostring, fromstring
 except ImportError, e:
     sys.exit('required python module "lxml" not found\n   see http://codespeak.net/lxml/\n    %s' % e)
 
@@ -101,7 +127,10 @@ class Ticker:
         self.next = self.n + self.per_second * self.tick_interval
 
     def tick(self):
-        self.n += 1
+        self.update(self.n + 1)
+
+    def update(self, n):
+        self.n = n
         if self.n >= self.next:
             self.report()
 
@@ -139,58 +168,229 @@ def proc_forms(options, synd, case, case_elem):
         edit_form.update()
 
 
-def proc_cases(options, cred, cases):
+def proc_case(options, cred, case_elem):
     """
     Case-based import - single <Person> element contained within each <Case>
     """
-    ticker = Ticker('cases')
-    for case_elem in cases:
-        try:
-            assert_tag(case_elem, 'Case')
-            person_elem = want_elem(case_elem, 'Person')
-            synd = find_syndrome(case_elem.get('syndrome'))
-            case = cases.new_case(cred, synd.syndrome_id)
-            copy_node(person_elem, case.person)
-            case.person.data_src = options.data_src
-            case.update()
-            proc_forms(options, synd, case, case_elem)
-        except Exception, e:
-            dump(case_elem)
-            raise
-            cmdcommon.abort(e)
-        ticker.tick()
-    globals.db.commit()
+    assert_tag(case_elem, 'Case')
+    person_elem = want_elem(case_elem, 'Person')
+    synd = find_syndrome(case_elem.get('syndrome'))
+    case = cases.new_case(cred, synd.syndrome_id)
+    copy_node(person_elem, case.person)
+    case.person.data_src = options.data_src
+    case.update()
+    proc_forms(options, synd, case, case_elem)
 
 
-def proc_persons(options, cred, persons):
+def proc_person(options, cred, person_elem):
     """
     Person-based import - one or more <Case> elements inside a <Cases>
     element inside each <Person>
     """
-    ticker = Ticker('cases')
-    for person_elem in persons:
+    assert_tag(person_elem, 'Person')
+    cases_elem = want_elem(person_elem, 'Cases')
+    person_id = None
+    for case_elem in cases_elem.getchildren():
+        assert_tag(case_elem, 'Case')
+        synd = find_syndrome(case_elem.get('syndrome'))
+        case = cases.new_case(cred, synd.syndrome_id, 
+                              use_person_id=person_id)
+        if person_id is None:
+            copy_node(person_elem, case.person)
+            case.person.data_src = options.data_src
+        case.update()
+        if person_id is None:
+            person_id = case.case_row.person_id
+        proc_forms(options, synd, case, case_elem)
+
+
+def proc_records(options, cred, proc, records, committed):
+    """
+    Import /records/ (elements) using /proc/, committing every
+    options.commit_every records (if set) and at the end, and calling
+    /committed/ with the count of records committed after each commit.
+    """
+    count = 0
+    for elem in records:
         try:
-            assert_tag(person_elem, 'Person')
-            cases_elem = want_elem(person_elem, 'Cases')
-            person_id = None
-            for case_elem in cases_elem.getchildren():
-                assert_tag(case_elem, 'Case')
-                synd = find_syndrome(case_elem.get('syndrome'))
-                case = cases.new_case(cred, synd.syndrome_id, 
-                                      use_person_id=person_id)
-                if person_id is None:
-                    copy_node(person_elem, case.person)
-                    case.person.data_src = options.data_src
-                case.update()
-                if person_id is None:
-                    person_id = case.case_row.person_id
-                proc_forms(options, synd, case, case_elem)
-                ticker.tick()
-        except Exception, e:
-            dump(person_elem)
+            proc(options, cred, elem)
+        except Exception:
+            dump(elem)
             raise
-            cmdcommon.abort(e)
+        count += 1
+        if options.commit_every and count % options.commit_every == 0:
+            globals.db.commit()
+            committed(count)
     globals.db.commit()
+    committed(count)
+
+
+class Checkpoint:
+    """
+    Import progress: the count of records committed by each worker
+    (records are dealt to the workers in turn, and each commits its
+    records in order).
+    """
+
+    def __init__(self, filename, xmlfile, jobs):
+        self.filename = filename
+        st = os.stat(xmlfile)
+        self.file_id = os.path.abspath(xmlfile), st.st_size, st.st_mtime
+        self.jobs = jobs
+        self.done = [0] * jobs
+        if filename and os.path.exists(filename):
+            self.load()
+
+    def load(self):
+        f = open(self.filename, 'rb')
+        try:
+            state = cPickle.load(f)
+        finally:
+            f.close()
+        if state['file_id'] != self.file_id:
+            cmdcommon.abort('checkpoint %r is for a different or changed '
+                            'file: %s' % (self.filename, state['file_id'][0]))
+        if state['jobs'] != self.jobs:
+            cmdcommon.abort('checkpoint %r was written with --jobs=%d' % 
+                            (self.filename, state['jobs']))
+        self.done = state['done']
+
+    def save(self):
+        if not self.filename:
+            return
+        state = dict(file_id=self.file_id, jobs=self.jobs, done=self.done)
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(
+                                            os.path.abspath(self.filename)))
+        f = os.fdopen(fd, 'wb')
+        try:
+            cPickle.dump(state, f, -1)
+            f.close()
+            os.rename(tmpname, self.filename)
+        finally:
+            try:
+                os.unlink(tmpname)
+            except OSError:
+                pass
+
+    def remove(self):
+        if self.filename:
+            try:
+                os.unlink(self.filename)
+            except OSError:
+                pass
+
+    def is_done(self, n):
+        return n // self.jobs < self.done[n % self.jobs]
+
+    def total(self):
+        return sum(self.done)
+
+
+class WorkerPool:
+    """
+    Forked worker processes, each importing the records it is sent (as
+    serialised XML) on its own database connection, and reporting its
+    commits back to the parent.
+    """
+
+    def __init__(self, options, cred, proc, committed):
+        self.committed = committed
+        self.failed = []
+        self.workers = []
+        self.by_fd = {}
+        # The workers must not share our database connection
+        globals.db.close()
+        sys.stdout.flush()
+        for n in range(options.jobs):
+            rec_rfd, rec_wfd = os.pipe()
+            res_rfd, res_wfd = os.pipe()
+            pid = os.fork()
+            if not pid:
+                for pid, rec_f, res_fd in self.workers:
+                    rec_f.close()
+                    os.close(res_fd)
+                os.close(rec_wfd)
+                os.close(res_rfd)
+                self._worker(options, cred, proc, rec_rfd, res_wfd)
+            os.close(rec_rfd)
+            os.close(res_wfd)
+            self.workers.append((pid, os.fdopen(rec_wfd, 'wb'), res_rfd))
+            self.by_fd[res_rfd] = n, ''
+
+    def _read_records(self, f):
+        while True:
+            line = f.readline()
+            if not line:
+                break
+            yield fromstring(f.read(int(line)))
+
+    def _worker(self, options, cred, proc, rec_rfd, res_wfd):
+        status = 1
+        try:
+            try:
+                out = os.fdopen(res_wfd, 'w', 0)
+                def committed(count):
+                    out.write('C %d\n' % count)
+                records = self._read_records(os.fdopen(rec_rfd, 'rb'))
+                proc_records(options, cred, proc, records, committed)
+                status = 0
+            except:
+                traceback.print_exc()
+        finally:
+            os._exit(status)
+
+    def send(self, n, elem):
+        """
+        Send record /n/ to its worker
+        """
+        pid, rec_f, res_fd = self.workers[n % len(self.workers)]
+        data = tostring(elem)
+        try:
+            rec_f.write('%d\n' % len(data))
+            rec_f.write(data)
+        except IOError, e:
+            if e.errno != errno.EPIPE:
+                raise
+            # The worker has died - it will be reaped below
+        self.poll(0)
+        return not self.failed
+
+    def poll(self, timeout=None):
+        if not self.by_fd:
+            return
+        ready, ignore, ignore = select.select(self.by_fd.keys(), [], [], 
+                                              timeout)
+        for fd in ready:
+            n, buf = self.by_fd[fd]
+            data = os.read(fd, 4096)
+            if not data:
+                del self.by_fd[fd]
+                os.close(fd)
+                pid = self.workers[n][0]
+                status = os.waitpid(pid, 0)[1]
+                if status:
+                    self.failed.append(n)
+                continue
+            lines = (buf + data).split('\n')
+            self.by_fd[fd] = n, lines.pop()
+            for line in lines:
+                fields = line.split()
+                if fields[0] == 'C':
+                    self.committed(n, int(fields[1]))
+
+    def finish(self):
+        """
+        Wait for the workers to import the records sent, returning the
+        list of workers that failed.
+        """
+        for pid, rec_f, res_fd in self.workers:
+            try:
+                rec_f.close()
+            except IOError:
+                pass
+        while self.by_fd:
+            self.poll()
+        return self.failed
 
 
 def main(args):
@@ -202,33 +402,83 @@ def main(args):
     cmdcommon.opt_user(optp)
     optp.add_option('-d', '--data-src', default='xmlimport',
                     help='Set data source to DATA_SRC')
+    optp.add_option('-j', '--jobs', type='int', default=1,
+            help='import using JOBS worker processes (requires '
+                 '--checkpoint, default %default)',
+            metavar='JOBS')
+    optp.add_option('--commit-every', type='int', 
+            help='with --checkpoint, commit every N records (default 500)',
+            metavar='N')
+    optp.add_option('-c', '--checkpoint', metavar='FILENAME',
+            help='record progress in FILENAME, and resume from it if it '
+                 'exists')
     options, args = optp.parse_args(args)
 
     try:
         xmlfile, = args
     except ValueError:
         optp.error('exactly 1 argument needed')
+    if options.checkpoint:
+        if options.commit_every is None:
+            options.commit_every = 500
+        if options.commit_every < 1:
+            optp.error('--commit-every must be at least 1')
+    elif options.commit_every is not None:
+        optp.error('--commit-every requires --checkpoint')
+    elif options.jobs != 1:
+        optp.error('--jobs requires --checkpoint')
+    if options.jobs < 1:
+        optp.error('--jobs must be at least 1')
 
     cred = cmdcommon.user_cred(options)
 
     find_syndrome = SyndromeCache(options.syndrome).find_syndrome
 
-    context = iter(iterparse(open(xmlfile), events=('start','end')))
-    event, root = context.next()
+    checkpoint = Checkpoint(options.checkpoint, xmlfile, options.jobs)
+    if checkpoint.total():
+        print 'Resuming after %d records imported' % checkpoint.total()
 
-    def yield_nodes(nodename):
-        for event, elem in context:
-            if event == 'end' and elem.tag == nodename:
-                yield elem
-                root.clear()
+    context = iter(iterparse(open(xmlfile, 'rb'), events=('start','end')))
+    event, root = context.next()
 
     if root.tag == 'Cases':
-        proc_cases(options, cred, yield_nodes('Case'))
+        rec_tag, proc = 'Case', proc_case
     elif root.tag == 'Persons':
-        proc_persons(options, cred, yield_nodes('Person'))
+        rec_tag, proc = 'Person', proc_person
     else:
         cmdcommon.abort('Root of XML tree is not a <Cases> tag nor <Persons> tag')
 
+    def yield_records():
+        # Record numbers, and elements of records not yet imported
+        n = 0
+        for event, elem in context:
+            if event == 'end' and elem.tag == rec_tag:
+                if not checkpoint.is_done(n):
+                    yield n, elem
+                n += 1
+                root.clear()
+
+    ticker = Ticker('records')
+    base = list(checkpoint.done)
+    def committed(worker, count):
+        checkpoint.done[worker] = base[worker] + count
+        checkpoint.save()
+        ticker.update(checkpoint.total())
+
+    if options.jobs == 1:
+        records = yield_records()
+        proc_records(options, cred, proc, (elem for n, elem in records),
+                     lambda count: committed(0, count))
+    else:
+        pool = WorkerPool(options, cred, proc, committed)
+        for n, elem in yield_records():
+            if not pool.send(n, elem):
+                break
+        if pool.finish():
+            cmdcommon.abort('import worker failed (%d records imported)' % 
+                            checkpoint.total())
+    checkpoint.remove()
+
 
 if __name__ == '__main__':
     main(sys.argv[1:])
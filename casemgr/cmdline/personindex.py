@@ -16,10 +16,13 @@
 #   Contributors: See the CONTRIBUTORS file for details of contributions.
 #
 import sys, os
+from optparse import OptionParser
 from casemgr import fuzzyperson
 from casemgr import globals
 
-def main(args):
+usage = '%prog [options]'
+
+def per_person():
     curs = globals.db.cursor()
     try:
         curs.execute('SELECT person_id, surname, given_names FROM persons')
@@ -36,6 +39,32 @@ def main(args):
             last_pc = pc
         fuzzyperson.update(globals.db, person_id, surname, given_names)
     print ' %d of %d 100%% done' % (i+1, rowcnt)
+
+def bulk():
+    curs = globals.db.cursor()
+    try:
+        curs.execute('SELECT count(*) FROM persons')
+        rowcnt, = curs.fetchone()
+    finally:
+        curs.close()
+    fuzzyperson.phonetic_cache.prewarm(globals.db)
+    def progress(i, codes):
+        pc = i * 100 / max(rowcnt, 1)
+        sys.stdout.write(' %d of %d %2d%% done\r' % (i, rowcnt, pc))
+        sys.stdout.flush()
+    codes = fuzzyperson.rebuild(globals.db, progress)
+    print ' %d of %d 100%% done, %d codes' % (rowcnt, rowcnt, codes)
+
+def main(args):
+    optp = OptionParser(usage=usage)
+    optp.add_option('--per-person', action='store_true',
+            help='update persons one at a time, rather than rebuilding the '
+                 'index as a new table (slow, but does not lock the index)')
+    options, args = optp.parse_args(args)
+    if options.per_person:
+        per_person()
+    else:
+        bulk()
     globals.db.commit()
 
 if __name__ == '__main__':
@@ -24,18 +24,26 @@ multiple instances of the forms. Form instances can also be associated
 with different versions of the form definition.
 """
 
+import sys
 import time
 import csv
 import re
+import Queue
+try:
+    import threading
+except ImportError:
+    threading = None
 try:
     set
 except NameError:
     from sets import Set as set
 from mx import DateTime
-from cocklebur import form_ui, dbobj
+from cocklebur import form_ui, dbobj, colfile
 from cocklebur.filename_safe import filename_safe
 from casemgr import globals, caseaccess, syndrome, casetags
 
+import config
+
 ctrlre = re.compile(r'[\000-\037]+')
 
 ISO_fmt = '%Y-%m-%d %H:%M:%S'
@@ -56,6 +64,22 @@ def value_format(value, strip_newlines=False):
     return value
 
 
+def column_kind(col_type):
+    """
+    The cocklebur.colfile column kind for a dbobj column type
+    """
+    if issubclass(col_type, dbobj.BooleanColumn):
+        return 'bool'
+    elif issubclass(col_type, (dbobj.IntColumn, dbobj.ReferenceColumn)):
+        return 'int'
+    elif issubclass(col_type, dbobj.FloatColumn):
+        return 'float'
+    elif issubclass(col_type, (dbobj.DateColumn, dbobj.DatetimeColumn)):
+        return 'date'
+    else:
+        return 'str'
+
+
 class Forms:
 
     """
@@ -81,12 +105,15 @@ class Forms:
 
 class FormFormatterBase:
 
+    # If True, values are not formatted (for typed exports)
+    raw = False
+
     def __init__(self, form_name, strip_newlines):
         self.form_name = form_name
         self.strip_newlines = strip_newlines
         self.columns = ['form_id', 'form_date']
+        self.column_kinds = {'form_id': 'str', 'form_date': 'date'}
         self.columns_seen = set(self.ignore)
-        self.clear()
         self.table_map = {}
         self.form_count_by_case = {}
         self.form_versions = set()
@@ -103,27 +130,38 @@ class FormFormatterBase:
         form = globals.formlib.load(self.form_name, version)
         self.table_map[version] = form.table
         for col in form.columns:
+            kind = column_kind(col.type)
+            if self.column_kinds.setdefault(col.name, kind) != kind:
+                # Type differs between form versions
+                self.column_kinds[col.name] = 'str'
             if col.name not in self.columns_seen:
                 self.columns.append(col.name)
                 self.columns_seen.add(col.name)
 
-    def clear(self):
-        self.form_by_summ_id = {}
-
-    def preload(self, db, version, summary_ids):
+    def fetch(self, db, version, summary_ids, form_by_summ_id):
         query = db.query(self.table_map[version])
         query.where_in('summary_id', summary_ids)
         for row in query.fetchdict():
             summary_id = row['summary_id']
             row['form_id'] = form_ui.form_id(summary_id)
-            self.form_by_summ_id[summary_id] = row
+            form_by_summ_id[summary_id] = row
+
+    def blank(self):
+        if self.raw:
+            return None
+        return ''
 
     def row_format(self, row):
         if row is None:
-            return [''] * len(self.columns)
+            return [self.blank()] * len(self.columns)
+        if self.raw:
+            return [row.get(col) for col in self.columns]
         return [value_format(row.get(col), self.strip_newlines)
                 for col in self.columns]
 
+    def row_kinds(self):
+        return [self.column_kinds.get(col, 'str') for col in self.columns]
+
 
 form_row_formatters = {}
 
@@ -142,12 +180,15 @@ class FormFormatterClassic(FormFormatterBase):
                     for inst in range(self.form_count)
                     for col in self.columns]
 
-    def col_values(self, summ_ids):
+    def col_kinds(self):
+        return self.row_kinds() * self.form_count
+
+    def col_values(self, summ_ids, form_by_summ_id):
         values = []
         for i in range(self.form_count):
             row = None
             if i < len(summ_ids):
-                row = self.form_by_summ_id.get(summ_ids[i][1])
+                row = form_by_summ_id.get(summ_ids[i][1])
             values.extend(self.row_format(row))
         return values
 
@@ -172,15 +213,18 @@ class FormFormatterDoHA(FormFormatterBase):
                     labels.append('%s%d' % (col, i))
         return labels
 
-    def col_values(self, summ_ids):
+    def col_kinds(self):
+        return (['str', 'int'] + self.row_kinds()) * self.form_count
+
+    def col_values(self, summ_ids, form_by_summ_id):
         values = []
         for i in range(self.form_count):
             values.append(self.form_name)
             row = None
             if i < len(summ_ids):
-                row = self.form_by_summ_id.get(summ_ids[i][1])
+                row = form_by_summ_id.get(summ_ids[i][1])
             if row is None:
-                values.append('')
+                values.append(self.blank())
             else:
                 values.append(summ_ids[i][0])
             values.extend(self.row_format(row))
@@ -198,9 +242,12 @@ class FormFormatterForm(FormFormatterBase):
             self.add_form_columns(form_version)
         return ['%s.%s' % (self.form_name, col) for col in self.columns]
 
-    def col_values(self, summ_ids):
+    def col_kinds(self):
+        return self.row_kinds()
+
+    def col_values(self, summ_ids, form_by_summ_id):
         for form_version, summ_id in summ_ids:
-            yield self.row_format(self.form_by_summ_id.get(summ_id))
+            yield self.row_format(form_by_summ_id.get(summ_id))
 
 form_row_formatters['form'] = FormFormatterForm
 
@@ -214,6 +261,7 @@ class RowFormatterBase(object):
         self.fetch_cols = ('cases.*', 'persons.*')
         self.form_formatter = form_row_formatters[format]
         self.strip_newlines = strip_newlines
+        self.raw = False
 
     def seen_form(self, id, form_name, form_version):
         try:
@@ -242,22 +290,41 @@ class RowFormatterBase(object):
     def set_include_forms(self, include_forms):
         self.include_forms = include_forms
 
-    def preload(self, db, cases):
+    def set_raw(self, raw):
+        """
+        If /raw/ is True, rows() returns typed values rather than
+        strings (for colfile exports).
+        """
+        self.raw = raw
+        for form in self.forms_by_name.values():
+            form.raw = raw
+
+    def format_value(self, value):
+        if self.raw:
+            return value
+        return value_format(value, self.strip_newlines)
+
+    def fetch(self, db, cases):
+        """
+        Fetch the case, tag and form data for a chunk of cases (this may
+        be called from a prefetch thread, with its own /db/).
+        """
+        chunk = ExportChunk(cases)
         id_idx = self.case_cols.index('case_id')
         query = db.query('cases')
         query.join('JOIN persons USING (person_id)')
         query.where_in('case_id', [case.id for case in cases])
-        self.cases = {}
         for row in query.fetchcols(self.case_cols):
-            self.cases[row[id_idx]] = row
-        self.cases_tags = casetags.CasesTags(self.cases.keys())
+            chunk.cases[row[id_idx]] = row
+        chunk.cases_tags = casetags.CasesTags(chunk.cases.keys(), db)
         for name in self.include_forms:
-            self.forms_by_name[name].clear()
+            chunk.forms[name] = {}
         formvers_summids = ExportCase.summid_by_form_version(cases, 
                                                              self.include_forms)
         for (form_name, form_version), summ_ids in formvers_summids:
             form = self.forms_by_name[form_name]
-            form.preload(db, form_version, summ_ids)
+            form.fetch(db, form_version, summ_ids, chunk.forms[form_name])
+        return chunk
 
     def col_labels(self, db):
         self._get_case_cols(db)
@@ -267,21 +334,39 @@ class RowFormatterBase(object):
             labels.extend(self.forms_by_name[name].col_labels())
         return labels
 
+    def col_kinds(self, db):
+        """
+        The colfile kinds of the columns (call after col_labels)
+        """
+        tables = db.get_table('cases'), db.get_table('persons')
+        kinds = []
+        for name in self.case_cols:
+            for table_desc in tables:
+                col_desc = table_desc.columns_by_name.get(name)
+                if col_desc is not None:
+                    kinds.append(column_kind(col_desc.__class__))
+                    break
+            else:
+                kinds.append('str')
+        kinds.append('str')             # tags
+        for name in self.include_forms:
+            kinds.extend(self.forms_by_name[name].col_kinds())
+        return kinds
+
 
 row_formatters = {}
 
 class RowPerCaseFormatter(RowFormatterBase):
 
-    def rows(self, cases):
-        for case in cases:
-            values = [value_format(value, self.strip_newlines)
-                      for value in self.cases[case.id]]
-            values.append(str(self.cases_tags.get(case.id, '')))
+    def rows(self, chunk):
+        for case in chunk.export_cases:
+            values = map(self.format_value, chunk.cases[case.id])
+            values.append(str(chunk.cases_tags.get(case.id, '')))
             summid_by_form = case.summid_by_form()
             for name in self.include_forms:
                 form_fmt = self.forms_by_name[name]
                 summids = summid_by_form.get(form_fmt.form_name, [])
-                values.extend(form_fmt.col_values(summids))
+                values.extend(form_fmt.col_values(summids, chunk.forms[name]))
             yield values
 
 
@@ -297,16 +382,16 @@ class RowPerFormFormatter(RowFormatterBase):
             raise globals.Error('Must select one (and only one) form')
         self.include_forms = include_forms
 
-    def rows(self, cases):
+    def rows(self, chunk):
         assert len(self.include_forms) == 1
-        form_fmt = self.forms_by_name[self.include_forms[0]]
-        for case in cases:
-            case_cols = [value_format(value, self.strip_newlines)
-                         for value in self.cases[case.id]]
-            case_cols.append(str(self.cases_tags.get(case.id, '')))
+        name = self.include_forms[0]
+        form_fmt = self.forms_by_name[name]
+        for case in chunk.export_cases:
+            case_cols = map(self.format_value, chunk.cases[case.id])
+            case_cols.append(str(chunk.cases_tags.get(case.id, '')))
             summid_by_form = case.summid_by_form()
             summids = summid_by_form.get(form_fmt.form_name, [])
-            for form_cols in form_fmt.col_values(summids):
+            for form_cols in form_fmt.col_values(summids, chunk.forms[name]):
                 yield case_cols + form_cols
 
 row_formatters['form'] = RowPerFormFormatter
@@ -342,11 +427,92 @@ class ExportCase:
     summid_by_form_version = staticmethod(summid_by_form_version)
 
 
+class ExportChunk:
+    """
+    The case rows, tags and form rows (by form name, then summary_id)
+    fetched for a chunk of ExportCases.
+    """
+    def __init__(self, export_cases):
+        self.export_cases = export_cases
+        self.cases = {}
+        self.cases_tags = {}
+        self.forms = {}
+
+
+def fetch_chunks(db, row_formatter, chunks):
+    for cases in chunks:
+        yield row_formatter.fetch(db, cases)
+
+
+def _prefetch_chunks(db, row_formatter, chunks, queue, stop):
+    """
+    Prefetch thread: fetch chunks on /db/ and queue them, until done
+    or /stop/ is set.
+    """
+    def put(item):
+        while not stop.isSet():
+            try:
+                queue.put(item, True, 1)
+            except Queue.Full:
+                continue
+            return True
+        return False
+    try:
+        try:
+            for chunk in fetch_chunks(db, row_formatter, chunks):
+                if not put((chunk, None)):
+                    return
+        except:
+            put((None, sys.exc_info()))
+            return
+        put((None, None))
+    finally:
+        db.rollback()
+        db.close()
+
+
+class ChunkPrefetcher:
+    """
+    Iterate over fetched chunks, fetching up to /depth/ chunks ahead on
+    a second database connection in a background thread, so the
+    database is working while the caller formats the current chunk.
+
+    If the caller abandons the iteration, the thread is stopped when
+    this object is garbage collected (the thread does not refer to it).
+    """
+    def __init__(self, row_formatter, chunks, depth):
+        self.queue = Queue.Queue(depth)
+        self.stop = threading.Event()
+        thread = threading.Thread(target=_prefetch_chunks,
+                                  args=(globals.db.new_connection(),
+                                        row_formatter, chunks,
+                                        self.queue, self.stop))
+        thread.setDaemon(True)
+        thread.start()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        chunk, exc_info = self.queue.get()
+        if exc_info is not None:
+            self.stop.set()
+            raise exc_info[0], exc_info[1], exc_info[2]
+        if chunk is None:
+            raise StopIteration
+        return chunk
+
+    def __del__(self):
+        self.stop.set()
+
+
 class ExportCases:
     """
     This class records info about relevent cases, and returns them in
     bite-sized chunks.
     """
+    chunksize = 1000
+
     def __init__(self):
         self.cases_in_order = []
         self.cases_by_id = {}
@@ -361,7 +527,9 @@ class ExportCases:
         if summary_id is not None:
             export_case.add_summ_id(summary_id, form_name, form_version)
 
-    def yield_chunks(self, chunksize=1000):
+    def yield_chunks(self, chunksize=None):
+        if chunksize is None:
+            chunksize = self.chunksize
         i = 0
         while i < len(self.cases_in_order):
             yield self.cases_in_order[i:i+chunksize]
@@ -393,7 +561,7 @@ class CaseExporter:
         self.export_cases = ExportCases()
         row_formatter_cls = row_formatters[self.format]
         self.row_formatter = row_formatter_cls(self.format, self.strip_newlines)
-        rows = query.fetchcols(('cases.case_id', 
+        rows = query.yieldcols(('cases.case_id', 
                                 'summary_id', 'form_label', 'form_version'))
         for case_id, summary_id, form_name, form_version in rows:
             self.export_cases.add_summ_id(case_id, summary_id,
@@ -417,17 +585,62 @@ class CaseExporter:
         return 'nec-%s-%s.csv' % (syndrome_name,
                                  time.strftime('%Y%m%d-%H%M'))
 
+    def fetch_chunks(self):
+        chunks = self.export_cases.yield_chunks()
+        if (config.export_prefetch and threading is not None
+                and len(self.export_cases) > self.export_cases.chunksize):
+            return ChunkPrefetcher(self.row_formatter, chunks,
+                                   config.export_prefetch)
+        return fetch_chunks(globals.db, self.row_formatter, chunks)
+
     def row_gen(self, include_forms):
         self.row_formatter.set_include_forms(include_forms)
         yield self.row_formatter.col_labels(globals.db)
-        for cases in self.export_cases.yield_chunks():
-            self.row_formatter.preload(globals.db, cases)
-            for row in self.row_formatter.rows(cases):
+        for chunk in self.fetch_chunks():
+            for row in self.row_formatter.rows(chunk):
                 yield row
 
+    def export_parts(self, include_forms):
+        """
+        Return a list of functions, each returning the rows of one part
+        of the export: the column labels, then each chunk of cases. The
+        first must be called before the others, as it prepares the
+        formatters.
+        """
+        self.row_formatter.set_include_forms(include_forms)
+        def labels():
+            return [self.row_formatter.col_labels(globals.db)]
+        def chunk_part(cases):
+            def rows():
+                chunk = self.row_formatter.fetch(globals.db, cases)
+                return self.row_formatter.rows(chunk)
+            return rows
+        parts = [labels]
+        for cases in self.export_cases.yield_chunks():
+            parts.append(chunk_part(cases))
+        return parts
+
     def csv_write(self, include_forms, f):
         csv.writer(f).writerows(self.row_gen(include_forms))
 
+    def colfile_write(self, include_forms, f):
+        """
+        Write the export as a typed, compressed column file (see
+        cocklebur.colfile), a row group per chunk of cases.
+        """
+        row_formatter = self.row_formatter
+        row_formatter.set_include_forms(include_forms)
+        row_formatter.set_raw(True)
+        try:
+            labels = row_formatter.col_labels(globals.db)
+            kinds = row_formatter.col_kinds(globals.db)
+            writer = colfile.ColumnFileWriter(f, zip(labels, kinds))
+            for chunk in self.fetch_chunks():
+                writer.write_rows(list(row_formatter.rows(chunk)))
+            writer.close()
+        finally:
+            row_formatter.set_raw(False)
+
 
 class ContactExporter:
 
@@ -448,18 +661,38 @@ class ContactExporter:
         return 'nec-contacts-%s-%s.csv' % (syndrome_name,
                                  time.strftime('%Y%m%d-%H%M'))
 
-    def row_gen(self, include_forms):
-        yield 'id_a', 'id_b', 'contact_type', 'contact_date'
+    labels = 'id_a', 'id_b', 'contact_type', 'contact_date'
+    cols = 'case_id', 'contact_id', 'contact_type', 'contact_date'
+    kinds = 'int', 'int', 'str', 'date'
+
+    def query(self):
         query = globals.db.query('case_contacts')
         query.join('JOIN cases USING (case_id)')
         query.join('LEFT JOIN contact_types USING (contact_type_id)')
         query.where('case_id < contact_id')
         caseaccess.acl_query(query, self.credentials, deleted=self.deleted)
-        cols = 'case_id', 'contact_id', 'contact_type', 'contact_date'
-        for row in query.fetchcols(cols):
+        return query
+
+    def row_gen(self, include_forms):
+        yield self.labels
+        for row in self.query().yieldcols(self.cols):
             if row[-1]:
                 row = row[:-1] + (row[-1].strftime(ISO_fmt),)
             yield row
 
+    def export_parts(self, include_forms):
+        return [lambda: self.row_gen(include_forms)]
+
     def csv_write(self, include_forms, f):
         csv.writer(f).writerows(self.row_gen(include_forms))
+
+    def colfile_write(self, include_forms, f, chunksize=1000):
+        writer = colfile.ColumnFileWriter(f, zip(self.labels, self.kinds))
+        rows = []
+        for row in self.query().yieldcols(self.cols):
+            rows.append(row)
+            if len(rows) >= chunksize:
+                writer.write_rows(rows)
+                rows = []
+        writer.write_rows(rows)
+        writer.close()
@@ -48,6 +48,8 @@ class ImportErrors:
     def __init__(self):
         self.nerrors = 0
         self.errors = {None: []}
+        self.col_counts = {}
+        self.limited = False
 
     def __nonzero__(self):
         return bool(self.nerrors)
@@ -62,7 +64,12 @@ class ImportErrors:
     def count(self):
         return self.nerrors
 
-    def error(self, msg, recnum=None, row=None):
+    def error(self, msg, recnum=None, row=None, col=None):
+        # Once the limit is reached, further errors are not recorded
+        if self.limited:
+            return
+        if col is not None:
+            self.col_error(col)
         self.nerrors += 1
         if row:
             recnum = row.record_num
@@ -73,8 +80,25 @@ class ImportErrors:
         if self.nerrors == self.MAX_ERRORS:
             self.errors[None].insert(0, 'More than %d errors, giving up' % 
                                         self.MAX_ERRORS)
+            self.limited = True
             raise TooManyErrors
 
+    def col_error(self, col):
+        """
+        Count an error against column (or group) /col/
+        """
+        if self.limited:
+            return
+        self.col_counts[col] = self.col_counts.get(col, 0) + 1
+
+    def col_errors(self):
+        """
+        A list of (column, error count), most errors first
+        """
+        col_errors = [(-count, col) for col, count in self.col_counts.items()]
+        col_errors.sort()
+        return [(col, -count) for count, col in col_errors]
+
     def __contains__(self, recnum=None):
         return recnum in self.errors
 
@@ -215,14 +239,15 @@ class DemogGroup(GroupBase):
                 elif col_proc.entity == 'case_row':
                     col_proc.set(case.case_row, value)
             except catch_errors, e:
-                importer.error('%s: %s' % (col_proc.label, e), row=row)
+                importer.error('%s: %s' % (col_proc.label, e), row=row,
+                               col=col_proc.label)
 
     def validate(self, importer, case, row):
         try:
             case.validate()
             return True
         except catch_errors, e:
-            importer.error(e, row=row)
+            importer.error(e, row=row, col=self.label)
             return False
 
     def update(self, importer, case, row):
@@ -236,10 +261,13 @@ class DemogGroup(GroupBase):
     def headings(self):
         return [col_proc.label for col_proc in self.col_procs]
 
-    def preview(self, importer, case, row):
-        ns = NS(case=case)
+    def check(self, importer, case, row):
         self.apply(importer, case, row)
         self.validate(importer, case, row)
+        return NS(case=case)
+
+    def preview(self, importer, case, row):
+        ns = self.check(importer, case, row)
         preview = []
         for col_proc in self.col_procs:
             try:
@@ -259,12 +287,14 @@ class FormGroup(GroupBase):
         self.version = self.formdataimp.form.cur_version
         form = globals.formlib.load(self.name, self.version)
         self.col_procs = []
+        self.input_labels = {}
         for input in form.get_inputs():
+            label = input.label or input.column
+            self.input_labels[input.column] = label
             try:
                 rule = form_rules[input.column]
             except KeyError:
                 continue
-            label = input.label or input.column
             try:
                 method = None
                 args = {
@@ -298,12 +328,16 @@ class FormGroup(GroupBase):
             try:
                 col_proc.set(ns, col_proc.get(row))
             except catch_errors, e:
-                importer.error('%s: %s' % (col_proc.label, e), row=row)
+                importer.error('%s: %s' % (col_proc.label, e), row=row,
+                               col=col_proc.label)
 
     def validate(self, importer, ns, row):
         form = globals.formlib.load(self.name, self.version)
         form_errors = form.validate(ns)
         if form_errors:
+            for column in form_errors.by_input:
+                importer.errors.col_error(self.input_labels.get(column, 
+                                                                column))
             for error in form_errors.in_order:
                 importer.error('%s: %s' % (self.label, error), row=row)
             return False
@@ -328,10 +362,14 @@ class FormGroup(GroupBase):
     def headings(self):
         return [col_proc.label for col_proc in self.col_procs]
 
-    def preview(self, importer, case, row):
+    def check(self, importer, case, row):
         ns = NS()
         self.apply(importer, ns, row)
         self.validate(importer, ns, row)
+        return ns
+
+    def preview(self, importer, case, row):
+        ns = self.check(importer, case, row)
         return [col_proc.outtrans(ns) for col_proc in self.col_procs]
 
 
@@ -362,34 +400,79 @@ class ImportBase(object):
     def error(self, msg, **kw):
         self.errors.error(msg, **kw)
 
+    def set_status(self):
+        self.status = ('Loaded %d records, updated %d, created %d' %
+                        (self.update_cnt + self.new_cnt,
+                         self.update_cnt, self.new_cnt)) 
+        if self.importrules.conflicts == 'duplicate' and self.conflict_cnt:
+            self.status += ' (%s duplicates created)' % self.conflict_cnt
 
-class PreviewImport(ImportBase):
 
-    def __init__(self, credentials, syndrome_id, dataimp_src, importrules):
+class PreviewImport(ImportBase):
+    """
+    Check every row of the source, but only render the page of
+    /page_size/ rows starting at /offset/. The rows checked, and the
+    errors per column, are counted. If the error limit is reached, the
+    remaining rows are counted (and the page rendered), but not checked,
+    and /checked_rows/ is the number of rows that were.
+    """
+
+    page_size = 50
+
+    def __init__(self, credentials, syndrome_id, dataimp_src, importrules,
+                 offset=0):
         ImportBase.__init__(self, syndrome_id, dataimp_src, importrules)
         self.rows = []
         self.header = []
         self.group_header = []
+        self.offset = offset
+        self.n_rows = 0
+        self.checked_rows = None
         if self.errors:
             return
         for group in self.groups:
             self.group_header.append((group.label, len(group)))
             self.header.extend(group.headings())
         self.n_cols = len(self.header)
+        end = offset + self.page_size
+        # Rows are not imported, so one throwaway case serves for them all
+        case = cases.new_case(credentials, self.syndrome_id,
+                              defer_case_id=True)
         try:
             for row in self.dataimp_rows:
-                case = cases.new_case(credentials, self.syndrome_id,
-                                      defer_case_id=True)
-                row_pp = []
-                for group in self.groups:
-                    row_pp.extend(group.preview(self, case, row))
-                self.rows.append(row_pp)
-        except TooManyErrors:
-            pass
+                in_page = offset <= self.n_rows < end
+                if in_page or self.checked_rows is None:
+                    try:
+                        row_pp = self.check_row(case, row, in_page)
+                    except TooManyErrors:
+                        self.checked_rows = self.n_rows + 1
+                        if in_page:
+                            row_pp = self.check_row(case, row, in_page)
+                    if in_page:
+                        self.rows.append(row_pp)
+                self.n_rows += 1
         except Error, e:
             # For aborting errors
             self.error(e)
 
+    def check_row(self, case, row, preview):
+        # Clear the values applied from the previous row
+        case.case_row.db_revert()
+        case.person.db_revert()
+        row_pp = []
+        for group in self.groups:
+            if preview:
+                row_pp.extend(group.preview(self, case, row))
+            else:
+                group.check(self, case, row)
+        return row_pp
+
+    def has_prev(self):
+        return self.offset > 0
+
+    def has_next(self):
+        return self.offset + self.page_size < self.n_rows
+
 
 def locked_case_ids(credentials, syndrome_id, dataimp_src, importrules):
     importer = ImportBase(syndrome_id, dataimp_src, importrules)
@@ -450,12 +533,124 @@ class DataImp(ImportBase):
                 if dup_person_id is not None:
                     persondupe.conflict(dup_person_id, case.person.person_id)
                     self.conflict_cnt += 1
-            self.status = ('Loaded %d records, updated %d, created %d' %
-                            (self.update_cnt + self.new_cnt,
-                             self.update_cnt, self.new_cnt)) 
-            if self.importrules.conflicts == 'duplicate' and self.conflict_cnt:
-                self.status += ' (%s duplicates created)' % self.conflict_cnt
+            self.set_status()
+        except TooManyErrors:
+            pass
+        except Error, e:
+            self.error(e)
+
+
+class BulkDataImp(ImportBase):
+    """
+    As for DataImp, but rows are processed in chunks: the existing cases
+    for a chunk are found with one query, and their persons and forms
+    loaded and written with batched statements, rather than a query per
+    row. Rows are applied and validated, and errors reported, as for
+    DataImp. As an import with errors is not committed, nothing further
+    is written once an error has been reported.
+    """
+
+    chunksize = 500
+
+    def __init__(self, credentials, syndrome_id, dataimp_src, importrules):
+        ImportBase.__init__(self, syndrome_id, dataimp_src, importrules)
+        if self.errors:
+            return
+        self.credentials = credentials
+        self.update_cnt = self.new_cnt = self.conflict_cnt = 0
+        try:
+            chunk = []
+            chunk_keys = set()
+            for row in self.dataimp_rows:
+                key = None
+                if self.key_proc is not None:
+                    key = self.key_proc.get(row)
+                    # A case must be written before it is seen again
+                    if key is not None and key in chunk_keys:
+                        self.import_chunk(chunk)
+                        chunk = []
+                        chunk_keys = set()
+                    chunk_keys.add(key)
+                chunk.append((row, key))
+                if len(chunk) >= self.chunksize:
+                    self.import_chunk(chunk)
+                    chunk = []
+                    chunk_keys = set()
+            if chunk:
+                self.import_chunk(chunk)
+            self.set_status()
         except TooManyErrors:
             pass
         except Error, e:
             self.error(e)
+
+    def existing_cases(self, keys):
+        found = {}
+        if keys:
+            query = globals.db.query('cases')
+            query.where('syndrome_id = %s', self.syndrome_id)
+            query.where_in('local_case_id', keys)
+            caseaccess.acl_query(query, self.credentials, deleted=None)
+            for case in cases.edit_cases(self.credentials, query.fetchall()):
+                found.setdefault(case.case_row.local_case_id, []).append(case)
+        return found
+
+    def import_chunk(self, chunk):
+        found = self.existing_cases([key for row, key in chunk
+                                     if key is not None])
+        imported = []
+        for row, key in chunk:
+            case = None
+            dup_person_id = None
+            found_cases = found.get(key, [])
+            if len(found_cases) > 1:
+                self.error('%r %s is not unique' % (self.key_proc.label, key),
+                           row=row)
+                continue
+            if found_cases:
+                case = found_cases[0]
+            if (case is not None 
+                    and case.person.data_src != self.importrules.srclabel):
+                if self.importrules.conflicts == 'duplicate':
+                    dup_person_id = case.person.person_id
+                    case = None
+                else:
+                    self.locked_cases.append(key)
+                    continue
+            if case is None:
+                case = cases.new_case(self.credentials, self.syndrome_id,
+                                      defer_case_id=True)
+                case.person.data_src = self.importrules.srclabel
+                self.new_cnt += 1
+            else:
+                self.update_cnt += 1
+            self.demog_group.apply(self, case, row)
+            if self.demog_group.validate(self, case, row):
+                try:
+                    case.assert_not_viewonly()
+                except catch_errors, e:
+                    self.error(e, row=row)
+            imported.append((row, case, dup_person_id))
+        group_forms = []
+        for group in self.groups[1:]:
+            edit_forms = group.formdataimp.edit_many(
+                [case.case_row.case_id for row, case, dup in imported])
+            for (row, case, dup), edit_form in zip(imported, edit_forms):
+                group.apply(self, edit_form.instance_row, row)
+                group.validate(self, edit_form.instance_row, row)
+            group_forms.append((group, edit_forms))
+        if self.errors:
+            return
+        try:
+            cases.update_many([case for row, case, dup in imported])
+            for group, edit_forms in group_forms:
+                for (row, case, dup), edit_form in zip(imported, edit_forms):
+                    edit_form.case_id = case.case_row.case_id
+                group.formdataimp.update_many(edit_forms)
+        except catch_errors, e:
+            # The transaction is unusable after a database error
+            raise Error(str(e))
+        for row, case, dup_person_id in imported:
+            if dup_person_id is not None:
+                persondupe.conflict(dup_person_id, case.person.person_id)
+                self.conflict_cnt += 1
@@ -196,10 +196,22 @@ class Preview:
     def colvalues(self, colname):
         colvalues = self.colvalues_by_col.get(colname.lower())
         if colvalues:
-            colvalues = list(colvalues)
+            colvalues = colvalues.keys()
             colvalues.sort()
         return colvalues
 
+    def colhistogram(self, colname):
+        """
+        A list of (value, count) for the column, most frequent first, or
+        None if the column has too many distinct values
+        """
+        colvalues = self.colvalues_by_col.get(colname.lower())
+        if colvalues is None:
+            return None
+        histogram = [(-count, value) for value, count in colvalues.items()]
+        histogram.sort()
+        return [(value, -count) for count, value in histogram]
+
     def colpreview(self, colname):
         if self.col_names:
             try:
@@ -212,6 +224,10 @@ class Preview:
 
 
 class SrcPreview(Preview):
+    """
+    Stream through the source once, keeping the first 16 rows, and the
+    count of each distinct value of each column (up to 200 values).
+    """
 
     def __init__(self, datasrc_rows):
         Preview.__init__(self)
@@ -223,14 +239,14 @@ class SrcPreview(Preview):
                     try:
                         colvalues = self.colvalues_by_col[colname]
                     except KeyError:
-                        colvalues = self.colvalues_by_col[colname] = set()
+                        colvalues = self.colvalues_by_col[colname] = {}
                     if colvalues is not None:
                         if len(colvalues) > 200:
                             self.colvalues_by_col[colname] = None
                         else:
                             value = row.fields[i].strip()
                             if value and len(value) < 100:
-                                colvalues.add(value)
+                                colvalues[value] = colvalues.get(value, 0) + 1
             self.n_rows = datasrc_rows.n_rows
             self.n_cols = datasrc_rows.n_cols
             self.col_names = datasrc_rows.col_names
@@ -297,6 +297,20 @@ class EditField(object):
             preview = preview[:15]
         return preview
 
+    def preview_counts(self, dataimp_src):
+        """
+        As for preview(), but (value, count) tuples, most frequent first
+        (the count is None if the column has too many distinct values)
+        """
+        src_col = getattr(self.selected, 'src', None)
+        if not src_col:
+            return []
+        histogram = dataimp_src.preview.colhistogram(src_col)
+        if not histogram:
+            histogram = [(value, None) 
+                         for value in dataimp_src.preview.colpreview(src_col)]
+        return histogram[:15]
+
     def get_missing_field_options(self, colvalues=None):
         want = set()
         for value, label in self.field_options:
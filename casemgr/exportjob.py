@@ -0,0 +1,341 @@
+#
+#   The contents of this file are subject to the HACOS License Version 1.2
+#   (the "License"); you may not use this file except in compliance with
+#   the License.  Software distributed under the License is distributed
+#   on an "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, either express or
+#   implied. See the LICENSE file for the specific language governing
+#   rights and limitations under the License.  The Original Software
+#   is "NetEpi Collection". The Initial Developer of the Original
+#   Software is the Health Administration Corporation, incorporated in
+#   the State of New South Wales, Australia.
+#
+#   Copyright (C) 2004-2011 Health Administration Corporation, Australian
+#   Government Department of Health and Ageing, and others.
+#   All Rights Reserved.
+#
+#   Contributors: See the CONTRIBUTORS file for details of contributions.
+#
+"""
+Background export jobs.
+
+Rather than running within the web request, a large export can be queued
+as a job, which is run by a detached worker process (in the same way as
+the duplicate person scan). The results are spooled to disk for later
+download.
+
+Each job has a directory in the spool directory containing:
+
+    info            pickled job summary (owner, file name, part count)
+    export          pickled ExportSelect (exporter, case list and forms)
+    NNNNNN.gz       one gzip member per part of the export: the column
+                    labels, then each chunk of cases
+    error           the error message, if the job failed
+    done            present once all parts have been written
+    lock            locked by the running worker
+
+Each part is written to a temporary file and renamed into place, so a job
+that is interrupted can be resumed from the first missing part. A gzip
+file may contain several members, so the parts are simply concatenated
+to produce the download. Workers publish their progress via "exportjob"
+notifications.
+"""
+
+import os
+import re
+import sys
+import csv
+import time
+import gzip
+import fcntl
+import shutil
+import cPickle
+import tempfile
+import traceback
+
+from cocklebur import daemonize
+from casemgr import globals
+
+import config
+
+
+class ExportJobError(globals.Error): pass
+
+job_id_re = re.compile(r'^job-[0-9]{8}-[0-9]{6}-[A-Za-z0-9_]+$')
+
+# Progress of running jobs, from "exportjob" notifications
+job_progress = {}
+subscribed = False
+
+def progress_event(job_id, done, total):
+    job_progress[job_id] = int(done), int(total)
+
+def progress_subscribe():
+    global subscribed
+    if not subscribed:
+        subscribed = True
+        globals.notify.subscribe('exportjob', progress_event)
+
+def progress_notify(job_id, done, total):
+    globals.notify.notify('exportjob', job_id, done, total)
+
+
+def spool_dir():
+    path = config.export_spool_dir
+    if not path:
+        path = os.path.join(config.cgi_target, 'db', 'exports')
+    if not os.path.isdir(path):
+        os.makedirs(path, 0700)
+    return path
+
+
+def _dump(filename, obj):
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(filename))
+    f = os.fdopen(fd, 'wb')
+    try:
+        cPickle.dump(obj, f, -1)
+        f.close()
+        os.rename(tmpname, filename)
+    finally:
+        try:
+            os.unlink(tmpname)
+        except OSError:
+            pass
+
+
+def _load(filename):
+    f = open(filename, 'rb')
+    try:
+        return cPickle.load(f)
+    finally:
+        f.close()
+
+
+def _write_part(filename, rows):
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(filename))
+    f = os.fdopen(fd, 'wb')
+    try:
+        gzf = gzip.GzipFile('', 'wb', 6, f)
+        csv.writer(gzf).writerows(rows)
+        gzf.close()
+        f.close()
+        os.rename(tmpname, filename)
+    finally:
+        try:
+            os.unlink(tmpname)
+        except OSError:
+            pass
+
+
+class ExportJob:
+
+    def __init__(self, job_id):
+        if not job_id_re.match(job_id):
+            raise ExportJobError('Invalid export job %r' % job_id)
+        self.job_id = job_id
+        self.path = os.path.join(spool_dir(), job_id)
+        try:
+            info = _load(self._filename('info'))
+        except (IOError, EOFError, cPickle.UnpicklingError):
+            raise ExportJobError('Export job not found')
+        self.user_id = info['user_id']
+        self.filename = info['filename']
+        self.created = info['created']
+        self.part_count = info['part_count']
+
+    def _filename(self, name):
+        return os.path.join(self.path, name)
+
+    def part_filename(self, n):
+        return self._filename('%06d.gz' % n)
+
+    def part_filenames(self):
+        return [self.part_filename(n) for n in range(self.part_count)]
+
+    def lock(self):
+        """
+        Returns a locked file descriptor, or None if another worker is
+        running the job.
+        """
+        fd = os.open(self._filename('lock'), os.O_RDWR | os.O_CREAT, 0600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            os.close(fd)
+            return None
+        return fd
+
+    def is_running(self):
+        fd = self.lock()
+        if fd is None:
+            return True
+        os.close(fd)
+        return False
+
+    def is_done(self):
+        return os.path.exists(self._filename('done'))
+
+    def error(self):
+        try:
+            f = open(self._filename('error'))
+        except IOError:
+            return None
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def parts_done(self):
+        done = 0
+        for filename in self.part_filenames():
+            if os.path.exists(filename):
+                done += 1
+        return done
+
+    def status(self):
+        if self.is_done():
+            return 'done'
+        if self.is_running():
+            return 'running'
+        if self.error():
+            return 'failed'
+        return 'interrupted'
+
+    def status_desc(self):
+        status = self.status()
+        if status == 'done':
+            return 'Complete'
+        if status == 'failed':
+            return 'Failed: %s' % self.error()
+        done = job_progress.get(self.job_id, (0, 0))[0]
+        done = max(done, self.parts_done())
+        pc = done * 100 / self.part_count
+        if status == 'running':
+            return 'Running, %d%% complete' % pc
+        return 'Interrupted at %d%%' % pc
+
+    def created_desc(self):
+        return time.strftime('%Y-%m-%d %H:%M', time.localtime(self.created))
+
+    def size(self):
+        size = 0
+        for filename in self.part_filenames():
+            try:
+                size += os.path.getsize(filename)
+            except OSError:
+                pass
+        return size
+
+    def run(self):
+        """
+        Write any missing parts of the export (in this process).
+        """
+        fd = self.lock()
+        if fd is None:
+            return
+        try:
+            try:
+                os.unlink(self._filename('error'))
+            except OSError:
+                pass
+            try:
+                exportsel = _load(self._filename('export'))
+                parts = exportsel.export_parts()
+                assert len(parts) == self.part_count
+                for n, part in enumerate(parts):
+                    filename = self.part_filename(n)
+                    exists = os.path.exists(filename)
+                    # The first part (column labels) also prepares the
+                    # formatters, so it is always run.
+                    if n == 0 or not exists:
+                        rows = part()
+                        if not exists:
+                            _write_part(filename, rows)
+                    # Don't hold a transaction open for the whole export
+                    globals.db.rollback()
+                    progress_notify(self.job_id, n + 1, self.part_count)
+                open(self._filename('done'), 'w').close()
+            except Exception, e:
+                traceback.print_exc(None, sys.stderr)
+                globals.db.rollback()
+                f = open(self._filename('error'), 'w')
+                try:
+                    f.write(str(e) or e.__class__.__name__)
+                finally:
+                    f.close()
+        finally:
+            os.close(fd)
+
+    def start(self):
+        """
+        Run the job in a detached worker process.
+        """
+        # The forked child must not share our connection to the database.
+        globals.db.close()
+        if daemonize.daemonize():
+            return
+        # Nor our notification connection - reading from it would take
+        # events meant for the web worker.
+        globals.notify.reset()
+        try:
+            print >> sys.stderr, '%s: export job %s started' %\
+                (config.appname, self.job_id)
+            self.run()
+        finally:
+            os._exit(0)
+
+    def delete(self):
+        if self.is_running():
+            raise ExportJobError('Export job is running')
+        shutil.rmtree(self.path, True)
+
+
+def new_job(credentials, exportsel):
+    """
+    Queue an export job for the current ExportSelect parameters
+    (the caller should then start() it).
+    """
+    part_count = len(exportsel.export_parts())
+    prefix = time.strftime('job-%Y%m%d-%H%M%S-')
+    path = tempfile.mkdtemp(prefix=prefix, dir=spool_dir())
+    _dump(os.path.join(path, 'export'), exportsel)
+    info = dict(user_id=credentials.user.user_id,
+                filename=exportsel.filename() + '.gz',
+                created=time.time(),
+                part_count=part_count)
+    _dump(os.path.join(path, 'info'), info)
+    return ExportJob(os.path.basename(path))
+
+
+def user_job(credentials, job_id):
+    job = ExportJob(job_id)
+    if job.user_id != credentials.user.user_id:
+        raise ExportJobError('Export job not found')
+    return job
+
+
+def user_jobs(credentials):
+    """
+    The export jobs of this user, most recent first. Jobs older than
+    config.export_spool_days are deleted.
+    """
+    progress_subscribe()
+    globals.notify.poll()
+    expire = time.time() - config.export_spool_days * 86400
+    jobs = []
+    for job_id in os.listdir(spool_dir()):
+        try:
+            job = ExportJob(job_id)
+        except ExportJobError:
+            # Not a job, or creation did not complete
+            path = os.path.join(spool_dir(), job_id)
+            if (job_id_re.match(job_id)
+                    and os.path.getmtime(path) < expire):
+                shutil.rmtree(path, True)
+            continue
+        if job.created < expire and not job.is_running():
+            job.delete()
+        elif job.user_id == credentials.user.user_id:
+            jobs.append((job.created, job))
+    jobs.sort()
+    jobs.reverse()
+    return [job for created, job in jobs]
@@ -86,8 +86,14 @@ class ExportSelect:
     def filename(self):
         return self.exporter.filename()
 
-    def row_gen(self):
+    def _include_forms(self):
         include_forms = self.include_forms
         if not isinstance(include_forms, list):
             include_forms = [include_forms]
-        return self.exporter.row_gen(include_forms)
+        return include_forms
+
+    def row_gen(self):
+        return self.exporter.row_gen(self._include_forms())
+
+    def export_parts(self):
+        return self.exporter.export_parts(self._include_forms())
@@ -33,13 +33,22 @@ def instance_summary(form, instance_row):
     return '; '.join(form.collect_summary(instance_row))
 
 
+def data_notify(case_id):
+    """
+    The forms of a case have changed, send notification
+    """
+    query = globals.db.query('cases')
+    query.where('case_id = %s', case_id)
+    cached.commit_notify.notify('casedata', query.aggregate('syndrome_id'))
+
+
 class EditForm(object):
     """
     Represents an active edit of a case form (corresponds to a row in the
     summary and form instance tables).
     """
     def __init__(self, case_id, form, summary=None, 
-                 data_src=None, force_multiple=False):
+                 data_src=None, force_multiple=False, instance_row=None):
         self.case_id = case_id
         self.name = form.name
         self.label = form.label
@@ -59,9 +68,11 @@ class EditForm(object):
             self.deleted = summary.deleted
             self.delete_reason = summary.delete_reason
             self.delete_timestamp = summary.delete_timestamp
-        form = self.get_form_ui()
-        self.instance_row = form_ui.load_form_data(globals.db, form, 
-                                                   self.summary_id)
+        if instance_row is None:
+            form = self.get_form_ui()
+            instance_row = form_ui.load_form_data(globals.db, form, 
+                                                  self.summary_id)
+        self.instance_row = instance_row
 
     def get_form_data(self):
         return self.instance_row
@@ -162,6 +173,7 @@ class EditForm(object):
             self.instance_row.form_date = summary_row.form_date
         was_new = self.instance_row.is_new()
         self.instance_row.db_update()
+        data_notify(self.case_id)
         task_info = dict(form_name=self.label, 
                          summary_id=self.summary_id, 
                          is_new=was_new)
@@ -179,6 +191,7 @@ class EditForm(object):
                      delete, reason, timestamp)
         globals.db.commit()
         self.deleted = delete
+        data_notify(self.case_id)
 
     def task_info(self):
         return dict(form_name=self.label, 
@@ -237,6 +250,7 @@ class FormDataImp:
     def __init__(self, syndrome_id, label, data_src):
         assert data_src
         self.form = _getform(label, syndrome_id)
+        self.syndrome_id = syndrome_id
         self.data_src = data_src
 
     def edit(self, case_id):
@@ -258,6 +272,100 @@ class FormDataImp:
                                  force_multiple=True)
         return edit_form, edit_form.get_form_data()
 
+    def edit_many(self, case_ids):
+        """
+        As for edit(), for a list of case_ids (None for new cases), but
+        loading existing forms with a query each, rather than a query
+        per case. Returns a list of EditForms.
+        """
+        form = globals.formlib.load(self.form.label, self.form.cur_version)
+        summaries = {}
+        query = globals.db.query('case_form_summary', order_by='summary_id')
+        query.where_in('case_id', [case_id for case_id in case_ids 
+                                   if case_id is not None])
+        query.where('form_label = %s', self.form.label)
+        query.where('data_src = %s', self.data_src)
+        query.where('NOT deleted')
+        for summary in query.fetchall():
+            summaries.setdefault(summary.case_id, summary)
+        instance_rows = {}
+        query = globals.db.query(form.table)
+        query.where_in('summary_id', [summary.summary_id 
+                                      for summary in summaries.values()])
+        for instance_row in query.fetchall():
+            instance_rows[instance_row.summary_id] = instance_row
+        defaults = form.get_defaults()
+        edit_forms = []
+        for case_id in case_ids:
+            summary = summaries.get(case_id)
+            instance_row = None
+            if summary is not None:
+                instance_row = instance_rows.get(summary.summary_id)
+            if instance_row is None:
+                instance_row = globals.db.new_row(form.table, **defaults)
+            if summary is None:
+                edit_form = EditForm(case_id, self.form, None, 
+                                     data_src=self.data_src, 
+                                     force_multiple=True,
+                                     instance_row=instance_row)
+            else:
+                edit_form = EditForm(case_id, self.form, summary, 
+                                     force_multiple=True,
+                                     instance_row=instance_row)
+            edit_forms.append(edit_form)
+        return edit_forms
+
+    def update_many(self, edit_forms):
+        """
+        Write a list of (validated) EditForms from edit_many() as their
+        update() methods would, but batching statements (the case_id of
+        forms for new cases must be set first).
+        """
+        if not edit_forms:
+            return
+        if config.form_rollforward:
+            query = globals.db.query('forms', for_update=True)
+            query.where('label = %s', self.form.label)
+            deployed_version = query.aggregate('cur_version')
+            if deployed_version != self.form.cur_version:
+                raise globals.ReviewForm('The definition of the %r form was'
+                                         ' changed during the import' %
+                                         self.form.name)
+        form = globals.formlib.load(self.form.label, self.form.cur_version)
+        summary_rows = {}
+        query = globals.db.query('case_form_summary', for_update=True)
+        query.where_in('summary_id', [edit_form.summary_id 
+                                      for edit_form in edit_forms
+                                      if edit_form.summary_id is not None])
+        for summary_row in query.fetchall():
+            summary_rows[summary_row.summary_id] = summary_row
+        rows = []
+        for edit_form in edit_forms:
+            summary_row = summary_rows.get(edit_form.summary_id)
+            if summary_row is None:
+                summary_row = globals.db.new_row('case_form_summary')
+                summary_row.form_label = edit_form.label
+                summary_row.case_id = edit_form.case_id
+            summary_row.form_version = edit_form.version
+            summary_row.data_src = edit_form.data_src
+            instance_row = edit_form.instance_row
+            if instance_row.form_date:
+                summary_row.form_date = instance_row.form_date
+            summary_row.summary = instance_summary(form, instance_row)
+            rows.append(summary_row)
+        # New summaries are refetched with their summary_id
+        globals.db.update_rows(rows)
+        for edit_form, summary_row in zip(edit_forms, rows):
+            instance_row = edit_form.instance_row
+            if edit_form.summary_id is None:
+                edit_form.summary_id = summary_row.summary_id
+                instance_row.summary_id = summary_row.summary_id
+            if not instance_row.form_date:
+                instance_row.form_date = summary_row.form_date
+        globals.db.update_rows([edit_form.instance_row 
+                                for edit_form in edit_forms])
+        cached.commit_notify.notify('casedata', self.syndrome_id)
+
 
 class FormSummary:
     """
@@ -17,22 +17,71 @@
 #
 import string
 import itertools
+try:
+    set
+except NameError:
+    from sets import Set as set
 
+import config
 from cocklebur import dbobj
+from cocklebur.lrucache import LRUCache
 from casemgr.nickcache import get_nicks
 from casemgr.phonetic_encode import dmetaphone
 
 
 transmap = string.maketrans('-,', '  ')
 
+def name_words(field):
+    return field.lower().translate(transmap).split()
+
+
+class PhoneticCache(LRUCache):
+    """
+    Memo of double metaphone encodings of (normalised) name words.
+    """
+    def encode(self, word):
+        try:
+            return self[word]
+        except KeyError:
+            code = self[word] = dmetaphone(word)
+            return code
+
+    def prewarm(self, db, count=None):
+        """
+        Encode the words of the /count/ most common surnames and given
+        names (and their nicknames).
+        """
+        if count is None:
+            count = config.phonetic_cache_prewarm
+        if not count:
+            return
+        words = set()
+        curs = db.cursor()
+        try:
+            for col in ('surname', 'given_names'):
+                dbobj.execute(curs, 'SELECT %s FROM persons'
+                                    ' WHERE %s IS NOT NULL'
+                                    ' GROUP BY %s ORDER BY count(*) DESC'
+                                    ' LIMIT %%s' % (col, col, col), (count,))
+                for name, in curs.fetchall():
+                    words.update(name_words(name))
+        finally:
+            curs.close()
+        for nicks in get_nicks(words):
+            for nick in nicks:
+                self.encode(nick)
+
+phonetic_cache = PhoneticCache(config.phonetic_cache_size)
+
+
 def encode_phones(*fields):
+    encode = phonetic_cache.encode
     word_phones = []
     for field in fields:
         if field:
-            words = field.lower().translate(transmap).split()
-            wordnicks = get_nicks(words)
+            wordnicks = get_nicks(name_words(field))
             for nicks in wordnicks:
-                word_phones.append([dmetaphone(nick) for nick in nicks])
+                word_phones.append([encode(nick) for nick in nicks])
     return word_phones
 
 
@@ -47,6 +96,97 @@ def update(db, person_id, *names):
     finally:
         curs.close()
 
+def _yield_phonetics(rows):
+    for person_id, surname, given_names in rows:
+        for mp in itertools.chain(*encode_phones(surname, given_names)):
+            yield person_id, mp
+
+
+def update_many(db, rows):
+    """
+    As for update(), for a list of (person_id, surname, given_names)
+    """
+    if not rows:
+        return
+    query = db.query('person_phonetics')
+    query.where_in('person_id', [row[0] for row in rows])
+    query.delete()
+    curs = db.cursor()
+    try:
+        dbobj.copy_rows(curs, 'person_phonetics', ('person_id', 'phonetics'),
+                        _yield_phonetics(rows))
+    finally:
+        curs.close()
+
+
+def rebuild(db, progress=None):
+    """
+    Rebuild the person_phonetics table from scratch.
+
+    Encodings are computed in a single streaming pass over the persons
+    table and bulk loaded into a new table, which replaces
+    person_phonetics when the caller commits. Persons updated while the
+    rebuild was running are re-encoded after the swap. /progress/, if
+    given, is called with the count of persons read and encodings
+    loaded after each chunk.
+    """
+    curs = db.cursor()
+    try:
+        dbobj.execute(curs, 'SELECT CURRENT_TIMESTAMP')
+        started, = curs.fetchone()
+        dbobj.execute(curs, 'CREATE TABLE person_phonetics_new'
+                            ' (LIKE person_phonetics) WITH OIDS')
+        dbobj.execute(curs, 'DECLARE phonetics_persons NO SCROLL CURSOR FOR'
+                            ' SELECT person_id, surname, given_names'
+                            ' FROM persons')
+        load_curs = db.cursor()
+        persons = count = 0
+        try:
+            while True:
+                dbobj.execute(curs, 'FETCH 10000 FROM phonetics_persons')
+                rows = curs.fetchall()
+                if not rows:
+                    break
+                count += dbobj.copy_rows(load_curs, 'person_phonetics_new',
+                                         ('person_id', 'phonetics'),
+                                         _yield_phonetics(rows))
+                persons += len(rows)
+                if progress is not None:
+                    progress(persons, count)
+        finally:
+            load_curs.close()
+        dbobj.execute(curs, 'CLOSE phonetics_persons')
+        for name, col in (('pp_person_id_idx', 'person_id'),
+                          ('pp_phonetics_idx', 'phonetics')):
+            dbobj.execute(curs, 'CREATE INDEX %s_new'
+                                ' ON person_phonetics_new (%s)' % (name, col))
+        # Readers and writers of the old table are only blocked from here
+        # until commit.
+        dbobj.execute(curs, 'LOCK TABLE person_phonetics'
+                            ' IN ACCESS EXCLUSIVE MODE')
+        dbobj.execute(curs, 'DELETE FROM person_phonetics_new'
+                            ' WHERE person_id NOT IN'
+                                ' (SELECT person_id FROM persons)')
+        dbobj.execute(curs, 'ALTER TABLE person_phonetics_new'
+                            ' ADD CONSTRAINT person_phonetics_person_id_fkey'
+                            ' FOREIGN KEY (person_id) REFERENCES persons'
+                            ' ON DELETE CASCADE')
+        dbobj.execute(curs, 'DROP TABLE person_phonetics')
+        dbobj.execute(curs, 'ALTER TABLE person_phonetics_new'
+                            ' RENAME TO person_phonetics')
+        for name in ('pp_person_id_idx', 'pp_phonetics_idx'):
+            dbobj.execute(curs, 'ALTER INDEX %s_new RENAME TO %s' % 
+                                (name, name))
+        dbobj.execute(curs, 'SELECT person_id, surname, given_names'
+                            ' FROM persons WHERE last_update >= %s',
+                      (started,))
+        for person_id, surname, given_names in curs.fetchall():
+            update(db, person_id, surname, given_names)
+    finally:
+        curs.close()
+    return count
+
+
 def find(query, *names):
     for name in names:
         if name and dbobj.is_wild(name):
@@ -27,7 +27,10 @@ __all__ = 'db', 'formlib'
 # Application globals
 dbobj.execute_debug(config.tracedb)
 db = dbobj.get_db(os.path.join(config.cgi_target, 'db'), config.dsn)
-formlib = form_ui.FormLibXMLDB(db, 'form_defs')
+form_cache_dir = None
+if config.form_cache:
+    form_cache_dir = os.path.join(config.cgi_target, 'db')
+formlib = form_ui.FormLibXMLDB(db, 'form_defs', cache_dir=form_cache_dir)
 remote_host = None
 notify = dummy_notification_client()
 
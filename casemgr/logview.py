@@ -46,6 +46,7 @@ class LogColumns:
 
 class LogView(paged_search.SortablePagedSearch):
     table = 'user_log'
+    keyset = True
 
     def __init__(self, prefs, title, 
                  user_id=None, case_id=None):
@@ -59,6 +59,9 @@ class dummy_notification_client:
     def subscribe(self, event, callback):
         return False
 
+    def reset(self):
+        pass
+
 
 class notification_client(SocketCore):
 
@@ -73,6 +76,16 @@ class notification_client(SocketCore):
         self.sent_subscriptions = set()
         self.poll()
 
+    def reset(self):
+        """
+        Drop the daemon connection, so it is re-established (and
+        subscriptions resent) on next use - a preforking parent calls
+        this so each worker makes its own connection.
+        """
+        self.close()
+        self.wrbuf = self.rdbuf = ''
+        self.sent_subscriptions = set()
+
     def proc_line(self, line):
         words = line.split()
         if words[0] == '!':
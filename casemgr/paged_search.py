@@ -17,6 +17,7 @@
 #
 
 # Standard Lib
+import re
 import time
 try:
     set
@@ -212,7 +213,126 @@ class PagedSearch(Pager):
         return rows
 
 
+order_re = re.compile(r'^(?:(\w+)\.)?(\w+)(?:\s+(ASC|DESC))?$', re.I)
+
+def keyset_order(table_desc, order_by):
+    """
+    Parse /order_by/ into a list of (column, descending) tuples, adding
+    the primary key columns so the ordering is unique. Returns None if the
+    order refers to anything other than plain columns of the table.
+    """
+    table = table_desc.name
+    pkey_cols = ['%s.%s' % (table, col.name)
+                 for col in table_desc.get_primary_cols()]
+    if not pkey_cols:
+        return None
+    if not order_by:
+        order_by = []
+    elif type(order_by) in (str, unicode):
+        order_by = order_by.split(',')
+    order = []
+    for term in order_by:
+        match = order_re.match(term.strip())
+        if match is None:
+            return None
+        qual, name, direction = match.groups()
+        if qual and qual.lower() != table:
+            return None
+        try:
+            table_desc.get_column(name)
+        except KeyError:
+            return None
+        desc = direction is not None and direction.upper() == 'DESC'
+        order.append(('%s.%s' % (table, name.lower()), desc))
+    cols = [col for col, desc in order]
+    for col in pkey_cols:
+        if col not in cols:
+            order.append((col, False))
+    return order
+
+
+def seek_expr(table_desc, order, boundary):
+    """
+    Returns an SQL expression and args selecting the rows that follow a
+    row with /order/ column values /boundary/. NULLs sort last ascending
+    and first descending, as they do in PostgreSQL. Other values are
+    read back from the boundary row while it exists, as some types
+    (timestamps) lose precision in the round trip.
+    """
+    table = table_desc.name
+    pkey_cols = ['%s.%s' % (table, col.name)
+                 for col in table_desc.get_primary_cols()]
+    cols = [col for col, desc in order]
+    pkey = [boundary[cols.index(col)] for col in pkey_cols]
+    pkey_expr = ' AND '.join(['%s = %%s' % col for col in pkey_cols])
+    terms, args = [], []
+    prefix, prefix_args = [], []
+    for (col, desc), value in zip(order, boundary):
+        if value is None:
+            if desc:
+                after, after_args = '%s IS NOT NULL' % col, []
+            else:
+                after = None
+            equal, equal_args = '%s IS NULL' % col, []
+        else:
+            if col in pkey_cols:
+                ref, ref_args = '%s', [value]
+            else:
+                ref = 'COALESCE((SELECT %s FROM %s WHERE %s), %%s)' %\
+                        (col, table, pkey_expr)
+                ref_args = pkey + [value]
+            if desc:
+                after = '%s < %s' % (col, ref)
+            else:
+                after = '(%s > %s OR %s IS NULL)' % (col, ref, col)
+            after_args = ref_args
+            equal, equal_args = '%s = %s' % (col, ref), ref_args
+        if after:
+            terms.append('(%s)' % ' AND '.join(prefix + [after]))
+            args.extend(prefix_args + after_args)
+        prefix.append(equal)
+        prefix_args.extend(equal_args)
+    if not terms:
+        return 'False', []
+    return '(%s)' % ' OR '.join(terms), args
+
+
+def keyset_page_pkeys(query, order, boundaries, page, page_len):
+    """
+    Returns the primary keys of page /page/ of /query/ in keyset /order/,
+    seeking past the nearest known preceding page boundary. /boundaries/
+    maps page numbers to the ordering values of the last row of the
+    previous page, and is updated with the boundary of the next page.
+    """
+    table_desc = query.table_desc
+    start = max([p for p in boundaries if p <= page] or [1])
+    query = query.copy()
+    if start > 1:
+        query.where(*seek_expr(table_desc, order, boundaries[start]))
+    query.order_by = [col + (desc and ' DESC' or '') for col, desc in order]
+    query.limit = page_len
+    query.offset = (page - start) * page_len
+    pkey_cols = ['%s.%s' % (table_desc.name, col.name)
+                 for col in table_desc.get_primary_cols()]
+    npkey = len(pkey_cols)
+    rows = query.fetchcols(pkey_cols + [col for col, desc in order])
+    if len(rows) == page_len:
+        boundaries[page + 1] = rows[-1][npkey:]
+    return [row[:npkey] for row in rows]
+
+
 class SortablePagedSearch(PagedSearch):
+    # In keyset mode, rather than fetching and retaining every matching
+    # key, only the ordering values of the last row of each page visited
+    # are kept, and a page is fetched by seeking past the preceding
+    # boundary (from the nearest known boundary, with OFFSET, when jumping
+    # ahead). The result count is only queried when needed. This requires
+    # the query to be ordered by columns of its table and not return
+    # duplicate rows - otherwise the search falls back to fetching keys.
+    keyset = False
+    keyset_page = None
+    keyset_pkeys = None
+    total = None
 
     def __init__(self, db, prefs, query=None, title=None):
         if query is not None:
@@ -223,6 +343,23 @@ class SortablePagedSearch(PagedSearch):
         self.order_by = self.query.order_by
         self.fetch_pkeys(self.query)
 
+    def new_search(self):
+        PagedSearch.new_search(self)
+        self.boundaries = {}
+        self.total = None
+        self.keyset_page = None
+        self.keyset_pkeys = None
+
+    def __len__(self):
+        if self.keyset_pkeys is not None:
+            return self.result_count()
+        return PagedSearch.__len__(self)
+
+    def keyset_order(self):
+        if not self.keyset or self.query.distinct or self.query.group_by:
+            return None
+        return keyset_order(self.query.table_desc, self.order_by)
+
     def set_order_by(self, order_by):
         if order_by.endswith('_desc'):
             order_by = order_by[:-len('_desc')] + ' DESC'
@@ -230,26 +367,66 @@ class SortablePagedSearch(PagedSearch):
         self.reset()
 
     def result_count(self):
+        if self.keyset_pkeys is not None:
+            if self.total is None:
+                self.total = 0
+                query = self.query.copy()
+                query.order_by = None
+                try:
+                    self.total = query.aggregate('count(*)')
+                except dbobj.DatabaseError, e:
+                    self.db.rollback()
+                    self.set_error(e)
+            return self.total
         if self.pkeys is None:
             self.fetch_pkeys(self.query)
+            if self.keyset_pkeys is not None:
+                return self.result_count()
         return PagedSearch.result_count(self)
 
     def page_pkeys(self):
         if self.order_by != self.query.order_by:
             self.query.order_by = self.order_by
+            self.boundaries = {}
+            self.keyset_pkeys = None
             self.fetch_pkeys(self.query)
+        elif self.keyset_pkeys is not None:
+            if self.keyset_page != self.cur_page():
+                self.fetch_pkeys(self.query)
+            return self.keyset_pkeys
         elif self.pkeys is None:
             # Refresh
             self.fetch_pkeys(self.query)
+        if self.keyset_pkeys is not None:
+            return self.keyset_pkeys
         return PagedSearch.page_pkeys(self)
 
+    def fetch_keyset_page(self, query, order):
+        st = time.time()
+        page = self.cur_page()
+        pkeys = keyset_page_pkeys(query, order, self.boundaries,
+                                  page, self.page_length())
+        if page == 1:
+            self.empty = not pkeys
+            if self.empty:
+                self.set_error('Nothing found')
+                self.total = 0
+        self.keyset_page = page
+        self.keyset_pkeys = pkeys
+        self.search_time = time.time() - st
+
     def fetch_pkeys(self, query):
         try:
-            PagedSearch.fetch_pkeys(self, query)
+            order = self.keyset_order()
+            if order is None:
+                PagedSearch.fetch_pkeys(self, query)
+            else:
+                self.fetch_keyset_page(query, order)
         except dbobj.DatabaseError, e:
             self.db.rollback()
             self.set_error(e)
             self.pkeys = []
+            self.keyset_pkeys = None
 
 
 def push_pager(ctx, pager):
@@ -306,23 +306,32 @@ class EditPerson(Person):
         finally:
             self.__dbrow.db_revert()
 
-    def db_update(self):
+    def _db_update_start(self):
+        # Returns the row to be written, and whether the names changed
         do_fuzzy_update = (self.surname != self.__dbrow.surname or 
                            self.given_names != self.__dbrow.given_names)
         self._copy_attrs(self, self.__dbrow)
+        return self.__dbrow, do_fuzzy_update
+
+    def _db_update_done(self):
+        self._copy_attrs(self.__dbrow, self)
+        self.DOB_edit = agelib.from_db(self)
+
+    def db_update(self):
+        dbrow, do_fuzzy_update = self._db_update_start()
         try:
-            self.__dbrow.db_update()
+            dbrow.db_update()
         except dbobj.RecordDeleted:
             raise dbobj.RecordDeleted('%s has been deleted (or merged) by another user' % config.person_label)
-        self._copy_attrs(self.__dbrow, self)
-        self.DOB_edit = agelib.from_db(self)
+        self._db_update_done()
         if do_fuzzy_update:
-            fuzzyperson.update(self.__dbrow.db(), self.person_id,
+            fuzzyperson.update(dbrow.db(), self.person_id,
                                self.surname, self.given_names)
 
     def db_revert(self):
         self.__dbrow.db_revert()
         self._copy_attrs(self.__dbrow, self)
+        self.DOB_edit = agelib.from_db(self)
 
     def db_delete(self):
         self.__dbrow.db_delete()
@@ -364,6 +373,38 @@ def edit_id(person_id):
     return person
 
 
+def update_many(persons):
+    """
+    Write a list of EditPersons as their db_update() methods would, but
+    batching statements. A person listed more than once is written once.
+    """
+    unique = []
+    seen = set()
+    for person in persons:
+        if id(person) not in seen:
+            seen.add(id(person))
+            unique.append(person)
+    persons = unique
+    dbrows = []
+    fuzzy = []
+    for person in persons:
+        dbrow, do_fuzzy_update = person._db_update_start()
+        dbrows.append(dbrow)
+        fuzzy.append(do_fuzzy_update)
+    try:
+        globals.db.update_rows(dbrows)
+    except dbobj.RecordDeleted:
+        raise dbobj.RecordDeleted('%s has been deleted (or merged) by '
+                                  'another user' % config.person_label)
+    names = []
+    for person, do_fuzzy_update in zip(persons, fuzzy):
+        person._db_update_done()
+        if do_fuzzy_update:
+            names.append((person.person_id, person.surname,
+                          person.given_names))
+    fuzzyperson.update_many(globals.db, names)
+
+
 def edit_new(seed_person=None):
     """
     Returns a new Person object for editing, optionally filled with fields from
@@ -20,14 +20,19 @@ from __future__ import division
 
 import os, sys
 import math
+import select
+import signal
+import traceback
 from time import time
+from array import array
+from bisect import bisect_right
 try:
     set
 except NameError:
     from sets import Set as set
 
 from cocklebur import dbobj, daemonize, datetime
-from casemgr import globals, persondupecfg
+from casemgr import globals, persondupecfg, persondupeindex
 from casemgr.persondupestat import DupeRunning, dupescan_notify
 
 #    These are the status values currently used:
@@ -37,8 +42,149 @@ STATUS_CONFLICT = 'C'   # import conflict
 
 uncertain = 0.5 # XXX somewhat of a fudge
 
+class NGramIndex(object):
+    """
+    Inverted index of n-gram postings for one NGram matcher group.
+
+    Each distinct n-gram is given a small integer id, and the postings
+    for that id are an array of member ordinals (in ascending order).
+    The n-gram ids of each member are held in one flat array, sliced
+    by /offsets/. This is much more compact than per-member tuples of
+    strings and per-n-gram lists of objects.
+
+    N-grams that appear in more than /stopgram_freq/ of the members (for
+    example " SM" or "SON") are "stop-grams", and are not used to generate
+    candidates. This does not change the result: two members that share
+    only stop-grams can only score better than /uncertain/ if one of them
+    is mostly made up of stop-grams, and those "exposed" members are
+    scanned against the full postings.
+    """
+    MIN_STOPGRAM_POSTINGS = 100
+
+    def __init__(self, stopgram_freq=None):
+        self.stopgram_freq = stopgram_freq
+        self.members = []
+        self.ngrams = []
+        self.gram_ids = {}
+        self.postings = []
+        self.grams = array('i')
+        self.offsets = array('i', [0])
+
+    def __len__(self):
+        return len(self.members)
+
+    def add(self, member, ngrams):
+        ordinal = len(self.members)
+        self.members.append(member)
+        gram_ids = self.gram_ids
+        postings = self.postings
+        for ngram in ngrams:
+            try:
+                gram_id = gram_ids[ngram]
+            except KeyError:
+                gram_id = gram_ids[ngram] = len(postings)
+                postings.append(array('i'))
+                self.ngrams.append(ngram)
+            postings[gram_id].append(ordinal)
+            self.grams.append(gram_id)
+        self.offsets.append(len(self.grams))
+        return ordinal
+
+    def member_grams(self, ordinal):
+        return self.grams[self.offsets[ordinal]:self.offsets[ordinal+1]]
+
+    def member_ngrams(self, ordinal):
+        return tuple([self.ngrams[g] for g in self.member_grams(ordinal)])
+
+    def stop_limit(self):
+        nmembers = len(self.members)
+        if not self.stopgram_freq:
+            return nmembers
+        return max(int(nmembers * self.stopgram_freq),
+                   self.MIN_STOPGRAM_POSTINGS)
+
+    def scan(self, progress=None):
+        """
+        Find every pair of members sharing enough n-grams to score better
+        than /uncertain/, and record the ratio in the /matches/ dict of
+        both members.
+        """
+        members = self.members
+        nmembers = len(members)
+        postings = self.postings
+        grams = self.grams
+        offsets = self.offsets
+        limit = self.stop_limit()
+        is_stop = array('b', [len(posting) > limit for posting in postings])
+        stopsets = [None] * nmembers
+        exposed = []
+        for a in xrange(nmembers):
+            members[a].matches = {}
+            stops = [g for g in grams[offsets[a]:offsets[a+1]] if is_stop[g]]
+            if stops:
+                stopsets[a] = set(stops)
+                if len(stops) > uncertain * (offsets[a+1] - offsets[a]):
+                    exposed.append(a)
+        # Candidates sharing at least one infrequent n-gram. Only members
+        # later in the postings are counted, the ratio is symmetric.
+        for a in xrange(nmembers):
+            if progress is not None:
+                progress(a, nmembers + len(exposed))
+            shared = {}
+            for g in grams[offsets[a]:offsets[a+1]]:
+                if is_stop[g]:
+                    continue
+                posting = postings[g]
+                for b in posting[bisect_right(posting, a):]:
+                    if b in shared:
+                        shared[b] += 1
+                    else:
+                        shared[b] = 1
+            stops_a = stopsets[a]
+            for b, count in shared.iteritems():
+                if stops_a is not None:
+                    stops_b = stopsets[b]
+                    if stops_b is not None:
+                        count += len(stops_a & stops_b)
+                self._add_match(a, b, count)
+        # Exposed members can match others with which they share only
+        # stop-grams, so these are counted against the full postings.
+        for n, a in enumerate(exposed):
+            if progress is not None:
+                progress(nmembers + n, nmembers + len(exposed))
+            shared = {}
+            for g in grams[offsets[a]:offsets[a+1]]:
+                for b in postings[g]:
+                    if b in shared:
+                        shared[b] += 1
+                    else:
+                        shared[b] = 1
+            del shared[a]
+            for b, count in shared.iteritems():
+                self._add_match(a, b, count)
+
+    def _add_match(self, a, b, count):
+        offsets = self.offsets
+        ratio = count * 2 / (offsets[a+1] - offsets[a] +
+                             offsets[b+1] - offsets[b])
+        if ratio > uncertain:
+            self.members[a].matches[b] = ratio
+            self.members[b].matches[a] = ratio
+
+    def release(self):
+        """
+        Discard the postings once the scan is complete (to save memory).
+        """
+        self.members = []
+        self.ngrams = []
+        self.gram_ids = {}
+        self.postings = []
+        self.grams = array('i')
+        self.offsets = array('i', [0])
+
+
 class NGram(object):
-    __slots__ = ('record', 'ngram_count','ngrams', 'matches')
+    __slots__ = ('record', 'ngram_count', 'ordinal', 'matches')
     N = 3
 
     def __init__(self, record, row):
@@ -54,36 +200,23 @@ class NGram(object):
                     ngram_count = len(word) - self.N + 1
                     i = 0
                     while i < ngram_count:
-                        ngrams.add(intern(word[i:i+self.N]))
+                        ngrams.add(word[i:i+self.N])
                         i += 1
         self.matches = None
-        self.ngrams = tuple(ngrams)
-        self.ngram_count = len(self.ngrams)
-        for ngram in self.ngrams:
-            self.ngram_map.setdefault(ngram, []).append(self)
+        self.ngram_count = len(ngrams)
+        self.ordinal = self.index.add(self, ngrams)
 
     def prescan(self):
-        shared_counts = {}
-        for ngram in self.ngrams:
-            for other in self.ngram_map[ngram]:
-                if other is not self:
-                    if other in shared_counts:
-                        shared_counts[other] += 2
-                    else:
-                        shared_counts[other] = 2
-        self.matches = {}
-        for other, shared_count in shared_counts.iteritems():
-            ratio = shared_count / (self.ngram_count + other.ngram_count)
-            if ratio > uncertain:
-                self.matches[other] = ratio
-                #assert ratio <= 1.0, 'ratio %.1f, shared cnt %d, this cnt %d, other cnt %d' % (ratio, shared_count, self.ngram_count, other.ngram_count)
-        self.ngrams = None  # No longer needed, save memory
-        return self.matches
+        if self.matches is None:
+            # Not scanned in bulk by MatchPersons.prescan()
+            self.index.scan()
+        members = self.index.members
+        return [members[ordinal] for ordinal in self.matches]
 
     def match(self, other):
         if not self.ngram_count or not other.ngram_count:
             return None
-        return self.matches.get(other, 0.0)
+        return self.matches.get(other.ordinal, 0.0)
 
 
 class Sex(object):
@@ -150,7 +283,7 @@ def get_matchers(dupepersoncfg):
                 base = NGram
                 attrs['fields'] = group.fields
                 attrs['N'] = dupepersoncfg.ngram_level
-                attrs['ngram_map'] = {}
+                attrs['index'] = NGramIndex(dupepersoncfg.stopgram_freq)
             cls = type(group.label, (base,), attrs)
             matchers.append(cls)
     # Adjust relative weights
@@ -323,8 +456,8 @@ class DupePersons:
         query = db.query('dupe_persons')
         query.where('status != %s', STATUS_CONFLICT)
         query.delete()
-        for mp in self.matchpairs.itervalues():
-            mp.dbrow(db).db_update(False)
+        db.update_rows([mp.dbrow(db) for mp in self.matchpairs.itervalues()],
+                       refetch=False)
 
     def get(self, id_a, id_b):
         if id_a > id_b:
@@ -400,6 +533,52 @@ class Timer:
         return ', '.join(times)
 
 
+class ScanProgress:
+    """
+    Report the scan phase percentage complete and estimated time to
+    completion via dupescan_notify. When the scan is split over several
+    worker processes, the counts of each worker are summed.
+    """
+
+    def __init__(self, nworkers=1):
+        self.t0 = time()
+        self.last_pc = 0
+        self.counts = [None] * nworkers
+
+    def update(self, n, iterations, worker=0):
+        self.counts[worker] = n, iterations
+        if len(self.counts) > 1:
+            if None in self.counts:
+                return
+            n = sum([count[0] for count in self.counts])
+            iterations = sum([count[1] for count in self.counts])
+        if iterations > 100000:
+            pc = n * 100 // iterations
+            if pc != self.last_pc:
+                el = time() - self.t0
+                etc = int(el / n * (iterations - n))
+                dupescan_notify('scan', pc, etc)
+                self.last_pc = pc
+
+
+class WorkerProgress:
+    """
+    Scan progress from a worker process, passed up the pipe to the
+    parent each time another percent is completed.
+    """
+
+    def __init__(self, out):
+        self.out = out
+        self.last_pc = None
+
+    def update(self, n, iterations):
+        pc = n * 100 // iterations
+        if pc != self.last_pc:
+            self.out.write('P %d %d\n' % (n, iterations))
+            self.out.flush()
+            self.last_pc = pc
+
+
 class MatchPersons:
     """
     This object manages the duplicate person identification.
@@ -408,19 +587,30 @@ class MatchPersons:
     the match strength is greater than /uncertain/, creates (or updates)
     a MatchPair record in the /dupes/ structure (which is an instance
     of DupePersons).
+
+    If /index_dir/ is given, full scans save a persistent n-gram index
+    there, and "updated only" scans use it to load just the changed
+    persons and their likely neighbours (see persondupeindex).
     """
+    LOAD_CHUNK = 1000
 
-    def __init__(self, db, config=None, updated_only=False):
+    def __init__(self, db, config=None, updated_only=False, jobs=1,
+                 index_dir=None):
         self.records = []
+        self.updated = None
         if config is None:
             config = persondupecfg.new_persondupecfg()
         self.configure(config)
         self.dupes = DupePersons()
         self.timer = Timer()
+        self.index = None
+        if index_dir:
+            self.index = persondupeindex.PersonDupeIndex(index_dir,
+                                                         self.matchers)
         dupe_lock(db, 'EXCLUSIVE')
         self.load(db, updated_only)
         self.prescan()
-        self.cross_compare(updated_only)
+        self.cross_compare(updated_only, jobs)
 
     def configure(self, dupepersoncfg):
         self.matchers = get_matchers(dupepersoncfg)
@@ -429,30 +619,75 @@ class MatchPersons:
     def load(self, db, updated_only):
         self.timer.start('load')
         dupescan_notify('load', 0, 0)
-        query = db.query('persons')
-        #query.where('(person_id % 3) = 0') # XXX speed-up for debugging only
-        for row in query.yieldall():
-            self.records.append(Record(row, self.matchers))
+        self.last_run = last_run(db)
+        if (updated_only and self.index is not None
+                and self.last_run is not None and self.index.load()):
+            self.load_updated(db)
+        else:
+            query = db.query('persons')
+            #query.where('(person_id % 3) = 0') # XXX speed-up for debugging only
+            for row in query.yieldall(fetchcount=2000, server_side=True):
+                self.records.append(Record(row, self.matchers))
         if updated_only:
             self.dupes.load(db)
         else:
             self.dupes.load(db, status=STATUS_EXCLUDED)
         self.timer.stop('load')
-        self.last_run = last_run(db)
+
+    def load_updated(self, db):
+        """
+        Load the persons changed since the last run, and the persons the
+        persistent index identifies as their likely matches.
+        """
+        query = db.query('persons')
+        query.where('last_update IS NULL OR last_update >= %s', self.last_run)
+        for row in query.yieldall(fetchcount=2000, server_side=True):
+            self.records.append(Record(row, self.matchers))
+        self.updated = list(self.records)
+        candidates = list(self.index.candidates(self.updated, uncertain))
+        self.index.close()
+        candidates.sort()
+        for i in xrange(0, len(candidates), self.LOAD_CHUNK):
+            query = db.query('persons')
+            query.where_in('person_id', candidates[i:i+self.LOAD_CHUNK])
+            for row in query.yieldall():
+                self.records.append(Record(row, self.matchers))
 
     def prescan(self):
         self.timer.start('prescan')
-        last_pc = 0
-        iterations = len(self.records)
+        indexes = [cls.index for cls in self.matchers
+                   if getattr(cls, 'index', None) is not None]
         t0 = time()
-        for n, record in enumerate(self.records):
-            pc = n * 100 // iterations
-            if pc != last_pc:
+        state = {'last_pc': 0, 'index': 0}
+        def progress(n, iterations):
+            done = (state['index'] + n / iterations) / len(indexes)
+            pc = int(done * 100)
+            if pc != state['last_pc']:
                 el = time() - t0
-                etc = int(el / n * (iterations - n))
+                etc = int(el / done * (1 - done))
                 dupescan_notify('index', pc, etc)
-                last_pc = pc
+                state['last_pc'] = pc
+        for index in indexes:
+            index.scan(progress)
+            state['index'] += 1
+        for record in self.records:
             record.prescan()
+        if self.index is not None:
+            # The index only speeds up later updated-only runs, so a
+            # failure to write it is not fatal, but a partly written index
+            # must not be used.
+            try:
+                if self.updated is None:
+                    self.index.build(self.records, uncertain)
+                else:
+                    self.index.update(self.updated)
+            except (IOError, OSError), e:
+                print >> sys.stderr, \
+                    'Person dupe detection: not indexed: %s' % e
+                self.index.discard()
+                self.index = None
+        for index in indexes:
+            index.release()
         self.timer.stop('prescan')
 
     def save(self, db):
@@ -460,9 +695,9 @@ class MatchPersons:
         self.dupes.save(db)
         self.timer.stop('save')
 
-    def _yield_update_pairs(self):
+    def _yield_update_pairs(self, records):
         thres = self.last_run
-        updated_records = [r for r in self.records
+        updated_records = [r for r in records
                             if not r.last_update or r.last_update >= thres]
         iterations = len(self.records) * len(updated_records)
         count = 0
@@ -481,8 +716,7 @@ class MatchPersons:
                 checked.add(keypair)
                 yield count, iterations, a, b
 
-    def _yield_all_pairs(self):
-        records = self.records
+    def _yield_all_pairs(self, records):
         nrecords = len(records)
         iterations = (nrecords - 1) * nrecords // 2
         count = 0
@@ -493,38 +727,125 @@ class MatchPersons:
                 b = records[bi]
                 yield count, iterations, a, b
 
-    def _yield_likely_pairs(self):
-        iterations = sum([len(a.likely) for a in self.records])
+    def _yield_likely_pairs(self, records):
+        iterations = sum([len(a.likely) for a in records])
         count = 0
-        for a in self.records:
+        for a in records:
             for b in a.likely:
                 count += 1
                 yield count, iterations, a, b
 
-    def cross_compare(self, updated_only=False):
+    def _compare_pairs(self, pairs, dupes, progress):
+        cutoff = self.cutoff
+        for n, iterations, a, b in pairs:
+            progress.update(n, iterations)
+            match_confidence = a.match(b)
+            if match_confidence > cutoff:
+                mp = dupes.get(a.key, b.key)
+                mp.confidence = match_confidence
+                cutoff = dupes.adjust_cutoff(cutoff)
+        return cutoff
+
+    def cross_compare(self, updated_only=False, jobs=1):
         self.timer.start('scan')
-        t0 = time()
-        if updated_only:
+        records = self.records
+        if self.updated is not None:
+            # Index assisted - updated persons against their likely matches
+            gen = self._yield_likely_pairs
+            records = self.updated
+        elif updated_only:
             gen = self._yield_update_pairs
         else:
             #gen = self._yield_all_pairs
             gen = self._yield_likely_pairs
-        thres = self.last_run
-        last_pc = 0
-        for n, iterations, a, b in gen():
-                pc = n * 100 // iterations
-                if iterations > 100000 and pc != last_pc:
-                    el = time() - t0
-                    etc = int(el / n * (iterations - n))
-                    dupescan_notify('scan', pc, etc)
-                    last_pc = pc
-                match_confidence = a.match(b)
-                if match_confidence > self.cutoff:
-                    mp = self.dupes.get(a.key, b.key)
-                    mp.confidence = match_confidence
-                    self.cutoff = self.dupes.adjust_cutoff(self.cutoff)
+        if jobs > 1 and len(records) > jobs:
+            self._parallel_compare(gen, records, jobs)
+        else:
+            self.cutoff = self._compare_pairs(gen(records), self.dupes,
+                                              ScanProgress())
         self.timer.stop('scan')
 
+    def _parallel_compare(self, gen, records, jobs):
+        """
+        Fork /jobs/ worker processes, each scoring a shard of the records
+        (every /jobs/-th record). The workers return their likely matches
+        and progress down a pipe, and the matches are merged in key order
+        so the result does not depend on which worker finishes first.
+        """
+        workers = {}
+        results = []
+        try:
+            for shard in range(jobs):
+                rfd, wfd = os.pipe()
+                pid = os.fork()
+                if not pid:
+                    for fd in workers:
+                        os.close(fd)
+                    os.close(rfd)
+                    self._compare_worker(gen(records[shard::jobs]), wfd)
+                os.close(wfd)
+                workers[rfd] = pid, shard, ''
+            progress = ScanProgress(jobs)
+            while workers:
+                ready, ignore, ignore = select.select(workers.keys(), [], [])
+                for fd in ready:
+                    pid, shard, buf = workers[fd]
+                    data = os.read(fd, 65536)
+                    if not data:
+                        os.close(fd)
+                        del workers[fd]
+                        status = os.waitpid(pid, 0)[1]
+                        if status:
+                            raise OSError('dupe scan worker %d failed '
+                                          '(status %d)' % (pid, status))
+                        continue
+                    lines = (buf + data).split('\n')
+                    workers[fd] = pid, shard, lines.pop()
+                    for line in lines:
+                        fields = line.split()
+                        if fields[0] == 'P':
+                            progress.update(int(fields[1]), int(fields[2]),
+                                            shard)
+                        else:
+                            results.append((int(fields[1]), int(fields[2]),
+                                            float(fields[3])))
+        finally:
+            # Only left over if we are bailing out - don't leave the
+            # remaining workers running (or as zombies)
+            for fd, (pid, shard, buf) in workers.items():
+                os.close(fd)
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except OSError:
+                    pass
+                os.waitpid(pid, 0)
+        results.sort()
+        for low_person_id, high_person_id, match_confidence in results:
+            if match_confidence > self.cutoff:
+                mp = self.dupes.get(low_person_id, high_person_id)
+                mp.confidence = match_confidence
+                self.cutoff = self.dupes.adjust_cutoff(self.cutoff)
+
+    def _compare_worker(self, pairs, wfd):
+        # Runs in the forked child, which must not touch the db connection
+        # or notification client it shares with the parent.
+        status = 1
+        try:
+            try:
+                out = os.fdopen(wfd, 'w')
+                dupes = DupePersons()
+                self._compare_pairs(pairs, dupes, WorkerProgress(out))
+                for mp in dupes.matchpairs.itervalues():
+                    out.write('M %d %d %r\n' % (mp.low_person_id,
+                                                mp.high_person_id,
+                                                mp.confidence))
+                out.close()
+                status = 0
+            except:
+                traceback.print_exc()
+        finally:
+            os._exit(status)
+
     def ngram_count(self):
         return sum([rec.ngram_count() for rec in self.records])
 
@@ -562,11 +883,13 @@ def explain_dupe(prefs, person_a, person_b):
     return a.desc_match(b)
 
 
-def persondupe(db, dup_config, updated_only=False):
+def persondupe(db, dup_config, updated_only=False, jobs=None):
     # We have to close our connection to the database, or the forked child will
     # inherit it, which is not allowed, and attempting to close one results in
     # both being torn down.
     import config
+    if jobs is None:
+        jobs = config.dupscan_jobs
     db.close()
     if daemonize.daemonize():
         return
@@ -578,7 +901,8 @@ def persondupe(db, dup_config, updated_only=False):
         else:
             psyco.full()
         print >> sys.stderr, '%s: Person dupe detection started' % config.appname
-        mp = MatchPersons(db, dup_config, updated_only)
+        mp = MatchPersons(db, dup_config, updated_only, jobs,
+                          index_dir=os.path.join(config.cgi_target, 'db'))
         mp.save(db)
         print >> sys.stderr, '%s: Person dupe detection: %s' % (config.appname, mp.stats())
         db.commit()
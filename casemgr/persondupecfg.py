@@ -79,10 +79,14 @@ defaults = [
 class PersonDupeCfg(object):
     cutoff_options = [(c / 100.0, '%d%%' % c)
                         for c in range(55,100,5)]
+    # N-grams appearing in more than this fraction of persons are not used
+    # to generate match candidates (class attr so old pickles get it).
+    stopgram_freq = 0.01
 
     def __init__(self):
         self.ngram_level = 3
         self.cutoff = 0.5
+        self.stopgram_freq = 0.01
         self.ngram_groups = []
 
     def edit_group(self, index):
@@ -110,6 +114,7 @@ class PersonDupeCfg(object):
     def reset(self):
         self.ngram_level = 3
         self.cutoff = 0.5
+        self.stopgram_freq = 0.01
         self.ngram_groups = copy.deepcopy(defaults)
 
     def start_editing(self):
@@ -118,6 +123,7 @@ class PersonDupeCfg(object):
     def stop_editing(self):
         self.ngram_level = int(self.ngram_level)
         self.cutoff = float(self.cutoff)
+        self.stopgram_freq = float(self.stopgram_freq)
 #        self.ngram_groups = [group for group in self.ngram_groups
 #                             if group.fields]
 
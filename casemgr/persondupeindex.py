@@ -0,0 +1,328 @@
+#
+#   The contents of this file are subject to the HACOS License Version 1.2
+#   (the "License"); you may not use this file except in compliance with
+#   the License.  Software distributed under the License is distributed
+#   on an "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, either express or
+#   implied. See the LICENSE file for the specific language governing
+#   rights and limitations under the License.  The Original Software
+#   is "NetEpi Collection". The Initial Developer of the Original
+#   Software is the Health Administration Corporation, incorporated in
+#   the State of New South Wales, Australia.
+#
+#   Copyright (C) 2004-2011 Health Administration Corporation, Australian
+#   Government Department of Health and Ageing, and others.
+#   All Rights Reserved.
+#
+#   Contributors: See the CONTRIBUTORS file for details of contributions.
+#
+"""
+Persistent n-gram index for "updated only" duplicate person scans.
+
+A full scan saves the n-gram postings of every person to disk (the
+"main" index). An updated-only scan then only needs to load the
+persons changed since the last scan, look their n-grams up in the
+main index to find candidate neighbours, and load those. Persons
+changed since the main index was built are recorded in a small
+"delta" file keyed by person_id (with their last_update), and their
+main index entries are ignored.
+
+Files are kept in the application db directory (next to the describer
+pickle), and are named by a hash of the n-gram matcher configuration,
+so a configuration change forces a rebuild by the next full scan:
+
+    dupeindex-<hash>.dir        marshalled n-gram directory and per-person
+                                n-gram counts
+    dupeindex-<hash>.post       postings (person_ids), memory mapped
+    dupeindex-<hash>.delta      pickled changes since the main index
+"""
+
+from __future__ import division
+
+import os
+import mmap
+import marshal
+import cPickle
+import tempfile
+from array import array
+from bisect import bisect_left
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+try:
+    set
+except NameError:
+    from sets import Set as set
+
+INDEX_VERSION = 1
+
+
+def _write_atomic(filename, write):
+    """
+    Call write(f) on a temporary file, and rename it into place
+    """
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(filename))
+    f = os.fdopen(fd, 'wb')
+    try:
+        write(f)
+        f.close()
+        os.chmod(tmpname, 0644)
+        os.rename(tmpname, filename)
+    finally:
+        try:
+            os.unlink(tmpname)
+        except OSError:
+            pass
+
+
+class PersonDupeIndex:
+
+    def __init__(self, index_dir, matchers):
+        self.index_dir = index_dir
+        # (position in Record.data, matcher class) of the n-gram groups
+        self.groups = [(i, cls) for i, cls in enumerate(matchers)
+                       if getattr(cls, 'index', None) is not None]
+        sig = md5(repr([(cls.fields, cls.N) for i, cls in self.groups]))
+        self.basename = os.path.join(index_dir,
+                                     'dupeindex-%s' % sig.hexdigest())
+        self.loaded = False
+
+    def _record_ngrams(self, record):
+        return [cls.index.member_ngrams(record.data[i].ordinal)
+                for i, cls in self.groups]
+
+    def build(self, records, threshold):
+        """
+        Write a new main index from a full load of persons (must be called
+        before the matcher indexes are released). Any delta is discarded.
+
+        For stop-grams, a second posting lists only the "exposed" persons
+        (those made up mostly of stop-grams, see NGramIndex), as these
+        can match while sharing only stop-grams.
+        """
+        person_ids = array('i', [record.key for record in records])
+        order = range(len(records))
+        order.sort(key=person_ids.__getitem__)
+        directory = {
+            'version': INDEX_VERSION,
+            'person_ids':
+                array('i', [person_ids[o] for o in order]).tostring(),
+            'ngram_dirs': [],
+            'limits': [],
+            'ngram_counts': [],
+            'stop_counts': [],
+        }
+        def write_posting(f, start, posting):
+            array('i', [person_ids[o] for o in posting]).tofile(f)
+            return start + len(posting)
+        def write_postings(f):
+            start = 0
+            for i, cls in self.groups:
+                index = cls.index
+                limit = index.stop_limit()
+                ngram_counts = array('i')
+                stop_counts = array('i')
+                for o in xrange(len(records)):
+                    grams = index.member_grams(o)
+                    ngram_counts.append(len(grams))
+                    stop_counts.append(len([g for g in grams
+                                        if len(index.postings[g]) > limit]))
+                ngram_dir = {}
+                for ngram, gram_id in index.gram_ids.iteritems():
+                    posting = index.postings[gram_id]
+                    entry = start, len(posting)
+                    start = write_posting(f, start, posting)
+                    if len(posting) > limit:
+                        exposed = [o for o in posting
+                                   if stop_counts[o] > threshold *
+                                                        ngram_counts[o]]
+                        entry += start, len(exposed)
+                        start = write_posting(f, start, exposed)
+                    ngram_dir[ngram] = entry
+                directory['ngram_dirs'].append(ngram_dir)
+                directory['limits'].append(limit)
+                directory['ngram_counts'].append(
+                    array('i', [ngram_counts[o] for o in order]).tostring())
+                directory['stop_counts'].append(
+                    array('i', [stop_counts[o] for o in order]).tostring())
+        self.close()
+        self._remove_stale()
+        _write_atomic(self.basename + '.post', write_postings)
+        _write_atomic(self.basename + '.dir',
+                      lambda f: marshal.dump(directory, f))
+        try:
+            os.unlink(self.basename + '.delta')
+        except OSError:
+            pass
+
+    def _remove_stale(self):
+        # Indexes for previous matcher configurations
+        for fn in os.listdir(self.index_dir):
+            if fn.startswith('dupeindex-'):
+                path = os.path.join(self.index_dir, fn)
+                if not path.startswith(self.basename + '.'):
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+
+    def discard(self):
+        """
+        Remove this index, so the next updated-only run falls back to a
+        full scan (used when the index could not be written).
+        """
+        self.close()
+        for ext in ('.post', '.dir', '.delta'):
+            try:
+                os.unlink(self.basename + ext)
+            except OSError:
+                pass
+
+    def load(self):
+        """
+        Load the main index and delta, returning False if there is no
+        usable index.
+        """
+        try:
+            f = open(self.basename + '.dir', 'rb')
+        except IOError:
+            return False
+        try:
+            directory = marshal.load(f)
+        finally:
+            f.close()
+        if directory.get('version') != INDEX_VERSION:
+            return False
+        self.person_ids = array('i', directory['person_ids'])
+        self.ngram_dirs = directory['ngram_dirs']
+        self.limits = directory['limits']
+        self.ngram_counts = [array('i', c) for c in directory['ngram_counts']]
+        self.stop_counts = [array('i', c) for c in directory['stop_counts']]
+        f = open(self.basename + '.post', 'rb')
+        try:
+            size = os.fstat(f.fileno()).st_size
+            if size:
+                self.postings = mmap.mmap(f.fileno(), size,
+                                          access=mmap.ACCESS_READ)
+            else:
+                self.postings = ''
+        finally:
+            f.close()
+        try:
+            f = open(self.basename + '.delta', 'rb')
+        except IOError:
+            self.delta = {}
+        else:
+            try:
+                self.delta = cPickle.load(f)
+            finally:
+                f.close()
+        self.delta_postings = [{} for group in self.groups]
+        for person_id, (last_update, group_ngrams) in self.delta.iteritems():
+            for postings, ngrams in zip(self.delta_postings, group_ngrams):
+                for ngram in ngrams:
+                    postings.setdefault(ngram, []).append(person_id)
+        self.loaded = True
+        return True
+
+    def close(self):
+        if self.loaded:
+            if not isinstance(self.postings, str):
+                self.postings.close()
+            self.postings = None
+            self.loaded = False
+
+    def _posting(self, start, count):
+        return array('i', self.postings[start*4:(start+count)*4])
+
+    def _counts(self, n, person_id):
+        i = bisect_left(self.person_ids, person_id)
+        if i < len(self.person_ids) and self.person_ids[i] == person_id:
+            return self.ngram_counts[n][i], self.stop_counts[n][i]
+        return None
+
+    def candidates(self, records, threshold):
+        """
+        Return the person_ids of indexed persons that may share more than
+        /threshold/ of their n-grams with any of /records/ in any group
+        (the "likely" test applied by NGramIndex.scan).
+
+        N-grams that were stop-grams when the index was built are only
+        scanned for records made up mostly of stop-grams; otherwise the
+        count of stop-grams shared is bounded by the stop-gram counts of
+        the two persons.
+        """
+        exclude = set([record.key for record in records])
+        found = set()
+        for record in records:
+            group_ngrams = self._record_ngrams(record)
+            for n, ngrams in enumerate(group_ngrams):
+                self._group_candidates(n, ngrams, threshold, exclude, found)
+        return found
+
+    def _group_candidates(self, n, ngrams, threshold, exclude, found):
+        na = len(ngrams)
+        if not na:
+            return
+        ngram_dir = self.ngram_dirs[n]
+        limit = self.limits[n]
+        sa = 0
+        for ngram in ngrams:
+            entry = ngram_dir.get(ngram)
+            if entry is not None and entry[1] > limit:
+                sa += 1
+        exposed = sa > threshold * na
+        # If this person is exposed, all postings are counted. Otherwise
+        # the stop-gram postings of exposed persons are counted, and the
+        # stop-grams shared with other persons are bounded by their counts.
+        shared = {}
+        for ngram in ngrams:
+            entry = ngram_dir.get(ngram)
+            if entry is None:
+                continue
+            if entry[1] <= limit or exposed:
+                entry = entry[:2]
+            else:
+                entry = entry[2:]
+            for person_id in self._posting(*entry):
+                if person_id in shared:
+                    shared[person_id] += 1
+                else:
+                    shared[person_id] = 1
+        for person_id, count in shared.iteritems():
+            if (person_id in exclude or person_id in found
+                    or person_id in self.delta):
+                continue
+            counts = self._counts(n, person_id)
+            if counts is None:
+                continue
+            nb, sb = counts
+            if not exposed and not sb > threshold * nb:
+                count += min(sa, sb)
+            if count * 2 / (na + nb) > threshold:
+                found.add(person_id)
+        # Persons changed since the main index was built
+        shared = {}
+        for ngram in ngrams:
+            for person_id in self.delta_postings[n].get(ngram, ()):
+                if person_id in shared:
+                    shared[person_id] += 1
+                else:
+                    shared[person_id] = 1
+        for person_id, count in shared.iteritems():
+            if person_id in exclude or person_id in found:
+                continue
+            nb = len(self.delta[person_id][1][n])
+            if count * 2 / (na + nb) > threshold:
+                found.add(person_id)
+
+    def update(self, records):
+        """
+        Record the current n-grams of changed persons in the delta (must
+        be called before the matcher indexes are released).
+        """
+        for record in records:
+            self.delta[record.key] = (record.last_update,
+                                      self._record_ngrams(record))
+        _write_atomic(self.basename + '.delta',
+                      lambda f: cPickle.dump(self.delta, f, -1))
@@ -17,7 +17,7 @@
 #
 from cocklebur import dbobj, utils
 from casemgr import globals, demogfields, person, fuzzyperson, persondupe, \
-                    syndrome
+                    syndrome, cached
 
 class PersonMergeError(globals.Error): pass
 class PersonHasChanged(PersonMergeError): pass
@@ -316,6 +316,8 @@ class Merge:
         update_person.db_update(refetch=False)
         delete_person.db_delete()
 #        globals.db.rollback()  # when testing
+        # Cases of any syndrome may have changed
+        cached.commit_notify.notify('casedata')
         return update_person, case_ids
 
 
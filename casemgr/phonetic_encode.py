@@ -53,6 +53,16 @@ verbose = False
 
 import string
 
+# Translation tables, built once at import rather than on every call - - - - -
+#
+_soundex_table = string.maketrans('abcdefghijklmnopqrstuvwxyz', \
+                                  '01230120022455012623010202')
+_mod_soundex_table = string.maketrans('abcdefghijklmnopqrstuvwxyz', \
+                                      '01360240043788015936020505')
+_nysiis_vowel_table = string.maketrans('eiou', 'aaaa')
+_nysiis_suffixes = {'ix':'ic', 'ex':'ec', 'ye':'y', 'ee':'y', 'ie':'y', \
+                    'dt':'d', 'rt':'d', 'rd':'d', 'nt':'n', 'nd':'n'}
+
 # =============================================================================
 
 def soundex(s, maxlen=4):
@@ -72,10 +82,9 @@ def soundex(s, maxlen=4):
     - http://www.nist.gov/dads/HTML/soundex.html
   """
 
-  # Translation table and characters that will not be used for soundex  - - - -
+  # Characters that will not be used for soundex  - - - - - - - - - - - - - - -
   #
-  transtable = string.maketrans('abcdefghijklmnopqrstuvwxyz', \
-                                '01230120022455012623010202')
+  transtable = _soundex_table
   # deletechars='aeiouhwy '
   deletechars = ' '
 
@@ -124,10 +133,9 @@ def mod_soundex(s, maxlen=4):
     - http://www.bluepoof.com/Soundex/info2.html
   """
 
-  # Translation table and characters that will not be used for soundex  - - - -
+  # Characters that will not be used for soundex  - - - - - - - - - - - - - - -
   #
-  transtable = string.maketrans('abcdefghijklmnopqrstuvwxyz', \
-                                '01360240043788015936020505')
+  transtable = _mod_soundex_table
   deletechars='aeiouhwy '
 
   if (not s):
@@ -314,8 +322,7 @@ def nysiis(s, maxlen=4):
 
   # Translate some suffix characters:
   #
-  suff_dict = {'ix':'ic', 'ex':'ec', 'ye':'y', 'ee':'y', 'ie':'y', \
-               'dt':'d', 'rt':'d', 'rd':'d', 'nt':'n', 'nd':'n'}
+  suff_dict = _nysiis_suffixes
   suff = s[-2:]
   s = s[:-2]+suff_dict.get(suff, suff)  # Replace suffix if in dictionary
 
@@ -331,7 +338,7 @@ def nysiis(s, maxlen=4):
 
   # Replace all vowels with A and delete whitespaces
   #
-  voweltable = string.maketrans('eiou', 'aaaa')
+  voweltable = _nysiis_vowel_table
   s2 = string.translate(s,voweltable, ' ')
 
   if (not s2):  # String only contained whitespaces
@@ -401,6 +408,19 @@ def nysiis(s, maxlen=4):
 
 # =============================================================================
 
+def _dmetaphone_isvowel(c):
+  if (c in 'aeiouy'):
+    return 1
+  else:
+    return 0
+
+def _dmetaphone_slavogermanic(str):
+  if (str.find('w')>-1) or (str.find('k')>-1) or (str.find('cz')>-1) or \
+     (str.find('witz')>-1):
+    return 1
+  else:
+    return 0
+
 def dmetaphone(s, maxlen=4):
   """Compute the Double Metaphone code for a string.
 
@@ -433,22 +453,8 @@ def dmetaphone(s, maxlen=4):
   primary_len = 0
   secondary_len = 0
 
-  # Sub routines  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-  #
-  def isvowel(c):
-    if (c in 'aeiouy'):
-      return 1
-    else:
-      return 0
-
-  def slavogermanic(str):
-    if (str.find('w')>-1) or (str.find('k')>-1) or (str.find('cz')>-1) or \
-       (str.find('witz')>-1):
-      return 1
-    else:
-      return 0
-
-  # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+  isvowel = _dmetaphone_isvowel
+  slavogermanic = _dmetaphone_slavogermanic
 
   length = len(s)
   if (len < 1):
@@ -468,7 +474,10 @@ def dmetaphone(s, maxlen=4):
     secondary_len = secondary_len+1
     current = current+1
 
-  while (primary_len < maxlen) or (secondary_len < maxlen):
+  # Only the primary code is returned, so stop once it is long enough
+  # (unless the secondary is wanted for the log message).
+  #
+  while (primary_len < maxlen) or (verbose and secondary_len < maxlen):
     if (current >= length):
       break
 
@@ -15,6 +15,8 @@
 #
 #   Contributors: See the CONTRIBUTORS file for details of contributions.
 #
+import time
+from array import array
 try:
     set
 except NameError:
@@ -22,6 +24,7 @@ except NameError:
 
 from cocklebur import datetime
 from cocklebur.form_ui.inputbase import OneChoiceBase
+from cocklebur.lrucache import LRUCache
 
 from casemgr import globals, syndrome, demogfields
 from casemgr.reports.common import *
@@ -79,6 +82,137 @@ class Tally(dict):
         self[key] = self.get(key, 0) + count
 
 
+class CrosstabCube(object):
+    """
+    Materialised crosstab: the tally of each cell (and the TOTAL
+    marginals), built from (count, row value, column value[, page value])
+    rows, and for drill-down, the case_ids of each cell (loaded on first
+    use, see load_cells).
+    """
+
+    def __init__(self, rows, has_page):
+        self.load_time = time.time()
+        self.date = datetime.now()
+        self.has_page = has_page
+        self.cells = None
+        tally = Tally()
+        if has_page:
+            for count, row_val, col_val, page_val in rows:
+                tally.add(count, row_val, col_val, page_val)
+                tally.add(count, row_val, TOTAL, page_val)
+                tally.add(count, TOTAL, col_val, page_val)
+                tally.add(count, TOTAL, TOTAL, page_val)
+                tally.add(count, row_val, col_val, TOTAL)
+                tally.add(count, row_val, TOTAL, TOTAL)
+                tally.add(count, TOTAL, col_val, TOTAL)
+                tally.add(count, TOTAL, TOTAL, TOTAL)
+        else:
+            for count, row_val, col_val in rows:
+                tally.add(count, row_val, col_val, TOTAL)
+                tally.add(count, row_val, TOTAL, TOTAL)
+                tally.add(count, TOTAL, col_val, TOTAL)
+                tally.add(count, TOTAL, TOTAL, TOTAL)
+        self.tally = tally
+
+    def load_cells(self, rows):
+        """
+        Record the case_ids of each cell from (case_id, row value,
+        column value[, page value]) rows
+        """
+        cells = {}
+        for row in rows:
+            key = row[1:]
+            if not self.has_page:
+                key += (TOTAL,)
+            try:
+                cells[key].append(row[0])
+            except KeyError:
+                cells[key] = array('l', [row[0]])
+        self.cells = cells
+
+    def case_ids(self, *coords):
+        """
+        Distinct case_ids of the cells matching the given row, column
+        and page values (TOTAL matching any value)
+        """
+        case_ids = set()
+        for key, cell_ids in self.cells.iteritems():
+            for want, val in zip(coords, key):
+                if want != TOTAL and want != val:
+                    break
+            else:
+                case_ids.update(cell_ids)
+        case_ids = list(case_ids)
+        case_ids.sort()
+        return case_ids
+
+
+class CubeCache(object):
+    """
+    Crosstab cubes, shared by all users of the application process, and
+    keyed by the crosstab query (which captures the syndrome, axes,
+    report filters and access restrictions).
+
+    Cubes of a syndrome are discarded when its cases or forms change
+    (the "casedata" notification). The notification is sent when the
+    change is made, and again when it is committed (see
+    cached.CommitNotify), and a cube loaded within settle_time of a
+    notification is not retained. Without the notification daemon,
+    cubes are not retained at all.
+    """
+    settle_time = 10
+    time_to_live = 3600
+
+    def __init__(self, size):
+        self.size = size
+        self.cubes = LRUCache(max(size, 1))
+        self.changed = {}
+        self.subscribed = False
+        self.enabled = False
+
+    def subscribe(self):
+        if not self.subscribed:
+            self.subscribed = True
+            self.enabled = (self.size > 0 and
+                    globals.notify.subscribe('casedata', self.notification))
+        return self.enabled
+
+    def notification(self, *args):
+        now = time.time()
+        syndrome_ids = []
+        for arg in args:
+            if arg == 'None':
+                continue
+            syndrome_ids.append(int(arg))
+        if not syndrome_ids:
+            # All syndromes
+            syndrome_ids = [None]
+        for syndrome_id in syndrome_ids:
+            self.changed[syndrome_id] = now
+        for key in self.cubes.keys():
+            if None in syndrome_ids or key[0] in syndrome_ids:
+                del self.cubes[key]
+
+    def get(self, key):
+        if not self.subscribe():
+            return None
+        cube = self.cubes.get(key)
+        if (cube is not None
+                and cube.load_time + self.time_to_live < time.time()):
+            del self.cubes[key]
+            cube = None
+        return cube
+
+    def put(self, key, cube):
+        if not self.subscribe():
+            return
+        changed = max(self.changed.get(key[0], 0), self.changed.get(None, 0))
+        if cube.load_time > changed + self.settle_time:
+            self.cubes[key] = cube
+
+cube_cache = CubeCache(config.crosstab_cache)
+
+
 class CrossTabCount:
 
     render = 'crosstab'
@@ -124,31 +258,29 @@ class CrossTabCount:
         self.params.filter_query(query)
         return query
 
-    def run(self):
+    def tally_query(self):
         query = self.get_query(group_by=','.join(self.cols))
-        cols = ['count(*)'] + self.cols
-        data = query.fetchcols(cols)
-        tally = Tally()
+        return query, ['count(*)'] + self.cols
+
+    def cube_key(self):
+        query, cols = self.tally_query()
+        query_expr, query_args = query.build_expr(cols)
+        return self.syndrome_id, query_expr, tuple(query_args)
+
+    def run(self):
+        key = self.cube_key()
+        cube = cube_cache.get(key)
+        if cube is None:
+            query, cols = self.tally_query()
+            cube = CrosstabCube(query.fetchcols(cols), bool(self.page.table))
+            cube_cache.put(key, cube)
+        self.date = cube.date
+        tally = cube.tally
         if self.page.table:
-            for count, row_val, col_val, page_val in data:
-                tally.add(count, row_val, col_val, page_val)
-                tally.add(count, row_val, TOTAL, page_val)
-                tally.add(count, TOTAL, col_val, page_val)
-                tally.add(count, TOTAL, TOTAL, page_val)
-                tally.add(count, row_val, col_val, TOTAL)
-                tally.add(count, row_val, TOTAL, TOTAL)
-                tally.add(count, TOTAL, col_val, TOTAL)
-                tally.add(count, TOTAL, TOTAL, TOTAL)
             if not self.empty_pages:
                 self.page.options = [(val, label)
                                      for val, label in self.page.options
                                      if tally.get((TOTAL, TOTAL, val))]
-        else:
-            for count, row_val, col_val in data:
-                tally.add(count, row_val, col_val, TOTAL)
-                tally.add(count, row_val, TOTAL, TOTAL)
-                tally.add(count, TOTAL, col_val, TOTAL)
-                tally.add(count, TOTAL, TOTAL, TOTAL)
         if not self.empty_rowsncols:
             self.row.options = [(val, label)
                                 for val, label in self.row.options
@@ -171,8 +303,17 @@ class CrossTabCount:
         return ' '.join(style)
 
     def get_key_case_ids(self, *coords):
+        axes = self.row, self.col, self.page
+        cube = cube_cache.get(self.cube_key())
+        if cube is not None:
+            if cube.cells is None:
+                query = self.get_query()
+                cube.load_cells(query.yieldcols(['cases.case_id'] + self.cols))
+            values = [axis.options[int(index)][0]
+                      for axis, index in zip(axes, coords)]
+            return cube.case_ids(*values)
         query = self.get_query(distinct=True)
-        for axis, index in zip((self.row, self.col, self.page), coords):
+        for axis, index in zip(axes, coords):
             val = axis.options[int(index)][0]
             if val != TOTAL:
                 axis.filter(query, val)
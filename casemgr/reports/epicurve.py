@@ -27,9 +27,11 @@ try:
 except NameError:
     from sets import Set as set
 
-from mx.DateTime import DateTimeType, DateTimeDelta, RelativeDateTime, Monday
+from mx.DateTime import DateTimeType, DateTimeDelta, RelativeDateTime, Monday,\
+                        DateTimeFromAbsDays
 
 from cocklebur import datetime, trafficlight, utils
+from cocklebur.dbobj.columnar import ResultColumn
 
 from casemgr import globals
 from casemgr.reports.common import *
@@ -44,7 +46,7 @@ def import_pylab():
     We defer loading matplotlib until it's actually needed as it can
     take several seconds to import, and it may not be available at all.
     """
-    global matplotlib, pylab
+    global matplotlib, pylab, numpy
     if 'matplotlib' not in sys.modules:
         # Problem: matplotlib wants to load it's font cache (pickle) and rc
         # files from a writable directory. This is potentially a security
@@ -60,6 +62,7 @@ def import_pylab():
             import matplotlib
             matplotlib.use('Agg')
             import pylab
+            import numpy
         except ImportError, e:
             raise Error('matplotlib not available (%s)?' % (e))
 
@@ -81,6 +84,37 @@ def same_scale(axis, *axes):
         getattr(ax, 'set_%slim' % axis)(l, u)
 
 
+def date_ordinals(dates):
+    """
+    Given /dates/, either a list of mx.DateTime (or None), or a dbobj
+    ResultColumn of dates, return numpy arrays of the day ordinals (mx
+    absdays) and of which dates are not null.
+    """
+    if isinstance(dates, ResultColumn):
+        if not len(dates):
+            return numpy.zeros(0), numpy.zeros(0, dtype=bool)
+        if dates.kind == 'date':
+            ordinals = numpy.frombuffer(dates.values, dtype=numpy.float64)
+            valid = numpy.frombuffer(dates.nulls, dtype=numpy.uint8) == 0
+            return ordinals, valid
+        dates = dates.tolist()
+    ordinals = numpy.array([date is not None and date.absdays or 0.0
+                            for date in dates], dtype=numpy.float64)
+    valid = numpy.array([date is not None for date in dates], dtype=bool)
+    return ordinals, valid
+
+
+def bincount(values, length):
+    """
+    Count occurrences of each integer in /values/ (0 <= value < length)
+    """
+    counts = numpy.zeros(length)
+    if len(values):
+        found = numpy.bincount(values)
+        counts[:len(found)] = found
+    return counts
+
+
 class CondCol:
     def __init__(self, data, optionexpr=None):
         self.data = map(str, data)
@@ -126,16 +160,15 @@ class EpiCurve:
         (respecively).
         """
         assert self.dates
+        ordinals, valid = date_ordinals(self.dates)
+        ordinals = ordinals[valid]
         if self.lower_dates:
-            dates = filter(None, self.dates + self.lower_dates)
-        else:
-            dates = filter(None, self.dates)
-        if not dates:
+            lower_ordinals, valid = date_ordinals(self.lower_dates)
+            ordinals = numpy.concatenate((ordinals, lower_ordinals[valid]))
+        if not len(ordinals):
             raise Error('No date records found')
-        start_of_day = RelativeDateTime(hour=0, minute=0, second=0)
-        start_of_next_day = RelativeDateTime(days=1, hour=0, minute=0, second=0)
-        self.first = min(dates) + start_of_day
-        self.last = max(dates) + start_of_next_day
+        self.first = DateTimeFromAbsDays(math.floor(ordinals.min()))
+        self.last = DateTimeFromAbsDays(math.floor(ordinals.max()) + 1)
         self.span = self.last - self.first
         assert isinstance(self.first, DateTimeType)
         assert isinstance(self.last, DateTimeType)
@@ -226,11 +259,12 @@ class EpiCurve:
     def info(self, msgs):
         n_recs = len(self.dates)
         info = ['%d records' % n_recs]
-        date_missing = sum([not date for date in self.dates])
+        date_missing = int((~date_ordinals(self.dates)[1]).sum())
         if date_missing:
             info.append(', %d missing %s' % (date_missing, self.date_label))
         if self.lower_dates:
-            lower_date_missing = sum([not date for date in self.lower_dates])
+            lower_valid = date_ordinals(self.lower_dates)[1]
+            lower_date_missing = int((~lower_valid).sum())
             if lower_date_missing:
                 info.append(', %d missing %s' % (lower_date_missing, 
                                                  self.lower_date_label))
@@ -246,18 +280,23 @@ class EpiCurve:
             lvl = 'info'
         msgs.msg(lvl, ''.join(info))
 
-    def date_bin(self, dates):
+    def date_bins(self, dates):
         """
-        Do the date binning
+        Returns numpy arrays of the bin number of each of /dates/, and
+        which of the dates are not null.
         """
         assert self.n_bins
         assert self.bin_span
-        bins = pylab.zeros(self.n_bins)
-        for date in dates:
-            if date is not None:
-                bin = int((date - self.first) / self.bin_span)
-                bins[bin] += 1
-        return bins
+        ordinals, valid = date_ordinals(dates)
+        offsets = (ordinals - self.first.absdays) / self.bin_span.days
+        return numpy.floor(offsets).astype(int), valid
+
+    def date_bin(self, dates):
+        """
+        Do the date binning
+        """
+        bins, valid = self.date_bins(dates)
+        return bincount(bins[valid], self.n_bins)
 
     def strata_date_bin(self, dates, *condcols):
         """
@@ -265,17 +304,31 @@ class EpiCurve:
 
         Strata is a list of tuples. There must be a tuple for each date entry.
         """
-        assert self.n_bins
-        assert self.bin_span
-        cols = [cc.data for cc in condcols]
-        rows = zip(*cols)
+        bins, valid = self.date_bins(dates)
+        # Factorise the strata into a single code per row
+        codes = numpy.zeros(len(bins), dtype=int)
+        levels = []
+        for cc in condcols:
+            index = dict([(v, i) for i, v in enumerate(cc.order)])
+            inverse = numpy.fromiter(itertools.imap(index.__getitem__,
+                                                    cc.data),
+                                     dtype=int, count=len(cc.data))
+            levels.append(cc.order)
+            codes = codes * len(cc.order) + inverse
+        n_strata = 1
+        for values in levels:
+            n_strata *= len(values)
+        counts = bincount(codes[valid] * self.n_bins + bins[valid],
+                          n_strata * self.n_bins)
+        counts = counts.reshape((n_strata, self.n_bins))
         strata_bins = {}
-        for c in set(rows):
-            strata_bins[c] = pylab.zeros(self.n_bins)
-        for d, c in itertools.izip(dates, rows):
-            if d is not None:
-                bin = int((d - self.first) / self.bin_span)
-                strata_bins[c][bin] += 1
+        for code in numpy.unique(codes):
+            key = []
+            rest = code
+            for values in levels[::-1]:
+                rest, index = divmod(rest, len(values))
+                key.insert(0, values[index])
+            strata_bins[tuple(key)] = counts[code]
         return strata_bins
 
     def strata_ratios(self, strata_bins):
@@ -370,6 +423,9 @@ class FieldInfo(object):
     def data(self):
         return self.fields.get_column(self.index)
 
+    def column(self):
+        return self.fields.columns[self.index]
+
 
 class DemogFieldInfo(FieldInfo):
 
@@ -401,7 +457,7 @@ class ECFields(list):
         self.params = params
         self.cols = []
         self.join = None
-        self.rows = None
+        self.columns = None
 
     def _get_field(self, field):
         form, field = field.split(':')
@@ -435,10 +491,15 @@ class ECFields(list):
             query.join(join + ' case_form_summary USING (case_id)')
             query.join(join + ' %s ON (case_form_summary.summary_id = %s.summary_id AND NOT case_form_summary.deleted)' % (table, table))
             #query.where('NOT case_form_summary.deleted')
-        self.rows = query.fetchcols(self.cols)
+        self.columns = query.fetchcols_columnar(self.cols)
+
+    def record_count(self):
+        if not self.columns:
+            return 0
+        return len(self.columns[0])
 
     def get_column(self, index):
-        return [row[index] for row in self.rows]
+        return self.columns[index].tolist()
 
 
 class EpiCurveParamsMixin:
@@ -549,11 +610,11 @@ class EpiCurveParamsMixin:
         if self.ts_stacking:
             stack_field = ecfields.add_field(self.ts_stacking)
         ecfields.load(query, boolstr(self.ts_missing_forms))
-        if not ecfields.rows:
+        if not ecfields.record_count():
             raise globals.Error('No records found')
-        ec.set_dates(date_field.data(), date_field.label)
+        ec.set_dates(date_field.column(), date_field.label)
         if date2_field:
-            ec.set_lower_dates(date2_field.data(), date2_field.label)
+            ec.set_lower_dates(date2_field.column(), date2_field.label)
         ec.info(msgs)
         if msgs.have_errors():
             return
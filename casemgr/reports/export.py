@@ -150,7 +150,7 @@ class ReportExportBase(object):
         query.where_in('form_label', self.forms)
         query.where_in('case_id', self.case_ids)
         cols = 'case_id', 'summary_id', 'form_label', 'form_version'
-        for case_id, summ_id, form_name, form_version in query.fetchcols(cols):
+        for case_id, summ_id, form_name, form_version in query.yieldcols(cols):
             form_info = self.info_by_form[form_name]
             form_info.add_summary(case_id, summ_id, form_version)
 
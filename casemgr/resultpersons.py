@@ -21,6 +21,7 @@ Code to support a person-oriented view of cases, as used by the search
 result pages.
 """
 
+import time
 try:
     set
 except NameError:
@@ -66,14 +67,30 @@ class Person(person.Person):
 
 class ResultPersons(paged_search.PagedSearch):
     result_type = 'person'
+    # In keyset mode, used when the persons are ordered by their own
+    # columns, only the current page of persons (and their case keys) is
+    # fetched and retained, with pages located by seeking past the
+    # ordering values of the last person of the previous page (see
+    # paged_search.SortablePagedSearch). Otherwise every matching
+    # person_id and case_id is fetched up front.
+    keyset = True
+    order = None
+    keyset_page = None
+    keyset_pkeys = None
+    total = None
 
-    def __init__(self, search_ops, query, initial_cols=None, description=None):
+    def __init__(self, search_ops, query, initial_cols=None, description=None,
+                 person_order=None):
         paged_search.PagedSearch.__init__(self, globals.db, search_ops.prefs, 
                                           'persons')
         self.search_ops = search_ops
         self.initial_cols = initial_cols
         self.description = description
         self.results_per_page = self.search_ops.prefs.get('persons_per_page')
+        self.query = query
+        if self.keyset and person_order is not None:
+            self.order = paged_search.keyset_order(
+                                globals.db.get_table('persons'), person_order)
         self.fetch_pkeys(query)
         # Can't use page_search.PagerSelect logic, because we're interested in
         # case_ids, not person_ids.
@@ -81,16 +98,37 @@ class ResultPersons(paged_search.PagedSearch):
         self.page_case_ids = set()
         self.page_selected = []
 
+    def new_search(self):
+        paged_search.PagedSearch.new_search(self)
+        self.boundaries = {}
+        self.total = None
+        self.keyset_page = None
+        self.keyset_pkeys = None
+
+    def __len__(self):
+        if self.order is not None:
+            return self.result_count()
+        return paged_search.PagedSearch.__len__(self)
+
     def single_case(self):
         """
         If search returned only one case, return the case_id
         """
+        if self.order is not None:
+            if self.result_count() == 1:
+                person_id, case_ids = self.page_pkeys()[0]
+                if len(case_ids) == 1:
+                    return case_ids[0]
+            return None
         if len(self.pkeys) == 1:
             person_id, case_ids = self.pkeys[0]
             if len(case_ids) == 1:
                 return case_ids[0]
 
     def fetch_pkeys(self, query):
+        if self.order is not None:
+            self.fetch_keyset_page(query)
+            return
         keys = []
         persons_keys = {}
         for person_id, case_id in query.fetchcols(('person_id', 'case_id')):
@@ -102,6 +140,63 @@ class ResultPersons(paged_search.PagedSearch):
                 person_keys.append(case_id)
         self.pkeys = keys
 
+    def fetch_keyset_page(self, query):
+        st = time.time()
+        page = self.cur_page()
+        # Page over the matching persons ...
+        match = query.copy()
+        match.order_by = None
+        match_expr, match_args = match.build_expr(['persons.person_id'])
+        persons_query = globals.db.query('persons')
+        persons_query.where('persons.person_id IN (%s)' % match_expr,
+                            *match_args)
+        person_ids = [pkey[0] for pkey in 
+                      paged_search.keyset_page_pkeys(persons_query, self.order,
+                                                     self.boundaries, page,
+                                                     self.page_length())]
+        # ... then collect the case keys for this page's persons only
+        persons_keys = {}
+        for person_id in person_ids:
+            persons_keys[person_id] = []
+        if person_ids:
+            query = query.copy()
+            query.where_in('persons.person_id', person_ids)
+            for person_id, case_id in query.fetchcols(('persons.person_id', 
+                                                       'cases.case_id')):
+                persons_keys[person_id].append(case_id)
+        if page == 1:
+            self.empty = not person_ids
+            if self.empty:
+                self.total = 0
+        self.keyset_page = page
+        self.keyset_pkeys = [(person_id, persons_keys[person_id])
+                             for person_id in person_ids]
+        self.search_time = time.time() - st
+
+    def result_count(self):
+        if self.order is not None:
+            if self.total is None:
+                query = self.query.copy()
+                query.order_by = None
+                self.total = query.aggregate(
+                                'count(DISTINCT persons.person_id)')
+            return self.total
+        return paged_search.PagedSearch.result_count(self)
+
+    def page_pkeys(self):
+        if self.order is not None:
+            if self.keyset_page != self.cur_page():
+                self.fetch_keyset_page(self.query)
+            return self.keyset_pkeys
+        return paged_search.PagedSearch.page_pkeys(self)
+
+    def search_order(self):
+        """
+        The query ordering of all cases, grouped by person, in keyset mode
+        """
+        return [col + (desc and ' DESC' or '') for col, desc in self.order] +\
+               ['notification_datetime']
+
     def new_button(self):
         return self.search_ops.button_new()
 
@@ -121,6 +216,9 @@ class ResultPersons(paged_search.PagedSearch):
         self._selected_to_page()
 
     def select_all(self):
+        if self.order is not None:
+            self.select(self.query.fetchcols('cases.case_id'))
+            return
         case_ids = set()
         for person_id, person_case_ids in self.pkeys:
             case_ids.update(person_case_ids)
@@ -129,6 +227,13 @@ class ResultPersons(paged_search.PagedSearch):
     def get_selected(self):
         # Yield selected cases in search order
         self._page_to_selected()
+        if self.order is not None:
+            if not self.selected:
+                return []
+            query = self.query.copy()
+            query.where_in('cases.case_id', self.selected)
+            query.order_by = self.search_order()
+            return query.fetchcols('cases.case_id')
         selected = []
         for person_id, person_case_ids in self.pkeys:
             for case_id in person_case_ids:
@@ -137,13 +242,14 @@ class ResultPersons(paged_search.PagedSearch):
         return selected
 
     def page_rows(self):
-        if not self.pkeys:
+        page_pkeys = self.page_pkeys()
+        if not page_pkeys:
             return []
         # Collect ordering and linking information
         self._page_to_selected()
         person_ids = []
         self.page_case_ids = set()
-        for person_id, person_case_ids in self.page_pkeys():
+        for person_id, person_case_ids in page_pkeys:
             person_ids.append(person_id)
             self.page_case_ids.update(person_case_ids)
         self._selected_to_page()
@@ -163,7 +269,7 @@ class ResultPersons(paged_search.PagedSearch):
         cases_tags = casetags.CasesTags(self.page_case_ids)
         # Now collate
         result = []
-        for person_id, person_case_ids in self.page_pkeys():
+        for person_id, person_case_ids in page_pkeys:
             try:
                 person = person_map[person_id]
             except KeyError:
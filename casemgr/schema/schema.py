@@ -152,6 +152,7 @@ def define_db(dsn):
     td.add_index('p_locality_idx', ['locality'])
     td.add_index('p_state_idx', ['state'])
     td.add_index('p_postcode_idx', ['postcode'])
+    td.add_index('p_last_update_idx', ['last_update'])
     td.add_index('p_alt_locality_idx', ['alt_locality'])
     td.add_index('p_alt_state_idx', ['alt_state'])
     td.add_index('p_alt_postcode_idx', ['alt_postcode'])
@@ -334,6 +335,19 @@ def define_db(dsn):
     td.add_index('cacl_unit_idx', ['unit_id'])
     td.add_index('cacl_case_idx', ['case_id'])
 
+    # Materialised case_acl and task access (see caseaccess)
+    td = db.new_table('case_visibility')
+    td.column('unit_id', ReferenceColumn, 
+              references = 'units', on_delete = 'cascade')
+    td.column('user_id', ReferenceColumn, 
+              references = 'users', on_delete = 'cascade')
+    td.column('case_id', ReferenceColumn, 
+              references = 'cases', on_delete = 'cascade')
+    td.column('via_task', BooleanColumn)
+    td.add_index('cv_unit_idx', ['unit_id', 'case_id'])
+    td.add_index('cv_user_idx', ['user_id', 'case_id'])
+    td.add_index('cv_case_idx', ['case_id'])
+
     td = db.new_table('case_form_summary')
     td.column('summary_id', SerialColumn, primary_key = True)
     td.column('case_id', ReferenceColumn, references = 'cases', 
@@ -863,3 +863,16 @@ class _UG(Upgrades):
         c('UPDATE persons SET DOB_prec = '
             'CASE WHEN dob_is_approx THEN 366 ELSE 0 END')
         c('ALTER TABLE persons DROP COLUMN DOB_is_approx')
+
+class _UG(Upgrades):
+    """
+    materialised case visibility (case_acl and task access)
+    """
+
+    def test(self):
+        return self.has_relation('case_visibility')
+
+    def upgrade(c):
+        from casemgr import caseaccess
+        c.db.get_table('case_visibility').create()
+        caseaccess.rebuild(c.db)
@@ -179,6 +179,7 @@ class Search(SearchOrderMixin):
         order_by = self.order_by_cols()
         if self.reverse:
             order_by = [col + ' DESC' for col in order_by]
+        person_order = list(order_by)
         order_by.append('notification_datetime')
         query = globals.db.query('persons', order_by=order_by)
         query.join('JOIN cases USING (person_id)')
@@ -193,7 +194,7 @@ class Search(SearchOrderMixin):
         self.result = resultpersons.ResultPersons(
             self.search_ops, query,
             initial_cols=self.order_by_cols(),
-            description=description)
+            description=description, person_order=person_order)
 
     def get_demog_fields(self):
         fields = demogfields.get_demog_fields(globals.db, self.syndrome_id)
@@ -21,9 +21,10 @@ try:
 except NameError:
     from sets import Set as set
 
+import time
 from mx import DateTime
 from cocklebur import dbobj, datetime
-from casemgr import globals, paged_search, unituser, cached
+from casemgr import globals, paged_search, unituser, cached, caseaccess
 import config
 
 class TaskError(globals.Error): pass
@@ -165,29 +166,113 @@ def user_workqueues(credentials):
     return query.fetchall()
 
 
-class QueueStats(cached.Cached):
+class QueueCounts(object):
+    """
+    Task counts by queue_id (None for all queues), shared by all users
+    of the application process, and counted with a single aggregate
+    query.
+
+    The counts of a queue are discarded when its tasks change (the
+    "queuestats" notification), or when the next of its active tasks
+    falls due (so the overdue count is exact). As the notification may
+    be sent before the change is committed, counts loaded within
+    settle_time of a notification are not retained. Without the
+    notification daemon, counts are kept for time_to_live.
+    """
+    settle_time = 10
+    time_to_live = 120
+
+    def __init__(self):
+        self.counts = {}
+        self.changed = {}
+        self.subscribed = False
+
+    def subscribe(self):
+        if not self.subscribed:
+            self.subscribed = True
+            if globals.notify.subscribe('queuestats', self.notification):
+                self.time_to_live *= 10
+
+    def notification(self, *args):
+        now = time.time()
+        # The counts for all queues change with any queue
+        queue_ids = [None]
+        for arg in args:
+            if arg != 'None':
+                queue_ids.append(int(arg))
+        for queue_id in queue_ids:
+            self.changed[queue_id] = now
+            self.counts.pop(queue_id, None)
+
+    def load(self, queue_id):
+        """
+        Returns (total, active, overdue, completed, locked) and the due
+        date of the next active task to become overdue (or None)
+        """
+        query = globals.db.query('tasks')
+        if queue_id is not None:
+            query.where('queue_id = %s', queue_id)
+        now = DateTime.now()
+        cols = (
+            'count(*)',
+            'count(completed_date)',
+            'sum(CASE WHEN completed_date IS NULL AND due_date < %s'
+                ' THEN 1 ELSE 0 END)',
+            'sum(CASE WHEN completed_date IS NULL AND locked_by_id IS NOT NULL'
+                ' THEN 1 ELSE 0 END)',
+            'min(CASE WHEN completed_date IS NULL AND due_date >= %s'
+                ' THEN due_date END)',
+        )
+        query_expr, query_args = query.build_expr(cols)
+        curs = globals.db.cursor()
+        try:
+            dbobj.execute(curs, query_expr, [now, now] + query_args)
+            total, completed, overdue, locked, next_due = curs.fetchone()
+        finally:
+            curs.close()
+        # sum() of no rows is NULL
+        counts = total, total - completed, overdue or 0, completed, locked or 0
+        return counts, next_due
+
+    def get(self, queue_id):
+        self.subscribe()
+        now = time.time()
+        try:
+            load_time, next_due, counts = self.counts[queue_id]
+        except KeyError:
+            pass
+        else:
+            if (load_time + self.time_to_live > now and 
+                    (next_due is None or next_due > DateTime.now())):
+                return counts
+            del self.counts[queue_id]
+        counts, next_due = self.load(queue_id)
+        changed = max(self.changed.get(queue_id, 0), self.changed.get(None, 0))
+        if now > changed + self.settle_time:
+            self.counts[queue_id] = now, next_due, counts
+        return counts
+
+queue_counts = QueueCounts()
+
+
+def queue_changed(*queue_ids):
+    """
+    The tasks of /queue_ids/ have changed, send notification
+    """
+    globals.notify.notify('queuestats', *queue_ids)
+
+
+class QueueStats:
+    """
+    Task counts of a queue (or all queues if queue_id is None)
+    """
     def __init__(self, queue_id):
         self.queue_id = queue_id
         self.refresh()
 
-    def load(self):
-        query = globals.db.query('tasks')
-        if self.queue_id is not None:
-            query.where('queue_id = %s', self.queue_id)
-        now = datetime.now()
-        self.total = self.completed = self.active =\
-            self.overdue = self.locked = 0
-        cols = 'due_date', 'completed_date', 'locked_by_id'
-        for due_date, completed_date, locked_by_id in query.fetchcols(cols):
-            self.total += 1
-            if completed_date is None:
-                self.active += 1
-                if due_date < now:
-                    self.overdue += 1
-                if locked_by_id is not None:
-                    self.locked += 1
-            else:
-                self.completed += 1
+    def refresh(self):
+        self.total, self.active, self.overdue, self.completed, self.locked =\
+            queue_counts.get(self.queue_id)
 
     def __iter__(self):
         self.refresh()
@@ -208,7 +293,10 @@ def delete_queue(queue_id):
     query = globals.db.query('tasks')
     query.where('queue_id = %s', queue_id)
     query.where('completed_date is not null')
+    case_ids = query.fetchcols('case_id')
     query.delete()
+    caseaccess.refresh_cases(globals.db, set(case_ids))
+    queue_changed(queue_id)
     try:
         queue.db_delete()
     except dbobj.ConstraintError:
@@ -488,12 +576,15 @@ class EditTask(_TaskBase):
             self.form_name = form_name
 
     def _update(self, db, inplace=False, complete=False):
+        seed_case_id = seed_queue_id = None
         if inplace:
             # Update in place
             task = self._locked_fetch(db, self.seed_task_id, self.this_user_id)
             if task is None:
                 raise TaskError('Update failed - the task has been changed'
                                 ' by another user')
+            seed_case_id = task.case_id
+            seed_queue_id = task.queue_id
             _set_unlocked(task)
             _clear_completed(task)
         else:
@@ -504,6 +595,7 @@ class EditTask(_TaskBase):
                     _set_unlocked(task)
                 _set_completed(task, self.this_user_id)
                 task.db_update()
+                seed_queue_id = task.queue_id
             task = db.new_row('tasks')
             task.parent_task_id = self.seed_task_id
             task.creation_date = datetime.now()
@@ -553,6 +645,8 @@ class EditTask(_TaskBase):
                 if task.due_date:
                     task.due_date += repeat_delta
                 task.db_update()
+        caseaccess.refresh_cases(db, set([seed_case_id, task.case_id]))
+        queue_changed(*set([seed_queue_id, task.queue_id]))
         globals.notify.notify('taskdesc')
 
     def update(self, db):
@@ -597,6 +691,7 @@ class LockedTask(_TaskBase):
         task.locked_by_id = self.user_id
         task.locked_date = datetime.now()
         task.db_update()
+        queue_changed(task.queue_id)
 
     def unlock(self, db):
         task = self._locked_fetch(db, self.task_id, self.user_id)
@@ -604,6 +699,7 @@ class LockedTask(_TaskBase):
             return
         _set_unlocked(task)
         task.db_update()
+        queue_changed(task.queue_id)
 
     def same_entity(self, action, case_id, form_name=None, summary_id=None):
         return same_entity(self, action, case_id, form_name, summary_id)
@@ -625,7 +721,10 @@ class LockedTask(_TaskBase):
         if not same_entity(task, action, case_id, form_name, summary_id):
             return
         self.done = True
+        case_changed = task.case_id != case_id
         task.case_id = self.case_id = case_id
         task.form_name = self.form_name = form_name
         task.summary_id = self.summary_id = summary_id
         task.db_update()
+        if case_changed:
+            caseaccess.refresh_cases(db, [case_id])
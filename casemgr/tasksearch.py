@@ -78,6 +78,7 @@ class TaskSearchParams:
             
 
 class TaskSearch(paged_search.SortablePagedSearch):
+    keyset = True
     orders = [
         ('due_date,active_date', 'Due Date'),
         ('active_date', 'Active Date'),
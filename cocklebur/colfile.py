@@ -0,0 +1,244 @@
+#
+#   The contents of this file are subject to the HACOS License Version 1.2
+#   (the "License"); you may not use this file except in compliance with
+#   the License.  Software distributed under the License is distributed
+#   on an "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, either express or
+#   implied. See the LICENSE file for the specific language governing
+#   rights and limitations under the License.  The Original Software
+#   is "NetEpi Collection". The Initial Developer of the Original
+#   Software is the Health Administration Corporation, incorporated in
+#   the State of New South Wales, Australia.
+#
+#   Copyright (C) 2004-2011 Health Administration Corporation, Australian
+#   Government Department of Health and Ageing, and others.
+#   All Rights Reserved.
+#
+#   Contributors: See the CONTRIBUTORS file for details of contributions.
+#
+"""
+Typed, compressed column files.
+
+A column file holds a table as a sequence of "row groups", each of which
+holds a block of rows stored column by column. Files are written a row
+group at a time, so large tables can be streamed. The layout is:
+
+    NECOLFILE 1\\n
+    byteorder=little int=8 len=4\\n     array byte order and item sizes
+    <number of columns>\\n
+    <kind>\\t<name>\\n                   for each column
+    then for each row group:
+        "G", row count (4 bytes, big endian)
+        for each column: block length (4 bytes, big endian), and the
+        zlib compressed block
+    "E"
+
+Column kinds, and their uncompressed blocks:
+
+    bool, int, float    null mask (a byte per row, 1 if null), then the
+                        values as an array of unsigned char, signed
+                        long ("int" bytes) or double (0 where null)
+    date                as float, the values being mx "absdays" (days
+                        since 1 Jan 1 AD, time of day as a fraction)
+    str                 the string lengths as an array of signed int
+                        ("len" bytes, -1 where null), then the strings
+
+Numeric blocks can be loaded without conversion (for example, with
+numpy.frombuffer).
+"""
+
+import sys
+import zlib
+import struct
+from array import array
+
+from mx import DateTime
+
+MAGIC = 'NECOLFILE 1\n'
+
+kinds = {
+    # kind: array typecode
+    'bool': 'B',
+    'int': 'l',
+    'float': 'd',
+    'date': 'd',
+    'str': None,
+}
+
+class ColumnFileError(Exception): pass
+
+
+def _bool(value):
+    if value:
+        return 1
+    return 0
+
+def _absdays(value):
+    return value.absdays
+
+encoders = {
+    'bool': _bool,
+    'int': int,
+    'float': float,
+    'date': _absdays,
+}
+
+
+class ColumnFileWriter:
+
+    def __init__(self, f, columns, level=6):
+        """
+        /columns/ is a list of (name, kind) tuples
+        """
+        for name, kind in columns:
+            if kind not in kinds:
+                raise ColumnFileError('unknown column kind %r' % kind)
+        self.f = f
+        self.level = level
+        self.kinds = [kind for name, kind in columns]
+        self.row_count = 0
+        f.write(MAGIC)
+        f.write('byteorder=%s int=%d len=%d\n' %
+                (sys.byteorder, array('l').itemsize, array('i').itemsize))
+        f.write('%d\n' % len(columns))
+        for name, kind in columns:
+            name = name.replace('\t', ' ').replace('\n', ' ')
+            f.write('%s\t%s\n' % (kind, name))
+
+    def _encode(self, kind, values):
+        if kind == 'str':
+            lengths = array('i')
+            strings = []
+            for value in values:
+                if value is None:
+                    lengths.append(-1)
+                else:
+                    value = str(value)
+                    lengths.append(len(value))
+                    strings.append(value)
+            return lengths.tostring() + ''.join(strings)
+        encode = encoders[kind]
+        nulls = array('B')
+        data = array(kinds[kind])
+        for value in values:
+            if value is None:
+                nulls.append(1)
+                data.append(0)
+            else:
+                nulls.append(0)
+                data.append(encode(value))
+        return nulls.tostring() + data.tostring()
+
+    def write_rows(self, rows):
+        """
+        Write a list of rows (sequences of column values) as a row group
+        """
+        if not rows:
+            return
+        ncols = len(self.kinds)
+        for row in rows:
+            if len(row) != ncols:
+                raise ColumnFileError('row has %d columns, expected %d' %
+                                      (len(row), ncols))
+        self.f.write('G' + struct.pack('>I', len(rows)))
+        for i, kind in enumerate(self.kinds):
+            block = zlib.compress(self._encode(kind, [row[i] for row in rows]),
+                                  self.level)
+            self.f.write(struct.pack('>I', len(block)))
+            self.f.write(block)
+        self.row_count += len(rows)
+
+    def close(self):
+        self.f.write('E')
+
+
+class ColumnFileReader:
+
+    def __init__(self, f):
+        self.f = f
+        if f.readline() != MAGIC:
+            raise ColumnFileError('not a column file')
+        params = dict([field.split('=', 1)
+                       for field in f.readline().split()])
+        self.swap = params['byteorder'] != sys.byteorder
+        if (int(params['int']) != array('l').itemsize
+                or int(params['len']) != array('i').itemsize):
+            raise ColumnFileError('column file integer sizes not supported')
+        self.columns = []
+        for i in range(int(f.readline())):
+            kind, name = f.readline().rstrip('\n').split('\t', 1)
+            self.columns.append((name, kind))
+
+    def _read(self, size):
+        data = self.f.read(size)
+        if len(data) != size:
+            raise ColumnFileError('truncated column file')
+        return data
+
+    def _decode(self, kind, count, block):
+        if kind == 'str':
+            lengths = array('i')
+            split = count * lengths.itemsize
+            lengths.fromstring(block[:split])
+            if self.swap:
+                lengths.byteswap()
+            values = []
+            offset = split
+            for length in lengths:
+                if length < 0:
+                    values.append(None)
+                else:
+                    values.append(block[offset:offset+length])
+                    offset += length
+            return values, None
+        nulls = array('B', block[:count])
+        data = array(kinds[kind])
+        data.fromstring(block[count:])
+        if self.swap:
+            data.byteswap()
+        return data, nulls
+
+    def groups(self):
+        """
+        Yields each row group as a list of (values, nulls) column tuples.
+        For "str" columns, values is a list (None for nulls) and nulls is
+        None, otherwise both are arrays.
+        """
+        while True:
+            marker = self._read(1)
+            if marker == 'E':
+                break
+            if marker != 'G':
+                raise ColumnFileError('corrupt column file')
+            count, = struct.unpack('>I', self._read(4))
+            group = []
+            for name, kind in self.columns:
+                size, = struct.unpack('>I', self._read(4))
+                block = zlib.decompress(self._read(size))
+                group.append(self._decode(kind, count, block))
+            yield group
+
+    def _values(self, kind, values, nulls):
+        if nulls is None:
+            return values
+        if kind == 'bool':
+            values = map(bool, values)
+        elif kind == 'date':
+            values = map(DateTime.DateTimeFromAbsDays, values)
+        else:
+            values = values.tolist()
+        for i, null in enumerate(nulls):
+            if null:
+                values[i] = None
+        return values
+
+    def rows(self):
+        """
+        Yields the rows as tuples of python values (None for nulls,
+        mx.DateTime for dates)
+        """
+        col_kinds = [kind for name, kind in self.columns]
+        for group in self.groups():
+            columns = [self._values(kind, values, nulls)
+                       for kind, (values, nulls) in zip(col_kinds, group)]
+            for row in zip(*columns):
+                yield row
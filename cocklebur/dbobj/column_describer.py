@@ -64,6 +64,10 @@ class ColumnType:
             col.append('DEFAULT %s' % self.default)
         col_sql.append(' '.join(col))
 
+    def cast_type(self):
+        """ Type used to cast parameters destined for this column """
+        return self.sql_type()
+
     def initial_value(self):
         return None
 
@@ -92,6 +96,10 @@ class StringColumn(ColumnType):
         else:
             return 'TEXT'
 
+    def cast_type(self):
+        # Let assignment to the column check the length
+        return 'TEXT'
+
 
 class PasswdColumn(StringColumn):
     # At this time, a password column is just a string column that knows to
@@ -377,6 +385,9 @@ class ReferenceColumn(ColumnType):
             sql.append('ON UPDATE %s' % self.on_update)
         return ' '.join(sql)
 
+    def cast_type(self):
+        return self.target_column().cast_type()
+
     def to_sql(self, value):
         ref_col_desc = self.target_column()
         return ref_col_desc.to_sql(value)
@@ -0,0 +1,135 @@
+#
+#   The contents of this file are subject to the HACOS License Version 1.2
+#   (the "License"); you may not use this file except in compliance with
+#   the License.  Software distributed under the License is distributed
+#   on an "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, either express or
+#   implied. See the LICENSE file for the specific language governing
+#   rights and limitations under the License.  The Original Software
+#   is "NetEpi Collection". The Initial Developer of the Original
+#   Software is the Health Administration Corporation, incorporated in
+#   the State of New South Wales, Australia.
+#
+#   Copyright (C) 2004-2011 Health Administration Corporation, Australian
+#   Government Department of Health and Ageing, and others.
+#   All Rights Reserved.
+#
+#   Contributors: See the CONTRIBUTORS file for details of contributions.
+#
+"""
+Column oriented query results (see Query.fetchcols_columnar).
+
+Each result column is held in a typed array (array.array), with a
+parallel null mask, rather than as a list of row tuples, so callers can
+bin and tally without a Python object per value (with NumPy, the arrays
+can be wrapped with numpy.frombuffer() without copying).
+
+The array type is chosen from the first non-null value of the column:
+
+    bool                        'bool', typecode 'B'
+    int, long                   'int', typecode 'l'
+    float                       'float', typecode 'd'
+    mx.DateTime                 'date', typecode 'd' - day ordinals
+                                (mx "absdays", days since 1 Jan 1 AD,
+                                with the time of day as a fraction)
+
+Anything else (strings, Decimal), or a column whose later values do not
+fit, is kept as a list ('object'). Null values are stored as zero (None
+for 'object' columns) and flagged in the null mask.
+"""
+
+from array import array
+
+from mx import DateTime
+
+
+def _same(value):
+    return value
+
+def _absdays(value):
+    return value.absdays
+
+
+class ResultColumn(object):
+
+    kinds = {
+        # kind: (typecode, converter)
+        'bool': ('B', int),
+        'int': ('l', _same),
+        'float': ('d', _same),
+        'date': ('d', _absdays),
+    }
+
+    def __init__(self, name):
+        self.name = name
+        self.kind = None
+        self.values = []
+        self.nulls = array('B')
+
+    def __len__(self):
+        return len(self.nulls)
+
+    def null_count(self):
+        return self.nulls.count(1)
+
+    def _set_kind(self, value):
+        if isinstance(value, bool):
+            kind = 'bool'
+        elif isinstance(value, (int, long)):
+            kind = 'int'
+        elif isinstance(value, float):
+            kind = 'float'
+        elif isinstance(value, DateTime.DateTimeType):
+            kind = 'date'
+        else:
+            kind = 'object'
+        self.kind = kind
+        if kind != 'object':
+            # Any preceding values were nulls
+            self.values = array(self.kinds[kind][0], [0]) * len(self.values)
+
+    def extend(self, values):
+        """
+        Append a batch of values
+        """
+        if self.kind is None:
+            for value in values:
+                if value is not None:
+                    self._set_kind(value)
+                    break
+        if self.kind is not None and self.kind != 'object':
+            typecode, convert = self.kinds[self.kind]
+            try:
+                data = array(typecode, [value is not None and convert(value)
+                                        or 0 for value in values])
+            except (TypeError, OverflowError, AttributeError):
+                # A value doesn't fit the array type
+                self.values = self.tolist()
+                self.kind = 'object'
+            else:
+                self.values.extend(data)
+        if self.kind is None or self.kind == 'object':
+            self.values.extend(values)
+        self.nulls.extend(array('B', [value is None for value in values]))
+
+    def tolist(self):
+        """
+        The column values as a list, with None for nulls (and dates as
+        mx.DateTime)
+        """
+        if self.kind is None or self.kind == 'object':
+            return list(self.values)
+        if self.kind == 'date':
+            values = map(DateTime.DateTimeFromAbsDays, self.values)
+        elif self.kind == 'bool':
+            values = map(bool, self.values)
+        else:
+            values = self.values.tolist()
+        for i, null in enumerate(self.nulls):
+            if null:
+                values[i] = None
+        return values
+
+    def __repr__(self):
+        return '<%s %s %s, %d values, %d null>' %\
+                (self.__class__.__name__, self.name, self.kind,
+                 len(self), self.null_count())
@@ -16,7 +16,9 @@
 #   Contributors: See the CONTRIBUTORS file for details of contributions.
 #
 import os
+import re
 import sys
+import copy
 import time
 import cPickle
 import weakref
@@ -27,7 +29,7 @@ except NameError:
 
 from cocklebur.dbobj import dbapi, query_builder, table_describer, result, \
                             table_dict, participation_table, misc
-from cocklebur.dbobj.execute import execute, commit, rollback
+from cocklebur.dbobj.execute import execute, commit, rollback, stmt_cache
 
 def order_by_dependancies(objs, debug = 0):
     """ Order some collection of objects to satisfy dependancies """
@@ -140,11 +142,13 @@ class DatabaseDescriberCore:
             dsn = DSN(dsn, **kwargs)
         self.dsn = dsn
         self.db = None
+        self.stmt_cache = None
         self.updated = True
         self.filename = str(self.dsn)
         self.mtime = 0
         self.clear_pending()
         self._invalidate_sys_info()
+        self.__server_version = None
         self.table_describers = {}
 
     def _invalidate_sys_info(self):
@@ -165,6 +169,8 @@ class DatabaseDescriberCore:
             if st.st_mtime > self.mtime:
                 self.mtime = st.st_mtime
                 self._invalidate_sys_info()
+                if self.stmt_cache is not None:
+                    self.stmt_cache.invalidate()
                 self.table_describers, = cPickle.load(f)
                 for table_desc in self.table_describers.values():
                     table_desc.db = self
@@ -343,6 +349,45 @@ class DatabaseDescriberCore:
             if 'does not exist' not in str(e):
                 raise
 
+    def server_version(self):
+        """
+        The database server version as a tuple, eg (8, 3)
+        """
+        if self.__server_version is None:
+            curs = self.cursor()
+            try:
+                execute(curs, 'SELECT version()')
+                version = curs.fetchone()[0]
+            finally:
+                curs.close()
+            # eg "PostgreSQL 8.3.7 on i486-pc-linux-gnu, compiled by ..."
+            match = re.match(r'\S+\s+(\d+)\.(\d+)', version)
+            if match:
+                self.__server_version = tuple(map(int, match.groups()))
+            else:
+                self.__server_version = ()
+        return self.__server_version
+
+    def batch_writes(self):
+        """
+        Can update_rows() batch rows (requires multi-row VALUES and
+        RETURNING)?
+        """
+        return self.server_version() >= (8, 2)
+
+    def array_params(self):
+        """
+        Can "IN" tests be passed as an array ("col = ANY (array)" only
+        uses indexes from 8.2)?
+        """
+        return self.server_version() >= (8, 2)
+
+    def update_rows(self, rows, refetch=True):
+        """
+        Write changes to a collection of ResultRows, batching statements
+        """
+        result.db_update_rows(rows, refetch=refetch)
+
     def db_has_relation(self, name):
         if self.__sys_relations is None:
             self._get_sys_info()
@@ -351,6 +396,8 @@ class DatabaseDescriberCore:
     # Proxy to Database API connection objects
     def _connect_db(self):
         self.db = self.dsn.connect()
+        self.__server_version = None
+        self.stmt_cache = stmt_cache()
         curs = self.db.cursor()
         try:
             execute(curs, "SET datestyle TO 'ISO,European'")
@@ -392,20 +439,28 @@ class DatabaseDescriberCore:
     def cursor(self):
         if self.db is None:
             self._connect_db()
-            return self.db.cursor()
+            return self._cursor()
         try:
-            return self.db.cursor()
+            return self._cursor()
         except dbapi.OperationalError, e:
             print >> sys.stderr, 'RETRYING - %s' % e
             self.close()
             self._connect_db()
-            return self.db.cursor()
+            return self._cursor()
+
+    def _cursor(self):
+        curs = self.db.cursor()
+        if self.stmt_cache is not None:
+            # execute() finds the connection's prepared statements here
+            curs.stmt_cache = self.stmt_cache
+        return curs
 
     def close(self):
         if self.db is not None:
             self.clear_pending()
             self.db.close()
             self.db = None
+            self.stmt_cache = None
 #            import traceback
 #            traceback.print_stack()
 
@@ -413,6 +468,21 @@ class DatabaseDescriberCore:
         if self.db is not None:
             self.close()
 
+    def new_connection(self):
+        """
+        Return a describer for the same database with its own connection
+        (and so its own transaction), sharing the table descriptions. It
+        can be used by another thread, and should be closed when done.
+        """
+        db = DatabaseDescriberCore(self.dsn)
+        db.filename = self.filename
+        db.mtime = self.mtime
+        for name, table_desc in self.table_describers.iteritems():
+            table_desc = copy.copy(table_desc)
+            table_desc.db = db
+            db.table_describers[name] = table_desc
+        return db
+
     def lock_table(self, table, mode, wait=True):
         cmd = 'LOCK %s IN %s MODE' % (table, mode)
         if not wait:
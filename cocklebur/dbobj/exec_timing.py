@@ -15,31 +15,282 @@
 #
 #   Contributors: See the CONTRIBUTORS file for details of contributions.
 #
+"""
+SQL instrumentation, enabled by dbobj.execute_timing().
+
+Statements are recorded by "shape" (the SQL text, with runs of
+placeholders collapsed, so where_in() queries of different lengths are
+counted together). The application brackets each request with
+begin_request() and end_request(page), which accumulates per-page query
+counts, rows, and request and database latencies, and notes statement
+shapes executed more than /nplus1/ times in a single request (usually a
+query issued once per row of an earlier query - an "N+1" pattern).
+
+Latency percentiles are calculated from the most recent SAMPLES
+observations.
+"""
+
+import os
+import re
+import time
+import tempfile
+
+SAMPLES = 1000
+
+_placeholders_re = re.compile(r'%s(\s*,\s*%s)+')
+
+def shape(cmd):
+    return _placeholders_re.sub('%s,...', cmd)
+
+
+class Samples(object):
+    """
+    The last SAMPLES observations of a quantity, for percentiles
+    """
+    __slots__ = 'values', 'pos'
+
+    def __init__(self):
+        self.values = []
+        self.pos = 0
+
+    def record(self, value):
+        if len(self.values) < SAMPLES:
+            self.values.append(value)
+        else:
+            self.values[self.pos] = value
+            self.pos = (self.pos + 1) % SAMPLES
+
+    def percentile(self, pc):
+        if not self.values:
+            return 0.0
+        values = list(self.values)
+        values.sort()
+        # Nearest rank
+        rank = int(len(values) * pc / 100.0 + 0.5)
+        return values[max(0, min(rank, len(values)) - 1)]
+
+    def percentiles(self):
+        return self.percentile(50), self.percentile(95), self.percentile(99)
+
 
 class ExecCmdTiming(object):
 
-    __slots__ = 'total', 'count'
+    __slots__ = 'total', 'count', 'rows', 'samples'
 
     def __init__(self):
         self.total = 0.0
         self.count = 0
+        self.rows = 0
+        self.samples = Samples()
 
-    def record(self, el):
+    def record(self, el, rows=0):
         self.total += el
         self.count += 1
+        self.rows += rows
+        self.samples.record(el)
 
 
-class ExecTiming:
+class PageTiming(object):
+
+    __slots__ = ('requests', 'queries', 'rows', 'db_total', 
+                 'elapsed', 'db_elapsed')
 
     def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.rows = 0
+        self.db_total = 0.0
+        self.elapsed = Samples()
+        self.db_elapsed = Samples()
+
+    def record(self, el, queries, rows, db_el):
+        self.requests += 1
+        self.queries += queries
+        self.rows += rows
+        self.db_total += db_el
+        self.elapsed.record(el)
+        self.db_elapsed.record(db_el)
+
+
+class NPlusOne(object):
+
+    __slots__ = 'requests', 'max_repeats'
+
+    def __init__(self):
+        self.requests = 0
+        self.max_repeats = 0
+
+    def record(self, repeats):
+        self.requests += 1
+        self.max_repeats = max(self.max_repeats, repeats)
+
+
+class ExecTiming:
+
+    def __init__(self, nplus1=10):
+        self.nplus1 = nplus1
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
         self.timings = {}
+        self.pages = {}
+        self.nplus1s = {}
+        self.prepared = {'hit': 0, 'miss': 0}
+        self.requests = 0
+        self.begin_request()
+
+    def begin_request(self):
+        self.req_start = time.time()
+        self.req_counts = {}
+        self.req_queries = 0
+        self.req_rows = 0
+        self.req_db = 0.0
 
-    def record(self, cmd, el):
+    def record(self, cmd, el, rows=0):
+        cmd = shape(cmd)
         try:
             ect = self.timings[cmd]
         except KeyError:
             ect = self.timings[cmd] = ExecCmdTiming()
-        ect.record(el)
+        ect.record(el, rows)
+        self.req_counts[cmd] = self.req_counts.get(cmd, 0) + 1
+        self.req_queries += 1
+        self.req_rows += rows
+        self.req_db += el
+
+    def record_prepared(self, status):
+        self.prepared[status] += 1
+
+    def end_request(self, page):
+        if not page:
+            page = 'unknown'
+        try:
+            pt = self.pages[page]
+        except KeyError:
+            pt = self.pages[page] = PageTiming()
+        pt.record(time.time() - self.req_start, 
+                  self.req_queries, self.req_rows, self.req_db)
+        for cmd, count in self.req_counts.iteritems():
+            if count > self.nplus1:
+                key = page, cmd
+                try:
+                    npo = self.nplus1s[key]
+                except KeyError:
+                    npo = self.nplus1s[key] = NPlusOne()
+                npo.record(count)
+        self.requests += 1
+        self.begin_request()
+
+    def top_statements(self, count=20):
+        """
+        The /count/ statements with the greatest total time, as
+        (shape, ExecCmdTiming) tuples
+        """
+        timings = [(ect.total, cmd, ect) 
+                   for cmd, ect in self.timings.iteritems()]
+        timings.sort()
+        timings.reverse()
+        return [(cmd, ect) for total, cmd, ect in timings[:count]]
+
+    def page_stats(self):
+        """
+        (page, PageTiming) tuples, greatest total database time first
+        """
+        pages = [(pt.db_total, page, pt) 
+                 for page, pt in self.pages.iteritems()]
+        pages.sort()
+        pages.reverse()
+        return [(page, pt) for db_total, page, pt in pages]
+
+    def nplus1_stats(self):
+        """
+        (page, shape, NPlusOne) tuples, most frequent first
+        """
+        stats = [(npo.requests, page, cmd, npo) 
+                 for (page, cmd), npo in self.nplus1s.iteritems()]
+        stats.sort()
+        stats.reverse()
+        return [(page, cmd, npo) for requests, page, cmd, npo in stats]
+
+    def prometheus(self, labels={}):
+        """
+        Return the statistics in the Prometheus text exposition format
+        """
+        def fmt_labels(**kw):
+            kw.update(labels)
+            items = kw.items()
+            items.sort()
+            return ','.join(['%s="%s"' % (k, _prom_escape(v)) 
+                             for k, v in items])
+        lines = []
+        def metric(name, type, help, values):
+            lines.append('# HELP dbobj_%s %s' % (name, help))
+            lines.append('# TYPE dbobj_%s %s' % (name, type))
+            for kw, value in values:
+                lines.append('dbobj_%s{%s} %s' % 
+                                (name, fmt_labels(**kw), _prom_value(value)))
+        def quantiles(samples, **kw):
+            for q, value in zip(('0.5', '0.95', '0.99'), 
+                                samples.percentiles()):
+                kw['quantile'] = q
+                yield dict(kw), value
+        pages = self.page_stats()
+        metric('requests_total', 'counter', 'Requests serviced, by page.',
+               [(dict(page=page), pt.requests) for page, pt in pages])
+        metric('queries_total', 'counter', 'SQL statements executed, by page.',
+               [(dict(page=page), pt.queries) for page, pt in pages])
+        metric('rows_total', 'counter', 'Rows returned or affected, by page.',
+               [(dict(page=page), pt.rows) for page, pt in pages])
+        values = []
+        for page, pt in pages:
+            values.extend(quantiles(pt.elapsed, page=page))
+        metric('request_seconds', 'summary', 'Request latency, by page.', 
+               values)
+        values = []
+        for page, pt in pages:
+            values.extend(quantiles(pt.db_elapsed, page=page))
+        metric('request_db_seconds', 'summary', 
+               'SQL time per request, by page.', values)
+        top = self.top_statements()
+        values = []
+        for cmd, ect in top:
+            values.extend(quantiles(ect.samples, statement=cmd))
+        metric('statement_seconds', 'summary', 
+               'Latency of the statements with the greatest total time.', 
+               values)
+        metric('statement_executions_total', 'counter', 
+               'Executions of the statements with the greatest total time.',
+               [(dict(statement=cmd), ect.count) for cmd, ect in top])
+        metric('nplus1_requests_total', 'counter', 
+               'Requests executing a statement more than %d times.' % 
+                    self.nplus1,
+               [(dict(page=page, statement=cmd), npo.requests)
+                for page, cmd, npo in self.nplus1_stats()])
+        metric('prepared_total', 'counter', 
+               'Prepared statement cache lookups.',
+               [(dict(result=status), count) 
+                for status, count in self.prepared.items()])
+        lines.append('')
+        return '\n'.join(lines)
+
+    def dump(self, filename, **labels):
+        """
+        Atomically write the Prometheus text format to /filename/ (for
+        example, for the node_exporter textfile collector)
+        """
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(filename))
+        f = os.fdopen(fd, 'w')
+        try:
+            f.write(self.prometheus(labels))
+            f.close()
+            os.chmod(tmpname, 0644)
+            os.rename(tmpname, filename)
+        finally:
+            try:
+                os.unlink(tmpname)
+            except OSError:
+                pass
 
     def __str__(self):
         report = ['Top 20 queries (av time, freq, cmd):']
@@ -48,8 +299,22 @@ class ExecTiming:
         timings.sort()
         for avg, freq, cmd in timings[-1:-20:-1]:
             report.append('   %.3fs %4d %s' % (avg, freq, cmd))
+        if self.prepared['hit'] or self.prepared['miss']:
+            report.append('Prepared statements: %d hits, %d misses' %
+                          (self.prepared['hit'], self.prepared['miss']))
         return '\n'.join(report)
 
+
+def _prom_escape(value):
+    value = str(value)
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _prom_value(value):
+    if isinstance(value, float):
+        return '%.6f' % value
+    return str(value)
+
+
 exec_timing = ExecTiming()
 
 def show():
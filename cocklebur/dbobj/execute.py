@@ -17,10 +17,13 @@
 #
 import sys
 from time import time
+from cStringIO import StringIO
 from cocklebur.dbobj import dbapi
+from cocklebur.dbobj.prepared import StatementCache
 
 debug = False
 timing = False
+prepare_size = 0
 
 def execute_debug(value):
     global debug
@@ -35,6 +38,22 @@ def execute_timing(value):
     if value:
         from exec_timing import exec_timing
 
+def execute_prepare(size):
+    """
+    Cache up to /size/ server-side prepared statements per connection
+    (0 disables the cache). Takes effect on the next connect.
+    """
+    global prepare_size
+    prepare_size = size
+
+def stmt_cache():
+    """
+    A new prepared statement cache for a connection, or None if disabled
+    """
+    if prepare_size:
+        return StatementCache(prepare_size)
+    return None
+
 prefix = '+'
 
 def execute(curs, cmd, args=()):
@@ -58,8 +77,12 @@ def execute(curs, cmd, args=()):
         raise dbapi.ProgrammingError('Only one command per execute() allowed')
     if debug or timing:
         st = time()
+    stmt_cache = getattr(curs, 'stmt_cache', None)
     try:
-        res = curs.execute(cmd, args)
+        if stmt_cache is None:
+            res = curs.execute(cmd, args)
+        else:
+            res, prepared = stmt_cache.execute(curs, cmd, args)
     except dbapi.Error, e:
         exc_type, exc_value, exc_tb = sys.exc_info()
         if 'duplicate key' in str(exc_value):
@@ -80,9 +103,69 @@ def execute(curs, cmd, args=()):
         if debug: 
             sys.stderr.write(pretty_cmd(cmd, args) + (' (%.3f secs)\n' % el))
         if timing:
-            exec_timing.record(cmd, el)
+            exec_timing.record(cmd, el, max(getattr(curs, 'rowcount', 0), 0))
+            if stmt_cache is not None and prepared:
+                exec_timing.record_prepared(prepared)
         return res
 
+def _copy_value(value):
+    if value is None:
+        return r'\N'
+    value = str(value)
+    for c, r in (('\\', '\\\\'), ('\t', '\\t'), ('\n', '\\n'), ('\r', '\\r')):
+        value = value.replace(c, r)
+    return value
+
+def copy_rows(curs, table, col_names, rows, batch_size=1000):
+    """
+    Bulk load an iterable of /rows/ (sequences of values for
+    /col_names/) into /table/, returning the number of rows loaded.
+
+    If the database adaptor supports it, rows are streamed with
+    COPY ... FROM STDIN, otherwise they are sent as multi-row INSERT
+    statements of /batch_size/ rows.
+    """
+    copy_from = getattr(curs, 'copy_from', None)
+    count = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            _copy_batch(curs, copy_from, table, col_names, batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        _copy_batch(curs, copy_from, table, col_names, batch)
+        count += len(batch)
+    return count
+
+def _copy_batch(curs, copy_from, table, col_names, batch):
+    if copy_from is not None:
+        if debug or timing:
+            st = time()
+        f = StringIO()
+        for row in batch:
+            f.write('\t'.join([_copy_value(v) for v in row]))
+            f.write('\n')
+        f.seek(0)
+        copy_from(f, table, columns=col_names)
+        if debug or timing:
+            el = time() - st
+            cmd = 'COPY %s (%s) FROM STDIN' % (table, ', '.join(col_names))
+        if debug:
+            sys.stderr.write('%s%s (%d rows, %.3f secs)\n' % 
+                             (prefix, cmd, len(batch), el))
+        if timing:
+            exec_timing.record(cmd, el, len(batch))
+    else:
+        values = '(%s)' % ', '.join(['%s'] * len(col_names))
+        cmd = 'INSERT INTO %s (%s) VALUES %s' % (table, ', '.join(col_names),
+                                           ', '.join([values] * len(batch)))
+        args = []
+        for row in batch:
+            args.extend(row)
+        execute(curs, cmd, args)
+
 def commit(db):
     if debug:
         sys.stderr.write(prefix + 'COMMIT\n')
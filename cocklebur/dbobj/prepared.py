@@ -0,0 +1,121 @@
+#
+#   The contents of this file are subject to the HACOS License Version 1.2
+#   (the "License"); you may not use this file except in compliance with
+#   the License.  Software distributed under the License is distributed
+#   on an "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, either express or
+#   implied. See the LICENSE file for the specific language governing
+#   rights and limitations under the License.  The Original Software
+#   is "NetEpi Collection". The Initial Developer of the Original
+#   Software is the Health Administration Corporation, incorporated in
+#   the State of New South Wales, Australia.
+#
+#   Copyright (C) 2004-2011 Health Administration Corporation, Australian
+#   Government Department of Health and Ageing, and others.
+#   All Rights Reserved.
+#
+#   Contributors: See the CONTRIBUTORS file for details of contributions.
+#
+"""
+Per-connection cache of server-side prepared statements.
+
+A statement is PREPAREd the first time its SQL text is seen, and later
+executions of the same text are sent as EXECUTE <name> (<args>), saving
+the server from re-parsing and re-planning it. The dbapi adapters
+interpolate arguments client side, so parameters are renumbered from
+pyformat %s to $1..$n, and the server infers their types.
+
+If the server can't prepare a statement (for example, a parameter whose
+type can't be inferred), the attempt is rolled back to a savepoint and
+the statement is remembered as unpreparable.
+"""
+
+import itertools
+
+from cocklebur.lrucache import LRUCache
+from cocklebur.dbobj import dbapi
+
+PREPARABLE = 'SELECT', 'INSERT', 'UPDATE', 'DELETE'
+
+
+def prepared_text(cmd, nargs):
+    """
+    Return /cmd/ with its parameters renumbered for PREPARE, or None
+    if the statement should not be prepared.
+    """
+    words = cmd.split(None, 1)
+    if not words or words[0].upper() not in PREPARABLE:
+        return None
+    parts = cmd.split('%s')
+    if len(parts) - 1 != nargs:
+        return None
+    for part in parts:
+        if '%' in part:
+            return None
+    text = [parts[0]]
+    for n, part in enumerate(parts[1:]):
+        text.append('$%d' % (n + 1))
+        text.append(part)
+    return ''.join(text)
+
+
+class StatementCache(LRUCache):
+    """
+    Map from SQL text to prepared statement name (or None if the
+    statement is not to be prepared). Statements discarded by the LRU
+    cache, or invalidated, are DEALLOCATEd before the next execution.
+    """
+    serial = itertools.count()
+
+    def __init__(self, size):
+        self.stale = []
+        LRUCache.__init__(self, size)
+
+    def evicted(self, cmd, name):
+        if name is not None:
+            self.stale.append(name)
+
+    def invalidate(self):
+        """
+        Discard all prepared statements (for example, because the schema
+        has changed)
+        """
+        self.stale.extend([name for name in self.values() if name is not None])
+        self.clear()
+
+    def _prepare(self, curs, cmd, nargs):
+        name = None
+        text = prepared_text(cmd, nargs)
+        if text is not None:
+            name = 'dbobj_stmt_%d' % self.serial.next()
+            curs.execute('SAVEPOINT dbobj_prepare', ())
+            try:
+                curs.execute('PREPARE %s AS %s' % (name, text), ())
+            except dbapi.Error:
+                curs.execute('ROLLBACK TO SAVEPOINT dbobj_prepare', ())
+                name = None
+            curs.execute('RELEASE SAVEPOINT dbobj_prepare', ())
+        self[cmd] = name
+        return name
+
+    def execute(self, curs, cmd, args):
+        """
+        Execute /cmd/, returning the cursor execute() result, and 'hit'
+        or 'miss' (or None if the statement is not prepared).
+        """
+        while self.stale:
+            curs.execute('DEALLOCATE %s' % self.stale[-1], ())
+            self.stale.pop()
+        try:
+            name = self[cmd]
+        except KeyError:
+            name = self._prepare(curs, cmd, len(args))
+            status = 'miss'
+        else:
+            status = 'hit'
+        if name is None:
+            return curs.execute(cmd, args), None
+        if args:
+            exec_cmd = 'EXECUTE %s (%s)' % (name, ', '.join(['%s'] * len(args)))
+        else:
+            exec_cmd = 'EXECUTE %s' % name
+        return curs.execute(exec_cmd, args), status
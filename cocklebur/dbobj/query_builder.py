@@ -15,7 +15,10 @@
 #
 #   Contributors: See the CONTRIBUTORS file for details of contributions.
 #
-from cocklebur.dbobj import dbapi, execute, result, misc
+import copy
+import itertools
+
+from cocklebur.dbobj import dbapi, execute, result, misc, columnar
 
 
 def wild(term):
@@ -27,6 +30,109 @@ def is_wild(term):
     return term and ('*' in term or '%' in term or '?' in term or '_' in term)
 
 
+in_array_threshold = 100
+
+def where_in_array(threshold):
+    """
+    Single column "IN" queries against integer or text columns with more
+    than /threshold/ values are passed as a single array parameter (0 disables)
+    """
+    global in_array_threshold
+    in_array_threshold = threshold
+
+
+def array_param(values, cast_type):
+    """
+    If the column /cast_type/ is INTEGER or TEXT, return an SQL array
+    literal of /values/, and the array type, otherwise None. None is also
+    returned if any of the values cannot be represented in the array
+    (NULLs, or values not of the column type).
+    """
+    if cast_type == 'INTEGER':
+        ints = []
+        for value in values:
+            if isinstance(value, basestring):
+                try:
+                    value = int(value)
+                except ValueError:
+                    return None
+            elif type(value) not in (int, long):
+                return None
+            ints.append(value)
+        if -2**31 <= min(ints) and max(ints) < 2**31:
+            array_type = 'int[]'
+        else:
+            array_type = 'bigint[]'
+        return '{%s}' % ','.join([str(value) for value in ints]), array_type
+    elif cast_type == 'TEXT':
+        for value in values:
+            if not isinstance(value, basestring):
+                return None
+        values = [value.replace('\\', '\\\\').replace('"', '\\"')
+                  for value in values]
+        return '{"%s"}' % '","'.join(values), 'text[]'
+    return None
+
+
+class ServerCursor(object):
+    """
+    Iterate over the rows resulting from a query using a named (DECLAREd)
+    server-side cursor, fetching /fetchcount/ rows at a time, so the
+    full result is never held in memory.
+
+    The server cursor is closed when the rows are exhausted or close()
+    is called. If the iterator is simply abandoned, the server closes
+    the cursor at the end of the transaction (a CLOSE is not attempted
+    on garbage collection, as the transaction may already have ended,
+    and the error would then abort the following transaction).
+    """
+    serial = itertools.count()
+
+    def __init__(self, db, query_expr, query_args, fetchcount=1000):
+        self.name = 'dbobj_cursor_%d' % self.serial.next()
+        self.fetchcount = fetchcount
+        self.description = None
+        self.rows = []
+        self.curs = db.cursor()
+        try:
+            execute.execute(self.curs, 'DECLARE %s NO SCROLL CURSOR FOR %s' % 
+                                        (self.name, query_expr), query_args)
+        except:
+            self.curs.close()
+            self.curs = None
+            raise
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if not self.rows:
+            if self.curs is None:
+                raise StopIteration
+            execute.execute(self.curs, 'FETCH %d FROM %s' % 
+                                        (self.fetchcount, self.name))
+            self.description = self.curs.description
+            self.rows = self.curs.fetchall()
+            if not self.rows:
+                self.close()
+                raise StopIteration
+            self.rows.reverse()
+        return self.rows.pop()
+
+    def close(self):
+        self.rows = []
+        if self.curs is not None:
+            try:
+                execute.execute(self.curs, 'CLOSE %s' % self.name)
+            finally:
+                self.curs.close()
+                self.curs = None
+
+    def __del__(self):
+        if self.curs is not None:
+            self.curs.close()
+
+
 class ExprBuilder:
     def __init__(self, table_desc, conjunction, negate=False):
         self.table_desc = table_desc
@@ -65,9 +171,41 @@ class ExprBuilder:
                         raise dbapi.ProgrammingError(
         'Multi-column "IN" query parameter count not equal to column count')
                     args.extend(value)
-            expr = '%s IN (%s)' % (incol, ','.join([valuefmt] * nargs))
+            array = None
+            if (valuefmt == '%s' and in_array_threshold
+                    and nargs > in_array_threshold
+                    and self.table_desc is not None
+                    and self.table_desc.db.array_params()):
+                col_desc = self._column_desc(incol)
+                if col_desc is not None:
+                    array = array_param(args, col_desc.cast_type())
+            if array is not None:
+                # "colname = ANY (array)" - a single parameter, saving the
+                # parser and planner from handling each value separately
+                value, array_type = array
+                expr = '%s = ANY (%%s::%s)' % (incol, array_type)
+                args = [value]
+            else:
+                expr = '%s IN (%s)' % (incol, ','.join([valuefmt] * nargs))
         self.where_exprs.append(('simple', expr, args))
 
+    def _column_desc(self, colname):
+        """
+        Find the describer for /colname/ if it is a column of this table
+        (optionally qualified with the table name), otherwise None.
+        """
+        try:
+            table, colname = colname.split('.')
+        except ValueError:
+            pass
+        else:
+            if table.lower() != self.table_desc.name.lower():
+                return None
+        try:
+            return self.table_desc.get_column(colname)
+        except KeyError:
+            return None
+
     def in_select(self, incol, table, op='IN', **kwargs):
         in_table_desc = self.table_desc.db.get_table(table)
         if 'columns' not in kwargs:
@@ -129,7 +267,7 @@ class Query:
                  distinct = False, 
                  for_update = False, for_share = False,
                  order_by = None, group_by = None, 
-                 limit = None, columns = None):
+                 limit = None, offset = None, columns = None):
         self.table_desc = table_desc
         self.distinct = distinct
         self.for_update = for_update
@@ -137,6 +275,7 @@ class Query:
         self.order_by = order_by
         self.group_by = group_by
         self.limit = limit
+        self.offset = offset
         self.columns = columns
         self.joins = []
         self.where_expr = ExprBuilder(self.table_desc, conjunction, negate)
@@ -146,6 +285,17 @@ class Query:
     def db(self):
         return self.table_desc.db
 
+    def copy(self):
+        """
+        Return a copy of the query to which further conditions can be
+        added without affecting this query (sub-expressions are shared).
+        """
+        query = copy.copy(self)
+        query.joins = list(self.joins)
+        query.where_expr = copy.copy(self.where_expr)
+        query.where_expr.where_exprs = list(self.where_expr.where_exprs)
+        return query
+
     def where(self, expr, *args):
         self.where_expr.where(expr, *args)
         return self             # Allow Query(table).where(...).execute(db)
@@ -233,6 +383,8 @@ class Query:
             query.append('FOR SHARE')
         if self.limit is not None:
             query.append('LIMIT %s' % self.limit)
+        if self.offset:
+            query.append('OFFSET %s' % self.offset)
         if self.set_query:
             set_op, set_query = self.set_query
             query.append(set_op)
@@ -266,6 +418,29 @@ class Query:
         finally:
             curs.close()
 
+    def fetchcols_columnar(self, columns, fetchcount=1000):
+        """
+        Execute the query, returning a columnar.ResultColumn (typed
+        array and null mask) for each of the requested columns (or a
+        single ResultColumn if /columns/ is a string).
+        """
+        if type(columns) in (str, unicode):
+            result = self.fetchcols_columnar([columns], fetchcount)
+            return result[0]
+        result = [columnar.ResultColumn(column) for column in columns]
+        curs = self.table_desc.db.cursor()
+        try:
+            self.execute(curs, columns)
+            while True:
+                rows = curs.fetchmany(fetchcount)
+                if not rows:
+                    break
+                for i, column in enumerate(result):
+                    column.extend([row[i] for row in rows])
+        finally:
+            curs.close()
+        return result
+
     def fetchall(self, limit=None):
         """
         Execute the query, returning a ResultSet containing ResultRows
@@ -280,14 +455,34 @@ class Query:
             curs.close()
         return rs
 
-    def yieldall(self, fetchcount=100):
+    def server_cursor(self, columns=None, fetchcount=1000):
+        """
+        Execute the query via a named server-side cursor (see
+        ServerCursor), returning an iterator over the raw result rows.
+        """
+        query_expr, query_args = self.build_expr(columns)
+        return ServerCursor(self.table_desc.db, query_expr, query_args, 
+                            fetchcount)
+
+    def yieldall(self, fetchcount=100, server_side=False):
         """
         Execute the query, yielding up ResultRow objects.
 
+        Ordinarily, the dbapi adapter fetches the whole result into
+        memory when the query is executed. If /server_side/ is True,
+        rows are fetched from a server-side cursor /fetchcount/ at a
+        time instead (at the cost of a round trip per fetch).
+
         Note that we can't mix generator functions and try/finally, so
         this could potentially leak cursors if the caller aborts early,
         and something prevents the generator being GCed.
         """
+        if server_side:
+            return self._yield_server_rows(self.server_cursor(None, 
+                                                              fetchcount))
+        return self._yield_rows(fetchcount)
+
+    def _yield_rows(self, fetchcount):
         curs = self.table_desc.db.cursor()
         self.execute(curs)
         while True:
@@ -300,6 +495,29 @@ class Query:
                 yield row
         curs.close()
 
+    def _yield_server_rows(self, cursor):
+        for fetch_row in cursor:
+            row = self.table_desc.get_row()
+            row.from_fetch(cursor.description, fetch_row)
+            yield row
+
+    def yieldcols(self, columns, fetchcount=1000, server_side=True):
+        """
+        Like fetchcols(), but yielding the rows as they are fetched
+        (from a server-side cursor, unless /server_side/ is False).
+        """
+        if server_side:
+            rows = self.server_cursor(columns, fetchcount)
+        else:
+            rows = iter(self.fetchcols(columns))
+        if type(columns) in (str, unicode):
+            if server_side:
+                return itertools.imap(lambda r: r[0], rows)
+            return rows
+        if server_side:
+            return itertools.imap(tuple, rows)
+        return rows
+
     def fetchdict(self):
         """
         Execute the query, returning a list of dicts representing the
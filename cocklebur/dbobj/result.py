@@ -18,13 +18,20 @@
 
 # Standard lib
 import copy
+try:
+    set
+except NameError:
+    from sets import Set as set
 
 # 3rd party
 from mx import DateTime
 
 # Module
 from cocklebur.dbobj import dbapi
-from cocklebur.dbobj.execute import execute
+from cocklebur.dbobj.execute import execute, copy_rows
+
+# Maximum rows written by one statement in db_update_rows()
+BATCH_SIZE = 200
 
 
 class _CmdBuilder:
@@ -310,7 +317,11 @@ class ResultRow:
                 col_value = self._columns[col_desc.name]
                 col_value.set_value(src_col_value.value())
 
-    def db_update(self, refetch=True):
+    def _get_changes(self):
+        """
+        Return the names and SQL values of the columns db_update() would
+        write, or None if nothing has changed.
+        """
         changed_cols, new_values = [], []
         no_change = True
         for col_desc in self._table_desc.get_columns():
@@ -328,7 +339,25 @@ class ResultRow:
                 changed_cols.append(col_desc.name)
                 new_values.append(col_desc.to_sql(value))
         if no_change:
+            return None
+        return changed_cols, new_values
+
+    def _write_done(self, fetch_desc, fetch_row):
+        """
+        Record a successful write (for db_commit/db_rollback), and load
+        the values refetched from the db.
+        """
+        for col_value in self._columns.values():
+            col_value.save()
+        self._saved_new = self._new
+        self.db().add_pending(self)
+        self.from_fetch(fetch_desc, fetch_row)
+
+    def db_update(self, refetch=True):
+        changes = self._get_changes()
+        if changes is None:
             return
+        changed_cols, new_values = changes
         table = self._table_desc.name
         curs = self.db().cursor()
         try:
@@ -362,13 +391,9 @@ class ResultRow:
                 cmd.append('SELECT * FROM %s WHERE' % table)
                 cmd.append_name_value_expr(' and ', pkey_names, pkey_values)
                 cmd.execute(curs)
-            for col_value in self._columns.values():
-                col_value.save()
-            self._saved_new = self._new
-            self.db().add_pending(self)
             result = curs.fetchmany(2)
             assert len(result) == 1
-            self.from_fetch(curs.description, result[0])
+            self._write_done(curs.description, result[0])
         finally:
             curs.close()
 
@@ -390,6 +415,151 @@ class ResultRow:
         return self._table_desc.nextval(colname)
 
 
+def db_update_rows(rows, refetch=True):
+    """
+    Write any changes to /rows/ (ResultRows, possibly from different
+    tables) as their db_update() methods would, in turn, but batching
+    statements.
+
+    Consecutive rows of a table are batched: new rows are grouped by
+    column set into multi-row INSERT ... RETURNING statements (or bulk
+    loaded if /refetch/ is False), and changed rows by changed column set
+    into UPDATE ... FROM (VALUES ...) statements. Writes to different
+    tables are made in the order given, so a parent row can be listed
+    before its dependents, but rows of one table within a run may be
+    written in any order, so must not reference each other. A row listed
+    more than once is written once, and a later row with the primary key
+    of an earlier row starts a new run, so the later changes win. Rows
+    are refetched, and take part in db commit and rollback, as for
+    db_update(). Batching requires PostgreSQL 8.2 - with earlier servers,
+    rows are written one at a time.
+    """
+    seen = set()
+    table_desc = None
+    pkeys = set()
+    batches = {}
+    order = []
+    for row in rows:
+        if id(row) in seen:
+            continue
+        seen.add(id(row))
+        changes = row._get_changes()
+        if changes is None:
+            continue
+        changed_cols, new_values = changes
+        pkey = None
+        if not row._new:
+            pkey = tuple(row._get_pkey()[1])
+        if row._table_desc is not table_desc or pkey in pkeys:
+            _write_batches(batches, order, refetch)
+            table_desc = row._table_desc
+            pkeys = set()
+            batches = {}
+            order = []
+        if pkey is not None:
+            pkeys.add(pkey)
+        key = row._new, tuple(changed_cols)
+        try:
+            batch = batches[key]
+        except KeyError:
+            batch = batches[key] = []
+            order.append(key)
+        batch.append((row, new_values))
+    _write_batches(batches, order, refetch)
+
+def _write_batches(batches, order, refetch):
+    for key in order:
+        new, changed_cols = key
+        batch = batches[key]
+        table_desc = batch[0][0]._table_desc
+        if len(batch) == 1 or not table_desc.db.batch_writes():
+            for row, new_values in batch:
+                row.db_update(refetch=refetch)
+            continue
+        for i in range(0, len(batch), BATCH_SIZE):
+            if new:
+                _insert_batch(table_desc, changed_cols, 
+                              batch[i:i+BATCH_SIZE], refetch)
+            else:
+                _update_batch(table_desc, changed_cols, 
+                              batch[i:i+BATCH_SIZE], refetch)
+
+def _insert_batch(table_desc, changed_cols, batch, refetch):
+    curs = table_desc.db.cursor()
+    try:
+        if not refetch:
+            copy_rows(curs, table_desc.name, changed_cols, 
+                      [new_values for row, new_values in batch])
+            return
+        cmd = _CmdBuilder()
+        cmd.append('INSERT INTO %s' % table_desc.name)
+        cmd.append_list_of_names(changed_cols)
+        cmd.append('VALUES')
+        for i, (row, new_values) in enumerate(batch):
+            if i:
+                cmd.append(',')
+            cmd.append_list_of_values(new_values)
+        cmd.append('RETURNING *')
+        cmd.execute(curs)
+        # Postgres returns the new rows in VALUES order
+        result = curs.fetchall()
+        assert len(result) == len(batch)
+        for (row, new_values), fetch_row in zip(batch, result):
+            row._write_done(curs.description, fetch_row)
+    finally:
+        curs.close()
+
+def _update_batch(table_desc, changed_cols, batch, refetch):
+    table = table_desc.name
+    pkey_descs = table_desc.get_primary_cols()
+    if not pkey_descs:
+        raise dbapi.ProgrammingError('No primary key defined for "%s"' % table)
+    key_names = ['_key_%s' % col_desc.name for col_desc in pkey_descs]
+    cmd = _CmdBuilder()
+    cmd.append('UPDATE %s SET' % table)
+    cmd.append(', '.join(['%s=_batch.%s' % (name, name) 
+                          for name in changed_cols]))
+    cmd.append('FROM (VALUES')
+    for i, (row, new_values) in enumerate(batch):
+        pkey_names, pkey_values = row._get_pkey()
+        if i:
+            cmd.append(',')
+            cmd.append_list_of_values(new_values + pkey_values)
+        else:
+            # The first row determines the column types
+            col_descs = [table_desc.get_column(name) for name in changed_cols]
+            casts = ['%%s::%s' % col_desc.cast_type() 
+                     for col_desc in col_descs + pkey_descs]
+            cmd.append('(' + ','.join(casts) + ')', 
+                       *(new_values + pkey_values))
+    cmd.append(') AS _batch')
+    cmd.append_list_of_names(list(changed_cols) + key_names)
+    cmd.append('WHERE')
+    cmd.append(' AND '.join(['%s.%s=_batch.%s' % (table, col_desc.name, key)
+                             for col_desc, key in zip(pkey_descs, key_names)]))
+    if refetch:
+        cmd.append('RETURNING %s, %s.*' % 
+                    (', '.join(['_batch.%s' % key for key in key_names]), 
+                     table))
+    curs = table_desc.db.cursor()
+    try:
+        cmd.execute(curs)
+        if curs.rowcount != len(batch):
+            raise dbapi.RecordDeleted('Record has been deleted')
+        if not refetch:
+            return
+        nkeys = len(key_names)
+        fetch_desc = curs.description[nkeys:]
+        by_key = {}
+        for fetch_row in curs.fetchall():
+            by_key[tuple(fetch_row[:nkeys])] = fetch_row[nkeys:]
+        for row, new_values in batch:
+            pkey_names, pkey_values = row._get_pkey()
+            row._write_done(fetch_desc, by_key[tuple(pkey_values)])
+    finally:
+        curs.close()
+
+
 class ResultSet(list):
     """
     Behaves like a list of ResultRow instances, inserts and deletes are
@@ -467,8 +637,7 @@ class ResultSet(list):
                 self._rows_deleted.remove(row)
                 raise
         self._rows_deleted = []
-        for row in self:
-            row.db_update()
+        db_update_rows(self)
         self.save_state()
 
     def db_has_changed(self):
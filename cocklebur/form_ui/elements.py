@@ -228,8 +228,9 @@ class Form(_ElementContainer):
     update_time = None
     author = None
     username = None
+    validation_plan = None
     ignoreattrs = _ElementContainer.ignoreattrs + (
-        'name', 'table', 'version', 'update_time',
+        'name', 'table', 'version', 'update_time', 'validation_plan',
     )
 
     def __init__(self, text, table=None, name=None,
@@ -260,6 +261,26 @@ class Form(_ElementContainer):
         # Legacy support for loading old form definitions
         pass
 
+    def update_validation(self):
+        """
+        Compile the form's inputs into a flat list, in validation order,
+        so validate() need not walk the element tree. The form must not
+        be edited afterwards (formlib compiles the forms it loads).
+        """
+        self.validation_plan = self.get_inputs()
+
+    def validate(self, namespace, formerrors=None):
+        if self.validation_plan is None:
+            return _ElementContainer.validate(self, namespace, formerrors)
+        if formerrors is None:
+            formerrors = columns.FormErrors()
+        for input in self.validation_plan:
+            try:
+                input.validate(namespace)
+            except common.ValidationError, e:
+                formerrors.add_error(input, e)
+        return formerrors
+
 class PagedForm(Form):
     render = 'PagedForm'
 
@@ -23,6 +23,8 @@ __all__ = 'FormLibPyFiles', 'FormLibXMLDB',
 import os
 import re
 import fcntl
+import cPickle
+import tempfile
 from cStringIO import StringIO
 from cocklebur import dbobj
 from cocklebur.form_ui.common import *
@@ -116,6 +118,7 @@ class FormLibBase:
         form.update_columns()
         form.update_labels()
         form.update_xlinks()
+        form.update_validation()
 
 
 class FormLibPyFiles(FormLibBase):
@@ -242,17 +245,24 @@ class FormLibPyFiles(FormLibBase):
 
 class FormLibXMLDB(FormLibBase):
     """
-    A library of forms stored as XML in a database table 
-    (with optional filesystem caching?).
+    A library of forms stored as XML in a database table.
+
+    If /cache_dir/ is given, parsed forms are also pickled to files in
+    that directory, so other processes (and later runs) need not parse
+    them again. Cache files are named by form name, version, and the
+    md5 of the XML definition, so a changed definition is never served
+    from a stale file. Bump cache_version if the pickled form classes
+    change incompatibly.
     """
-    # Implement filesystem caching of parsed forms
     # Implement in-core caching of names and versions? Only really of use to
     # admin form edit.
+    cache_version = 1
 
-    def __init__(self, db, table):
+    def __init__(self, db, table, cache_dir=None):
         FormLibBase.__init__(self)
         self.db = db
         self.table = table
+        self.cache_dir = cache_dir
 
     def __iter__(self):
         query = self.db.query(self.table, order_by=('name', 'version'))
@@ -290,23 +300,92 @@ class FormLibXMLDB(FormLibBase):
                 version = 0
         row.version = version
         row.db_update()
+        self._purge_cache(name, version)
         self._update(form, name, version)
         return version
 
+    def _cache_prefix(self, name, version=None):
+        prefix = 'formcache%d-%s-' % (self.cache_version, name)
+        if version is not None:
+            prefix += '%d-' % version
+        return prefix
+
+    def _purge_cache(self, name, version=None):
+        if not self.cache_dir:
+            return
+        prefix = self._cache_prefix(name, version)
+        try:
+            filenames = os.listdir(self.cache_dir)
+        except OSError:
+            return
+        for filename in filenames:
+            if filename.startswith(prefix):
+                try:
+                    os.unlink(os.path.join(self.cache_dir, filename))
+                except OSError:
+                    pass
+
+    def _cache_load(self, filename):
+        try:
+            f = open(filename, 'rb')
+        except IOError:
+            return None
+        try:
+            try:
+                return cPickle.load(f)
+            except Exception:
+                # Truncated, or from incompatible code - reparse
+                return None
+        finally:
+            f.close()
+
+    def _cache_save(self, filename, form):
+        # The cache is only an optimisation, so failures are ignored
+        try:
+            fd, tmpname = tempfile.mkstemp(dir=self.cache_dir)
+        except (IOError, OSError):
+            return
+        f = os.fdopen(fd, 'wb')
+        try:
+            try:
+                cPickle.dump(form, f, -1)
+                f.close()
+                os.chmod(tmpname, 0644)
+                os.rename(tmpname, filename)
+            except (IOError, OSError, cPickle.PicklingError):
+                pass
+        finally:
+            try:
+                os.unlink(tmpname)
+            except OSError:
+                pass
+
     def _load(self, name, version):
         if version is None:
             version = 0
         query = self.db.query(self.table)
         query.where('name = %s', name)
         query.where('version = %s', version)
-        row = query.fetchone()
-        if row is None:
-            raise NoFormError('No form %r, version %d' % (name, version))
-        form = xmlload(StringIO(row.xmldef))
+        cache_filename = form = None
+        if self.cache_dir:
+            digests = query.fetchcols('md5(xmldef)')
+            if not digests:
+                raise NoFormError('No form %r, version %d' % (name, version))
+            cache_filename = os.path.join(self.cache_dir, '%s%d-%s.pickle' %
+                            (self._cache_prefix(name), version, digests[0]))
+            form = self._cache_load(cache_filename)
+        if form is None:
+            row = query.fetchone()
+            if row is None:
+                raise NoFormError('No form %r, version %d' % (name, version))
+            form = xmlload(StringIO(row.xmldef))
+            if cache_filename:
+                self._cache_save(cache_filename, form)
         self._update(form, name, version)
         return form
 
     def rename(self, oldname, newname):
+        self._purge_cache(oldname)
         self.db.lock_table(self.table, 'EXCLUSIVE')
         if self.versions(newname):
             raise DuplicateFormError('form name %r is already used' % newname)
@@ -321,6 +400,7 @@ class FormLibXMLDB(FormLibBase):
             curs.close()
 
     def delete(self, name):
+        self._purge_cache(name)
         self.db.lock_table(self.table, 'EXCLUSIVE')
         curs = self.db.cursor()
         try:
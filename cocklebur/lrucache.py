@@ -0,0 +1,135 @@
+#
+#   The contents of this file are subject to the HACOS License Version 1.2
+#   (the "License"); you may not use this file except in compliance with
+#   the License.  Software distributed under the License is distributed
+#   on an "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, either express or
+#   implied. See the LICENSE file for the specific language governing
+#   rights and limitations under the License.  The Original Software
+#   is "NetEpi Collection". The Initial Developer of the Original
+#   Software is the Health Administration Corporation, incorporated in
+#   the State of New South Wales, Australia.
+#
+#   Copyright (C) 2004-2011 Health Administration Corporation, Australian
+#   Government Department of Health and Ageing, and others.
+#   All Rights Reserved.
+#
+#   Contributors: See the CONTRIBUTORS file for details of contributions.
+#
+"""
+A bounded mapping that discards the least recently used entries.
+"""
+
+PREV, NEXT, KEY, VALUE = range(4)
+
+class LRUCache(object):
+    """
+    Dictionary-like cache holding at most /size/ entries. Lookups and
+    stores make an entry most recently used, and when the cache is full
+    a store discards the least recently used entry.
+
+    Entries are kept in a circular doubly linked list of [prev, next,
+    key, value] links, the most recently used at the head.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.clear()
+
+    def clear(self):
+        self.map = {}
+        self.root = root = [None, None, None, None]
+        root[PREV] = root[NEXT] = root
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self.map)
+
+    def __contains__(self, key):
+        return key in self.map
+
+    def _unlink(self, link):
+        link[PREV][NEXT] = link[NEXT]
+        link[NEXT][PREV] = link[PREV]
+
+    def _link_head(self, link):
+        root = self.root
+        link[PREV] = root
+        link[NEXT] = root[NEXT]
+        root[NEXT][PREV] = link
+        root[NEXT] = link
+
+    def __getitem__(self, key):
+        try:
+            link = self.map[key]
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
+        root = self.root
+        if root[NEXT] is not link:
+            # Inline unlink and relink at head (this is the hot path)
+            prev, next = link[PREV], link[NEXT]
+            prev[NEXT] = next
+            next[PREV] = prev
+            head = root[NEXT]
+            link[PREV] = root
+            link[NEXT] = head
+            head[PREV] = root[NEXT] = link
+        return link[VALUE]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        link = self.map.get(key)
+        if link is not None:
+            link[VALUE] = value
+            self._unlink(link)
+        else:
+            if len(self.map) >= self.size:
+                oldest = self.root[PREV]
+                self._unlink(oldest)
+                del self.map[oldest[KEY]]
+                # Break the reference cycle
+                oldest[PREV] = oldest[NEXT] = None
+                self.evicted(oldest[KEY], oldest[VALUE])
+            link = [None, None, key, value]
+            self.map[key] = link
+        self._link_head(link)
+
+    def evicted(self, key, value):
+        """
+        Called when an entry is discarded to make room (subclass hook)
+        """
+        pass
+
+    def __delitem__(self, key):
+        link = self.map.pop(key)
+        self._unlink(link)
+        link[PREV] = link[NEXT] = None
+
+    def keys(self):
+        """
+        Keys, most recently used first
+        """
+        keys = []
+        root = self.root
+        link = root[NEXT]
+        while link is not root:
+            keys.append(link[KEY])
+            link = link[NEXT]
+        return keys
+
+    def values(self):
+        """
+        Values, most recently used first
+        """
+        values = []
+        root = self.root
+        link = root[NEXT]
+        while link is not root:
+            values.append(link[VALUE])
+            link = link[NEXT]
+        return values
@@ -312,6 +312,31 @@ class csv_download(DownloadBase):
         sys.stdout.flush()
 
 
+class file_download(DownloadBase):
+    """
+    Send the concatenated contents of one or more files
+    """
+    def __init__(self, ctx, filenames, file_name,
+                 content_type='application/unknown'):
+        DownloadBase.__init__(self, ctx, file_name, content_type)
+        self.filenames = filenames
+
+    def send(self, ctx):
+        self.set_headers(ctx)
+        ctx.write_headers()
+        for filename in self.filenames:
+            f = open(filename, 'rb')
+            try:
+                while True:
+                    buf = f.read(65536)
+                    if not buf:
+                        break
+                    sys.stdout.write(buf)
+            finally:
+                f.close()
+        sys.stdout.flush()
+
+
 def send_download(ctx):
     download = getattr(ctx.locals, 'download', None)
     if download:
@@ -0,0 +1,135 @@
+#
+#   The contents of this file are subject to the HACOS License Version 1.2
+#   (the "License"); you may not use this file except in compliance with
+#   the License.  Software distributed under the License is distributed
+#   on an "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, either express or
+#   implied. See the LICENSE file for the specific language governing
+#   rights and limitations under the License.  The Original Software
+#   is "NetEpi Collection". The Initial Developer of the Original
+#   Software is the Health Administration Corporation, incorporated in
+#   the State of New South Wales, Australia.
+#
+#   Copyright (C) 2004-2011 Health Administration Corporation, Australian
+#   Government Department of Health and Ageing, and others.
+#   All Rights Reserved.
+#
+#   Contributors: See the CONTRIBUTORS file for details of contributions.
+#
+"""
+Preforking process supervisor.
+
+The parent process does any expensive initialisation (imports, cache
+loading) once, then forks /workers/ child processes, each of which
+calls serve() to service requests (typically accepting connections
+on an inherited listening socket) until it decides to retire (for
+example, after a number of requests, or when its memory footprint
+grows too large). The supervisor immediately forks a replacement
+from the warm parent, so the remaining workers continue to service
+requests while a worker is recycled.
+
+SIGTERM or SIGINT to the parent stops the workers and exits.
+"""
+
+import os
+import sys
+import errno
+import signal
+import time
+import random
+
+def rss_mb():
+    """
+    Resident set size of this process in megabytes (or None if unknown)
+    """
+    try:
+        f = open('/proc/self/statm')
+    except IOError:
+        return None
+    try:
+        resident = int(f.read().split()[1])
+    finally:
+        f.close()
+    return resident * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+def jitter(count, fraction=0.1):
+    """
+    Spread the retirement of workers started together
+    """
+    if not count:
+        return count
+    return count + random.randint(0, int(count * fraction))
+
+
+class Supervisor:
+
+    # Back off if workers are dying faster than this
+    min_worker_life = 1.0
+
+    def __init__(self, workers, serve):
+        self.workers = workers
+        self.serve = serve
+        self.children = {}
+        self.running = True
+        self.saved_handlers = []
+
+    def spawn(self):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = time.time()
+            return
+        # Child - restore the signal handling the server expects
+        for sig, handler in self.saved_handlers:
+            signal.signal(sig, handler)
+        status = 0
+        try:
+            try:
+                self.serve()
+            except SystemExit, e:
+                status = e.code or 0
+            except:
+                import traceback
+                traceback.print_exc()
+                status = 1
+        finally:
+            sys.stderr.flush()
+            os._exit(status)
+
+    def _stop(self, *args):
+        self.running = False
+
+    def signal_children(self, sig):
+        for pid in self.children.keys():
+            try:
+                os.kill(pid, sig)
+            except OSError:
+                pass
+
+    def run(self):
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            self.saved_handlers.append((sig, signal.getsignal(sig)))
+            signal.signal(sig, self._stop)
+        try:
+            while self.running:
+                while len(self.children) < self.workers:
+                    self.spawn()
+                try:
+                    pid, status = os.wait()
+                except OSError, (eno, estr):
+                    if eno == errno.EINTR:
+                        continue
+                    raise
+                started = self.children.pop(pid, None)
+                if started is not None and self.running:
+                    life = time.time() - started
+                    if life < self.min_worker_life:
+                        time.sleep(self.min_worker_life - life)
+        finally:
+            self.signal_children(signal.SIGTERM)
+            while self.children:
+                try:
+                    pid, status = os.wait()
+                except OSError, (eno, estr):
+                    if eno == errno.EINTR:
+                        continue
+                    break
+                self.children.pop(pid, None)
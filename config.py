@@ -53,6 +53,10 @@ dup_per_syndrome = False
 # been tested in some time and is no longer recommended).
 form_rollforward = True
 
+# Save parsed form definitions alongside the application's db files, so
+# each new process does not need to parse the XML of every form it uses.
+form_cache = True
+
 # Immediately create cases and contacts from search results, rather than 
 # requiring an explicit "create" from the case/contact screen.
 immediate_create = True
@@ -92,6 +96,60 @@ tabbed_demogfields_threshold = 20
 # for persistent application servers).
 max_requests = 1000
 
+# If non-zero, a persistent (FastCGI) application server loads its caches
+# once, then forks this many worker processes to service requests. Workers
+# are replaced as they retire (after max_requests, or if their resident
+# memory exceeds max_rss megabytes).
+prefork_workers = 0
+max_rss = 0
+
+# Number of worker processes used to score candidate pairs during duplicate
+# person scans. Values greater than 1 fork a process per job (each scores a
+# share of the persons).
+dupscan_jobs = 1
+
+# Phonetic (double metaphone) encodings of name words are memoised. This sets
+# the number of words remembered, and the number of the most common surnames
+# and given names used to pre-warm the memo when the application starts.
+phonetic_cache_size = 50000
+phonetic_cache_prewarm = 2000
+
+# If non-zero, SQL statements are PREPAREd on the server the first time they
+# are seen, and later executions of the same statement skip parsing and
+# planning. This sets the number of prepared statements kept per connection.
+prepared_statements = 0
+
+# "IN" tests of integer or text columns against more than this many values
+# are passed to the database as a single array parameter, rather than a
+# parameter per value (PostgreSQL 8.2 and later). 0 disables.
+where_in_array = 100
+
+# Test case access against the case_visibility table (case_acl and task
+# access, maintained as they change) rather than subselects over case_acl,
+# tasks and work queues.
+case_visibility = True
+
+# Number of crosstab report results (and, once drilled into, the case_ids of
+# each cell) kept per application process. Results are discarded when the
+# cases or forms of their syndrome change. Requires the notification daemon.
+# 0 disables.
+crosstab_cache = 20
+
+# Case exports fetch this many chunks of 1000 cases ahead on a second database
+# connection, while the current chunk is formatted. 0 fetches and formats in
+# turn on the application's connection.
+export_prefetch = 2
+
+# Background export jobs are spooled to this directory (default: an "exports"
+# directory alongside the application's db files), and deleted after
+# export_spool_days.
+export_spool_dir = None
+export_spool_days = 7
+
+# Data imports look up existing cases and write cases, persons and forms in
+# batches of rows, rather than a row at a time.
+dataimp_bulk = True
+
 # ==============================================================================
 # User controls
 
@@ -162,3 +220,6 @@ install_debug = False
 create_db = True
 compile_py = True
 exec_timing = False
+exec_timing_nplus1 = 10
+exec_timing_dir = None
+exec_timing_interval = 100
@@ -58,6 +58,10 @@ class PageOps(page_common.PageOpsBase):
         log = logview.SystemLogView(ctx.locals._credentials.prefs, 'System log')
         ctx.push_page('logview', log)
 
+    def do_sql_stats(self, ctx, ignore):
+        if config.exec_timing:
+            ctx.push_page('admin_sql_stats')
+
     def do_view_rights(self, ctx, ignore):
         ctx.push_page('admin_view_right', ctx.locals.view_right)
 
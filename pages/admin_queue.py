@@ -16,7 +16,7 @@
 #   Contributors: See the CONTRIBUTORS file for details of contributions.
 #
 from cocklebur import dbobj, pt
-from casemgr import globals, credentials, tasks
+from casemgr import globals, credentials, tasks, caseaccess
 from pages import page_common
 
 import config
@@ -36,6 +36,8 @@ class PageOps(page_common.PageOpsBase):
 
     def commit(self, ctx):
         queue_updated = ctx.locals.queue.db_has_changed()
+        members_updated = (ctx.locals.unit_pt_search.db_has_changed() or
+                           ctx.locals.user_pt_search.db_has_changed())
         ctx.admin_log(ctx.locals.queue.db_desc())
         ctx.locals.queue.db_update()
         ctx.locals.unit_pt_search.set_key(ctx.locals.queue.queue_id)
@@ -44,6 +46,8 @@ class PageOps(page_common.PageOpsBase):
         ctx.locals.user_pt_search.set_key(ctx.locals.queue.queue_id)
         ctx.admin_log(ctx.locals.user_pt_search.db_desc())
         ctx.locals.user_pt_search.db_update()
+        if members_updated:
+            caseaccess.refresh_queue(globals.db, ctx.locals.queue.queue_id)
         globals.db.commit()
         if queue_updated:
             globals.notify.notify('workqueues', ctx.locals.queue.queue_id)
@@ -62,6 +66,7 @@ class PageOps(page_common.PageOpsBase):
 
     def do_delete(self, ctx, ignore):
         if ctx.locals.queue.queue_id:
+            ctx.locals.queue_stats.refresh()
             if ctx.locals.queue_stats.active:
                 raise page_common.PageError('workqueue %r cannot be deleted as it has outstanding tasks' % ctx.locals.queue.name)
             if not self.confirmed:
@@ -0,0 +1,44 @@
+#
+#   The contents of this file are subject to the HACOS License Version 1.2
+#   (the "License"); you may not use this file except in compliance with
+#   the License.  Software distributed under the License is distributed
+#   on an "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, either express or
+#   implied. See the LICENSE file for the specific language governing
+#   rights and limitations under the License.  The Original Software
+#   is "NetEpi Collection". The Initial Developer of the Original
+#   Software is the Health Administration Corporation, incorporated in
+#   the State of New South Wales, Australia.
+#
+#   Copyright (C) 2004-2011 Health Administration Corporation, Australian
+#   Government Department of Health and Ageing, and others.
+#   All Rights Reserved.
+#
+#   Contributors: See the CONTRIBUTORS file for details of contributions.
+#
+import os
+import time
+from cocklebur.dbobj.exec_timing import exec_timing
+from pages import page_common
+import config
+
+class PageOps(page_common.PageOpsBase):
+
+    def do_reset(self, ctx, ignore):
+        exec_timing.reset()
+
+    def do_refresh(self, ctx, ignore):
+        pass
+
+page_process = PageOps().page_process
+
+
+def ms(secs):
+    return '%.1f' % (secs * 1000)
+
+def page_display(ctx):
+    ctx.locals.sql_stats = exec_timing
+    ctx.locals.pid = os.getpid()
+    ctx.locals.since = time.strftime('%Y-%m-%d %H:%M:%S', 
+                                     time.localtime(exec_timing.started))
+    ctx.locals.ms = ms
+    ctx.run_template('admin_sql_stats.html')
@@ -17,7 +17,8 @@
 #
 
 from casemgr import globals, persondupe
-from casemgr.dataimp.dataimp import DataImp, PreviewImport, locked_case_ids
+from casemgr.dataimp.dataimp import DataImp, BulkDataImp, PreviewImport, \
+                                    locked_case_ids
 
 from pages import page_common, caseset_ops
 
@@ -26,10 +27,14 @@ import config
 class PageOps(page_common.PageOpsBase):
 
     def do_import(self, ctx, ignore):
-        imp = DataImp(ctx.locals._credentials,
-                      ctx.locals.editor.syndrome_id, 
-                      ctx.locals.dataimp_src, 
-                      ctx.locals.editor.importrules)
+        if config.dataimp_bulk:
+            importer = BulkDataImp
+        else:
+            importer = DataImp
+        imp = importer(ctx.locals._credentials,
+                       ctx.locals.editor.syndrome_id, 
+                       ctx.locals.dataimp_src, 
+                       ctx.locals.editor.importrules)
         if imp.errors:
             for error in imp.errors.get(None):
                 ctx.msg('err', error)
@@ -58,15 +63,32 @@ class PageOps(page_common.PageOpsBase):
         caseset_ops.make_caseset(ctx, case_ids,
                             'Data import source-locked cases')
 
+    def do_preview_prev(self, ctx, ignore):
+        ctx.locals.preview_offset = max(0, ctx.locals.preview_offset - 
+                                           PreviewImport.page_size)
+
+    def do_preview_next(self, ctx, ignore):
+        ctx.locals.preview_offset += PreviewImport.page_size
+
 
 
 page_process = PageOps().page_process
 
+def page_enter(ctx):
+    ctx.locals.preview_offset = 0
+    ctx.add_session_vars('preview_offset')
+
+def page_leave(ctx):
+    ctx.del_session_vars('preview_offset')
+
 def page_display(ctx):
+    # The source is checked in full on each display, but only the current
+    # page of rows is kept.
     ctx.locals.preview = PreviewImport(ctx.locals._credentials,
                                        ctx.locals.editor.syndrome_id, 
                                        ctx.locals.dataimp_src, 
-                                       ctx.locals.editor.importrules)
+                                       ctx.locals.editor.importrules,
+                                       ctx.locals.preview_offset)
     if ctx.locals.preview.errors:
         for error in ctx.locals.preview.errors.get():
             ctx.msg('err', error)
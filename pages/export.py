@@ -17,7 +17,7 @@
 #
 import sys, os
 
-from casemgr import dataexport, exportselect
+from casemgr import dataexport, exportselect, exportjob
 from pages import page_common
 
 import config
@@ -37,6 +37,32 @@ class PageOps(page_common.PageOpsBase):
             es = ctx.locals.exportsel
             page_common.csv_download(ctx, es.row_gen(), es.filename())
 
+    def do_jobexport(self, ctx, ignore):
+        if ctx.locals.changed:
+            ctx.add_message('Mode has changed, check parameters')
+        else:
+            job = exportjob.new_job(ctx.locals._credentials,
+                                    ctx.locals.exportsel)
+            job.start()
+            ctx.add_message('Background export started - '
+                            'this may take some time')
+
+    def do_jobdownload(self, ctx, job_id):
+        job = exportjob.user_job(ctx.locals._credentials, job_id)
+        if job.status() != 'done':
+            raise exportjob.ExportJobError('Export job is not complete')
+        page_common.file_download(ctx, job.part_filenames(), job.filename,
+                                  content_type='application/x-gzip')
+
+    def do_jobresume(self, ctx, job_id):
+        job = exportjob.user_job(ctx.locals._credentials, job_id)
+        job.start()
+        ctx.add_message('Background export resumed')
+
+    def do_jobdelete(self, ctx, job_id):
+        job = exportjob.user_job(ctx.locals._credentials, job_id)
+        job.delete()
+
     def page_process(self, ctx):
         ctx.locals.changed = ctx.locals.exportsel.refresh(ctx.locals._credentials)
         page_common.PageOpsBase.page_process(self, ctx)
@@ -54,4 +80,5 @@ def page_leave(ctx):
 
 def page_display(ctx):
     if not page_common.send_download(ctx):
+        ctx.locals.export_jobs = exportjob.user_jobs(ctx.locals._credentials)
         ctx.run_template('export.html')
@@ -19,8 +19,8 @@
 import sys, os
 import config
 from cocklebur import pageops
-from cocklebur.pageops import download, csv_download, send_download, \
-                              Confirm, ConfirmSave, \
+from cocklebur.pageops import download, csv_download, file_download, \
+                              send_download, Confirm, ConfirmSave, \
                               ConfirmDelete, ConfirmUndelete, ConfirmRevert
 from cocklebur import dbobj, form_ui, checkdigit
 from casemgr import globals, cases, tasks, taskdesc, credentials, messages
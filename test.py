@@ -28,6 +28,9 @@ all_tests = [
     'tests.person',
     'tests.wikiformatting',
     'tests.tuplestruct.suite',
+    'tests.lrucache.suite',
+    'tests.colfile.suite',
+    'tests.phonetic_encode.suite',
     'tests.dbobj.suite',
     'tests.xmlparse.suite',
     'tests.form.suite',
@@ -38,7 +41,10 @@ all_tests = [
     'tests.dataimp.editor',
     'tests.dataimp.dataimp',
     'tests.searchacl.suite',
+    'tests.queuestats.suite',
+    'tests.pagedsearch.suite',
     'tests.export.suite',
+    'tests.exportjob.suite',
     'tests.adminformedit.suite',
     'tests.demogfields.suite',
     'tests.reports.filters',
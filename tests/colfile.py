@@ -0,0 +1,89 @@
+#
+#   The contents of this file are subject to the HACOS License Version 1.2
+#   (the "License"); you may not use this file except in compliance with
+#   the License.  Software distributed under the License is distributed
+#   on an "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, either express or
+#   implied. See the LICENSE file for the specific language governing
+#   rights and limitations under the License.  The Original Software
+#   is "NetEpi Collection". The Initial Developer of the Original
+#   Software is the Health Administration Corporation, incorporated in
+#   the State of New South Wales, Australia.
+#
+#   Copyright (C) 2004-2011 Health Administration Corporation, Australian
+#   Government Department of Health and Ageing, and others.
+#   All Rights Reserved.
+#
+#   Contributors: See the CONTRIBUTORS file for details of contributions.
+#
+import unittest
+from cStringIO import StringIO
+
+from mx import DateTime
+
+from cocklebur import colfile
+
+columns = [
+    ('id', 'int'),
+    ('name', 'str'),
+    ('weight', 'float'),
+    ('onset', 'date'),
+    ('confirmed', 'bool'),
+]
+
+rows = [
+    (1, 'Smith', 71.5, DateTime.DateTime(2009, 6, 1), True),
+    (2, None, None, DateTime.DateTime(2009, 6, 2, 12, 0, 0), False),
+    (3, 'Line 1\nLine 2', 80.25, None, None),
+]
+
+
+class Case(unittest.TestCase):
+
+    def test_roundtrip(self):
+        f = StringIO()
+        writer = colfile.ColumnFileWriter(f, columns)
+        writer.write_rows(rows[:2])
+        writer.write_rows([])
+        writer.write_rows(rows[2:])
+        writer.close()
+        self.assertEqual(writer.row_count, 3)
+        f.seek(0)
+        reader = colfile.ColumnFileReader(f)
+        self.assertEqual(reader.columns, columns)
+        self.assertEqual(list(reader.rows()), rows)
+        f.seek(0)
+        reader = colfile.ColumnFileReader(f)
+        groups = list(reader.groups())
+        self.assertEqual(len(groups), 2)
+        values, nulls = groups[0][2]
+        self.assertEqual(list(values), [71.5, 0.0])
+        self.assertEqual(list(nulls), [0, 1])
+
+    def test_errors(self):
+        f = StringIO()
+        self.assertRaises(colfile.ColumnFileError,
+                          colfile.ColumnFileWriter, f, [('x', 'blob')])
+        writer = colfile.ColumnFileWriter(f, columns)
+        self.assertRaises(colfile.ColumnFileError, writer.write_rows, [(1,)])
+        writer.write_rows(rows)
+        # Truncated
+        f = StringIO(f.getvalue())
+        reader = colfile.ColumnFileReader(f)
+        self.assertRaises(colfile.ColumnFileError, list, reader.rows())
+        self.assertRaises(colfile.ColumnFileError,
+                          colfile.ColumnFileReader, StringIO('a,b,c\n'))
+
+
+class Suite(unittest.TestSuite):
+    test_list = (
+        'test_roundtrip',
+        'test_errors',
+    )
+    def __init__(self):
+        unittest.TestSuite.__init__(self, map(Case, self.test_list))
+
+def suite():
+    return Suite()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -188,6 +188,26 @@ class DataImpTest(testcommon.AppTestCase):
         positional_data = '\n'.join(data.splitlines()[1:])
         self._test_preview(import_positional_xml, positional_data)
 
+    def test_preview_paged(self):
+        cred = testcommon.DummyCredentials()
+        rules = xmlload(StringIO(import_named_xml))
+        src = datasrc.DataImpSrc('foo', StringIO(data))
+        page_size = dataimp.PreviewImport.page_size
+        dataimp.PreviewImport.page_size = 2
+        try:
+            imp = dataimp.PreviewImport(cred, 1, src, rules)
+            self.assertEqual(imp.n_rows, 3)
+            self.assertEqual([row[1] for row in imp.rows], ['BLOGS', 'SMITH'])
+            self.failIf(imp.has_prev())
+            self.failUnless(imp.has_next())
+            imp = dataimp.PreviewImport(cred, 1, src, rules, 2)
+            self.assertEqual(imp.n_rows, 3)
+            self.assertEqual([row[1] for row in imp.rows], ['JONES'])
+            self.failUnless(imp.has_prev())
+            self.failIf(imp.has_next())
+        finally:
+            dataimp.PreviewImport.page_size = page_size
+
     def test_preview_errors(self):
         cred = testcommon.DummyCredentials()
         rules = xmlload(StringIO(error_named_xml))
@@ -224,14 +244,35 @@ williams,,,,a,XX,XX,103,
             'record 4 (line 5): Either Surname or Local ID must be specified',
             'record 4 (line 5): Exposure History (SARS): Contact with case: this field must be answered',
         ])
+        self.assertEqual(imp.errors.col_errors(), [
+            ('Contact with case', 3),
+            ('Date of birth/Age', 2),
+            ('Contact duration (hours)', 1),
+            ('Date of first contact', 1),
+            ('Demographics', 1),
+            ('Favourite foods', 1),
+            ('Status', 1),
+        ])
+        self.assertEqual(imp.checked_rows, None)
         # Check "too many errors" handling
         lines = data.splitlines()
-        data = '\n'.join([lines[0]] + [lines[1]] * 101)
+        data = '\n'.join([lines[0]] + [lines[1]] * 101 + [lines[2]] * 49)
         src = datasrc.DataImpSrc('foo', StringIO(data))
         imp = dataimp.PreviewImport(cred, 1, src, rules)
         self.assertEqual(list(imp.errors)[0], 
             'More than %s errors, giving up' % imp.errors.MAX_ERRORS)
         self.assertEqual(imp.errors.count(), 100)
+        self.assertEqual(imp.errors.col_errors(), [('Status', 100)])
+        # Rows past the limit are still counted, and paged
+        self.assertEqual(imp.checked_rows, 100)
+        self.assertEqual(imp.n_rows, 150)
+        self.failUnless(imp.has_next())
+        imp = dataimp.PreviewImport(cred, 1, src, rules, 100)
+        self.assertEqual(imp.errors.count(), 100)
+        self.assertEqual(len(imp.rows), 50)
+        self.assertEqual(imp.rows[0][1], 'BLOGS')
+        self.assertEqual(imp.rows[-1][1], 'SMITH')
+        self.failIf(imp.has_next())
 
 
     def _fetch_rows(self):
@@ -303,5 +344,59 @@ williams,,,,a,XX,XX,103,
                 3.0, 'Unknown', None, False, True, False),
         ])
 
+    def test_bulk_import_named_update(self):
+        cred = testcommon.DummyCredentials()
+        rules = xmlload(StringIO(import_named_xml))
+        rules.add(ImportSource('local_case_id', 'Id'))
+        src = datasrc.DataImpSrc('foo', StringIO(data))
+        imp = dataimp.BulkDataImp(cred, 1, src, rules)
+        self.failIf(imp.errors, imp.errors)
+        self.assertEqual(imp.new_cnt, 3)
+        self.assertEqual(imp.update_cnt, 0)
+        # Record 101 is repeated, so is written before it is seen again
+        src = datasrc.DataImpSrc('foo', StringIO(data + data_update))
+        imp = dataimp.BulkDataImp(cred, 1, src, rules)
+        self.failIf(imp.errors, imp.errors)
+        self.assertEqual(imp.new_cnt, 1)
+        self.assertEqual(imp.update_cnt, 4)
+        self.assertListEq(self._fetch_rows(), [
+            ('BLOGS', dt('2001-11-24'), 0, 'confirmed', 'NSW', None, '100',
+                1.0, 'Unknown', None, True, False, False), 
+            ('SMITH', dt('2000-01-20'), 0, 'confirmed', 'NSW', None, '101',
+                2.0, 'Unknown', None, False, False, False), 
+            ('JONES', age4m, 31, 'preliminary', 'NSW', None, '102',
+                None, 'Unknown', None, False, False, False),
+            ('WILLIAMS', dt('1940-12-02'), 0, 'excluded', 'NSW', None, '104', 
+                3.0, 'Unknown', None, False, True, False),
+        ])
+    def test_bulk_import_shared_person(self):
+        cred = testcommon.DummyCredentials()
+        rules = xmlload(StringIO(import_named_xml))
+        rules.add(ImportSource('local_case_id', 'Id'))
+        src = datasrc.DataImpSrc('foo', StringIO(data))
+        imp = dataimp.BulkDataImp(cred, 1, src, rules)
+        self.failIf(imp.errors, imp.errors)
+        # Records 100 and 101 become cases of the one person
+        curs = self.db.cursor()
+        dbobj.execute(curs, 'UPDATE cases SET person_id = '
+                            ' (SELECT person_id FROM cases'
+                            '  WHERE local_case_id = %s)'
+                            ' WHERE local_case_id = %s', ('100', '101'))
+        update = '\n'.join(data.splitlines()[:1] + [
+            'blogs,confirmed,24/11/2001,,1,100,',
+            'bloggs,confirmed,24/11/2001,,2,101,',
+        ])
+        src = datasrc.DataImpSrc('foo', StringIO(update))
+        imp = dataimp.BulkDataImp(cred, 1, src, rules)
+        self.failIf(imp.errors, imp.errors)
+        self.assertEqual(imp.new_cnt, 0)
+        self.assertEqual(imp.update_cnt, 2)
+        # As for row-at-a-time import, the last write wins
+        query = self.db.query('persons', order_by='local_case_id')
+        query.join('JOIN cases USING (person_id)')
+        query.where_in('local_case_id', ['100', '101'])
+        self.assertEqual(query.fetchcols(['local_case_id', 'surname']),
+                         [('100', 'BLOGGS'), ('101', 'BLOGGS')])
+
 if __name__ == '__main__':
     unittest.main()
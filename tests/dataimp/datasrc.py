@@ -81,6 +81,8 @@ class DataSrcTest(unittest.TestCase):
             ['jones', 'suspected']])
         self.assertEqual(src.preview.colvalues('case_status'), 
                         ['confirmed', 'suspected'])
+        self.assertEqual(src.preview.colhistogram('case_status'), 
+                        [('confirmed', 2), ('suspected', 1)])
         self.assertEqual(src.preview.colpreview('surname'), 
                         ['blogs', 'smith', 'jones'])
         self.assertEqual(src.preview.colpreview('case_status'), 
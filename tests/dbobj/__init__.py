@@ -23,6 +23,9 @@ class AllTestSuite(unittest.TestSuite):
         'query_builder',
         'result',
         'participation_table',
+        'prepared',
+        'exec_timing',
+        'columnar',
     ]
     def __init__(self):
         unittest.TestSuite.__init__(self)
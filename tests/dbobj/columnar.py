@@ -0,0 +1,92 @@
+#
+#   The contents of this file are subject to the HACOS License Version 1.2
+#   (the "License"); you may not use this file except in compliance with
+#   the License.  Software distributed under the License is distributed
+#   on an "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, either express or
+#   implied. See the LICENSE file for the specific language governing
+#   rights and limitations under the License.  The Original Software
+#   is "NetEpi Collection". The Initial Developer of the Original
+#   Software is the Health Administration Corporation, incorporated in
+#   the State of New South Wales, Australia.
+#
+#   Copyright (C) 2004-2011 Health Administration Corporation, Australian
+#   Government Department of Health and Ageing, and others.
+#   All Rights Reserved.
+#
+#   Contributors: See the CONTRIBUTORS file for details of contributions.
+#
+import unittest
+from mx import DateTime
+from cocklebur.dbobj import columnar
+
+class Case(unittest.TestCase):
+    def _column(self, *batches):
+        column = columnar.ResultColumn('a')
+        for batch in batches:
+            column.extend(batch)
+        return column
+
+    def test_int(self):
+        column = self._column([None, 1], [2, None, 3])
+        self.assertEqual(column.kind, 'int')
+        self.assertEqual(column.values.typecode, 'l')
+        self.assertEqual(column.values.tolist(), [0, 1, 2, 0, 3])
+        self.assertEqual(column.nulls.tolist(), [1, 0, 0, 1, 0])
+        self.assertEqual(column.null_count(), 2)
+        self.assertEqual(len(column), 5)
+        self.assertEqual(column.tolist(), [None, 1, 2, None, 3])
+
+    def test_float(self):
+        column = self._column([1.5, None, 2])
+        self.assertEqual(column.kind, 'float')
+        self.assertEqual(column.tolist(), [1.5, None, 2.0])
+
+    def test_bool(self):
+        column = self._column([True, False, None])
+        self.assertEqual(column.kind, 'bool')
+        self.assertEqual(column.tolist(), [True, False, None])
+
+    def test_date(self):
+        dates = [DateTime.DateTime(2009, 3, 1), None,
+                 DateTime.DateTime(2009, 3, 2, 12, 0, 0)]
+        column = self._column(dates)
+        self.assertEqual(column.kind, 'date')
+        self.assertEqual(column.values[2] - column.values[0], 1.5)
+        self.assertEqual(column.tolist(), dates)
+
+    def test_object(self):
+        column = self._column([None], ['x', None])
+        self.assertEqual(column.kind, 'object')
+        self.assertEqual(column.tolist(), [None, 'x', None])
+        self.assertEqual(column.nulls.tolist(), [1, 0, 1])
+
+    def test_mixed(self):
+        # Values that don't fit the array type revert to a list
+        column = self._column([1, None], [2.5, 'x'])
+        self.assertEqual(column.kind, 'object')
+        self.assertEqual(column.tolist(), [1, None, 2.5, 'x'])
+        self.assertEqual(column.nulls.tolist(), [0, 1, 0, 0])
+
+    def test_empty(self):
+        column = self._column([], [None, None])
+        self.assertEqual(column.kind, None)
+        self.assertEqual(column.tolist(), [None, None])
+
+class Suite(unittest.TestSuite):
+    test_list = (
+        'test_int',
+        'test_float',
+        'test_bool',
+        'test_date',
+        'test_object',
+        'test_mixed',
+        'test_empty',
+    )
+    def __init__(self):
+        unittest.TestSuite.__init__(self, map(Case, self.test_list))
+
+def suite():
+    return Suite()
+
+if __name__ == '__main__':
+    unittest.main()
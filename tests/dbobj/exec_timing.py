@@ -0,0 +1,81 @@
+#
+#   The contents of this file are subject to the HACOS License Version 1.2
+#   (the "License"); you may not use this file except in compliance with
+#   the License.  Software distributed under the License is distributed
+#   on an "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, either express or
+#   implied. See the LICENSE file for the specific language governing
+#   rights and limitations under the License.  The Original Software
+#   is "NetEpi Collection". The Initial Developer of the Original
+#   Software is the Health Administration Corporation, incorporated in
+#   the State of New South Wales, Australia.
+#
+#   Copyright (C) 2004-2011 Health Administration Corporation, Australian
+#   Government Department of Health and Ageing, and others.
+#   All Rights Reserved.
+#
+#   Contributors: See the CONTRIBUTORS file for details of contributions.
+#
+import unittest
+from cocklebur.dbobj import exec_timing
+
+class Case(unittest.TestCase):
+    def test_shape(self):
+        self.assertEqual(exec_timing.shape(
+                    'SELECT * FROM t WHERE a IN (%s,%s,%s) AND b = %s'),
+                    'SELECT * FROM t WHERE a IN (%s,...) AND b = %s')
+
+    def test_percentiles(self):
+        samples = exec_timing.Samples()
+        self.assertEqual(samples.percentiles(), (0.0, 0.0, 0.0))
+        for n in range(100, 0, -1):
+            samples.record(n)
+        self.assertEqual(samples.percentiles(), (50, 95, 99))
+        for n in range(exec_timing.SAMPLES):
+            samples.record(1000)
+        self.assertEqual(samples.percentiles(), (1000, 1000, 1000))
+
+    def test_requests(self):
+        et = exec_timing.ExecTiming(nplus1=2)
+        et.record('SELECT * FROM cases WHERE case_id = %s', 0.01, 1)
+        for n in range(3):
+            et.record('SELECT * FROM persons WHERE person_id IN (%s,%s)', 
+                      0.02, 2)
+        et.end_request('case')
+        et.record('SELECT * FROM cases WHERE case_id = %s', 0.03, 1)
+        et.end_request(None)
+        self.assertEqual(et.requests, 2)
+        pages = dict(et.page_stats())
+        self.assertEqual(pages['case'].queries, 4)
+        self.assertEqual(pages['case'].rows, 7)
+        self.assertEqual(pages['unknown'].queries, 1)
+        nplus1 = et.nplus1_stats()
+        self.assertEqual(len(nplus1), 1)
+        page, cmd, npo = nplus1[0]
+        self.assertEqual((page, npo.requests, npo.max_repeats), ('case', 1, 3))
+        self.assertEqual(cmd, 
+                         'SELECT * FROM persons WHERE person_id IN (%s,...)')
+        top = et.top_statements(1)
+        self.assertEqual(top[0][0], cmd)
+        self.assertEqual(top[0][1].count, 3)
+        prom = et.prometheus(dict(pid=1))
+        self.failUnless('dbobj_queries_total{page="case",pid="1"} 4' 
+                        in prom.splitlines())
+        self.failUnless('# TYPE dbobj_request_seconds summary' 
+                        in prom.splitlines())
+        et.reset()
+        self.assertEqual(et.page_stats(), [])
+
+class Suite(unittest.TestSuite):
+    test_list = (
+        'test_shape',
+        'test_percentiles',
+        'test_requests',
+    )
+    def __init__(self):
+        unittest.TestSuite.__init__(self, map(Case, self.test_list))
+
+def suite():
+    return Suite()
+
+if __name__ == '__main__':
+    unittest.main()
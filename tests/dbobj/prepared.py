@@ -0,0 +1,97 @@
+#
+#   The contents of this file are subject to the HACOS License Version 1.2
+#   (the "License"); you may not use this file except in compliance with
+#   the License.  Software distributed under the License is distributed
+#   on an "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, either express or
+#   implied. See the LICENSE file for the specific language governing
+#   rights and limitations under the License.  The Original Software
+#   is "NetEpi Collection". The Initial Developer of the Original
+#   Software is the Health Administration Corporation, incorporated in
+#   the State of New South Wales, Australia.
+#
+#   Copyright (C) 2004-2011 Health Administration Corporation, Australian
+#   Government Department of Health and Ageing, and others.
+#   All Rights Reserved.
+#
+#   Contributors: See the CONTRIBUTORS file for details of contributions.
+#
+import unittest
+from cocklebur.dbobj import prepared, dbapi
+
+class DummyCurs:
+    def __init__(self, fail=()):
+        self.cmds = []
+        self.fail = fail
+
+    def execute(self, cmd, args):
+        for f in self.fail:
+            if cmd.startswith(f):
+                raise dbapi.ProgrammingError('could not prepare')
+        self.cmds.append((cmd, tuple(args)))
+
+class Case(unittest.TestCase):
+    def test_prepared_text(self):
+        self.assertEqual(prepared.prepared_text(
+                    'SELECT * FROM t WHERE a = %s AND b IN (%s,%s)', 3),
+                    'SELECT * FROM t WHERE a = $1 AND b IN ($2,$3)')
+        self.assertEqual(prepared.prepared_text('SELECT %s', 2), None)
+        self.assertEqual(prepared.prepared_text(
+                    "SELECT * FROM t WHERE a LIKE 'x%%'", 0), None)
+        self.assertEqual(prepared.prepared_text('LOCK t', 0), None)
+
+    def test_execute(self):
+        cache = prepared.StatementCache(1)
+        curs = DummyCurs()
+        cmd = 'SELECT * FROM t WHERE a = %s'
+        res, status = cache.execute(curs, cmd, [1])
+        self.assertEqual(status, 'miss')
+        name = curs.cmds[1][0].split()[1]
+        self.assertEqual(curs.cmds, [
+            ('SAVEPOINT dbobj_prepare', ()),
+            ('PREPARE %s AS SELECT * FROM t WHERE a = $1' % name, ()),
+            ('RELEASE SAVEPOINT dbobj_prepare', ()),
+            ('EXECUTE %s (%%s)' % name, (1,)),
+        ])
+        curs.cmds = []
+        res, status = cache.execute(curs, cmd, [2])
+        self.assertEqual(status, 'hit')
+        self.assertEqual(curs.cmds, [('EXECUTE %s (%%s)' % name, (2,))])
+        # Displaces the first statement, which is deallocated next time
+        cache.execute(curs, 'SELECT * FROM u', [])
+        curs.cmds = []
+        cache.execute(curs, 'SELECT * FROM u', [])
+        self.assertEqual(curs.cmds[0], ('DEALLOCATE %s' % name, ()))
+        self.assertEqual(curs.cmds[1][0][:8], 'EXECUTE ')
+        cache.invalidate()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(len(cache.stale), 1)
+
+    def test_unpreparable(self):
+        cache = prepared.StatementCache(10)
+        curs = DummyCurs(fail=('PREPARE',))
+        cmd = 'SELECT %s IS NULL'
+        self.assertEqual(cache.execute(curs, cmd, [1]), (None, None))
+        self.assertEqual(curs.cmds, [
+            ('SAVEPOINT dbobj_prepare', ()),
+            ('ROLLBACK TO SAVEPOINT dbobj_prepare', ()),
+            ('RELEASE SAVEPOINT dbobj_prepare', ()),
+            (cmd, (1,)),
+        ])
+        curs.cmds = []
+        self.assertEqual(cache.execute(curs, cmd, [1]), (None, None))
+        self.assertEqual(curs.cmds, [(cmd, (1,))])
+
+class Suite(unittest.TestSuite):
+    test_list = (
+        'test_prepared_text',
+        'test_execute',
+        'test_unpreparable',
+    )
+    def __init__(self):
+        unittest.TestSuite.__init__(self, map(Case, self.test_list))
+
+def suite():
+    return Suite()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -19,8 +19,12 @@ import unittest
 from cocklebur.dbobj import query_builder
 
 class DummyColDesc:
-    def __init__(self, name):
+    def __init__(self, name, sql_type='INTEGER'):
         self.name = name
+        self.sql_type = sql_type
+
+    def cast_type(self):
+        return self.sql_type
 
 class DummyCurs:
     def __init__(self, table_desc):
@@ -38,6 +42,11 @@ class DummyCurs:
     def fetchall(self):
         return self.table_desc.fetch_result
 
+    def fetchmany(self, count):
+        rows = self.table_desc.fetch_result[:count]
+        self.table_desc.fetch_result = self.table_desc.fetch_result[count:]
+        return rows
+
     def close(self):
         pass
 
@@ -51,6 +60,9 @@ class DummyDB:
     def get_table(self, name):
         return self.table_desc
 
+    def array_params(self):
+        return True
+
 class DummyTableDesc:
     name = 'test_table'
     
@@ -61,6 +73,30 @@ class DummyTableDesc:
     def get_primary_cols(self):
         return DummyColDesc('pkey_a'), DummyColDesc('pkey_b')
 
+    def get_column(self, name):
+        types = {'a': 'INTEGER', 's': 'TEXT', 'd': 'DATE'}
+        return DummyColDesc(name, types[name])
+
+class DummyServerCurs:
+    description = None
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.cmds = []
+
+    def execute(self, cmd, args):
+        self.cmds.append(cmd)
+        self.fetched = []
+        if cmd.startswith('FETCH '):
+            count = int(cmd.split()[1])
+            self.fetched, self.rows = self.rows[:count], self.rows[count:]
+
+    def fetchall(self):
+        return self.fetched
+
+    def close(self):
+        pass
+
 class Case(unittest.TestCase):
     def _test(self, query, expect, expect_args = [], **kwargs):
         got, got_args = query.build_expr(**kwargs)
@@ -195,6 +231,84 @@ class Case(unittest.TestCase):
                           ' WHERE (a IN (%s,%s))', 
                    [1,2])
 
+    def test_where_in_array(self):
+        saved = query_builder.in_array_threshold
+        query_builder.where_in_array(2)
+        try:
+            query = query_builder.Query(DummyTableDesc())
+            query.where_in('a', [1, 2])
+            self._test(query, 'SELECT test_table.*'
+                              ' FROM test_table'
+                              ' WHERE (a IN (%s,%s))', 
+                       [1,2])
+
+            query = query_builder.Query(DummyTableDesc())
+            query.where_in('a', [1, 2, 3])
+            self._test(query, 'SELECT test_table.*'
+                              ' FROM test_table'
+                              ' WHERE (a = ANY (%s::int[]))', 
+                       ['{1,2,3}'])
+
+            query = query_builder.Query(DummyTableDesc())
+            query.where_in(['a'], [(1,), (2,), (2**40,)])
+            self._test(query, 'SELECT test_table.*'
+                              ' FROM test_table'
+                              ' WHERE (a = ANY (%s::bigint[]))', 
+                       ['{1,2,1099511627776}'])
+
+            query = query_builder.Query(DummyTableDesc())
+            query.where_in('test_table.a', ['1', '2', '3'])
+            self._test(query, 'SELECT test_table.*'
+                              ' FROM test_table'
+                              ' WHERE (test_table.a = ANY (%s::int[]))', 
+                       ['{1,2,3}'])
+
+            query = query_builder.Query(DummyTableDesc())
+            query.where_in('s', ['x', 'y"', 'z\\'])
+            self._test(query, 'SELECT test_table.*'
+                              ' FROM test_table'
+                              ' WHERE (s = ANY (%s::text[]))', 
+                       ['{"x","y\\"","z\\\\"}'])
+
+            # Other column types, columns of other tables, mixed types,
+            # NULLs and multi-column tests are not converted
+            query = query_builder.Query(DummyTableDesc())
+            query.where_in('d', ['2011-01-01', '2011-01-02', '2011-01-03'])
+            self._test(query, 'SELECT test_table.*'
+                              ' FROM test_table'
+                              ' WHERE (d IN (%s,%s,%s))', 
+                       ['2011-01-01', '2011-01-02', '2011-01-03'])
+
+            query = query_builder.Query(DummyTableDesc())
+            query.where_in('other.a', [1, 2, 3])
+            self._test(query, 'SELECT test_table.*'
+                              ' FROM test_table'
+                              ' WHERE (other.a IN (%s,%s,%s))', 
+                       [1, 2, 3])
+
+            query = query_builder.Query(DummyTableDesc())
+            query.where_in('a', ['1', 'x', '3'])
+            self._test(query, 'SELECT test_table.*'
+                              ' FROM test_table'
+                              ' WHERE (a IN (%s,%s,%s))', 
+                       ['1', 'x', '3'])
+
+            query = query_builder.Query(DummyTableDesc())
+            query.where_in('a', [1, 2, None])
+            self._test(query, 'SELECT test_table.*'
+                              ' FROM test_table'
+                              ' WHERE (a IN (%s,%s,%s))', 
+                       [1, 2, None])
+
+            query = query_builder.Query(DummyTableDesc())
+            query.where_in(('a', 'b'), [(1, 2), (3, 4), (5, 6)])
+            self._test(query, 'SELECT test_table.*'
+                              ' FROM test_table'
+                              ' WHERE ((a,b) IN ((%s,%s),(%s,%s),(%s,%s)))', 
+                       [1, 2, 3, 4, 5, 6])
+        finally:
+            query_builder.where_in_array(saved)
+
     def test_join(self):
         query = query_builder.Query(DummyTableDesc())
         query.where('a = %s', 1)
@@ -223,6 +337,22 @@ class Case(unittest.TestCase):
     def test_limit(self):
         query = query_builder.Query(DummyTableDesc(), limit = 100)
         self._test(query, 'SELECT test_table.* FROM test_table LIMIT 100')
+        query.offset = 200
+        self._test(query, 'SELECT test_table.* FROM test_table'
+                          ' LIMIT 100 OFFSET 200')
+
+    def test_copy(self):
+        query = query_builder.Query(DummyTableDesc())
+        query.where('a = %s', 1)
+        copy = query.copy()
+        copy.where('b = %s', 2)
+        copy.join('JOIN foo USING (a)')
+        copy.order_by = 'a'
+        self._test(query, 'SELECT test_table.* FROM test_table'
+                          ' WHERE (a = %s)', [1])
+        self._test(copy, 'SELECT test_table.* FROM test_table'
+                         ' JOIN foo USING (a) WHERE (a = %s AND b = %s)'
+                         ' ORDER BY a', [1, 2])
 
     def test_keys_only(self):
         query = query_builder.Query(DummyTableDesc())
@@ -358,6 +488,44 @@ class Case(unittest.TestCase):
                         'SELECT COUNT(*) FROM test_table WHERE (a = %s)', 
                         (1,), 10)
 
+    def test_fetchcols_columnar(self):
+        table_desc = DummyTableDesc(fetch_result=[(1, 'a'), (None, 'b'),
+                                                  (3, None)])
+        query = query_builder.Query(table_desc)
+        a, b = query.fetchcols_columnar(('a', 'b'), fetchcount=2)
+        self.assertEqual(table_desc.execute_cmd, 'SELECT a, b FROM test_table')
+        self.assertEqual((a.name, a.kind, a.values.tolist()),
+                         ('a', 'int', [1, 0, 3]))
+        self.assertEqual(a.nulls.tolist(), [0, 1, 0])
+        self.assertEqual((b.name, b.kind, b.values), 
+                         ('b', 'object', ['a', 'b', None]))
+        table_desc.fetch_result = [(1,), (2,)]
+        a = query.fetchcols_columnar('a')
+        self.assertEqual(a.tolist(), [1, 2])
+
+    def test_yieldcols(self):
+        table_desc = DummyTableDesc()
+        curs = DummyServerCurs([[1, 'a'], [2, 'b'], [3, 'c']])
+        table_desc.db.cursor = lambda: curs
+        query = query_builder.Query(table_desc)
+        query.where('a = %s', 1)
+        rows = query.yieldcols(('a', 'b'), fetchcount=2)
+        self.assertEqual(len(curs.cmds), 1)
+        name = curs.cmds[0].split()[1]
+        self.assertEqual(curs.cmds[0], 
+                         'DECLARE %s NO SCROLL CURSOR FOR '
+                         'SELECT a, b FROM test_table WHERE (a = %%s)' % name)
+        self.assertEqual(list(rows), [(1, 'a'), (2, 'b'), (3, 'c')])
+        self.assertEqual(curs.cmds[1:], ['FETCH 2 FROM ' + name,
+                                         'FETCH 2 FROM ' + name,
+                                         'FETCH 2 FROM ' + name,
+                                         'CLOSE ' + name])
+        curs.rows = [[1, 'a'], [2, 'b']]
+        curs.cmds = []
+        rows = query.yieldcols('a')
+        self.assertEqual(rows.next(), 1)
+        self.assertNotEqual(curs.cmds[0].split()[1], name)
+
 class Suite(unittest.TestSuite):
     test_list = (
         'test_expr_build',
@@ -368,11 +536,13 @@ class Suite(unittest.TestSuite):
         'test_where_andor',
         'test_where_not',
         'test_where_in',
+        'test_where_in_array',
         'test_join',
         'test_distinct',
         'test_order_by',
         'test_for_update',
         'test_limit',
+        'test_copy',
         'test_keys_only',
         'test_sub_select',
         'test_sub_select_where',
@@ -381,6 +551,8 @@ class Suite(unittest.TestSuite):
         'test_where_pkey',
         'test_fetchall',
         'test_aggregate',
+        'test_fetchcols_columnar',
+        'test_yieldcols',
     )
     def __init__(self):
         unittest.TestSuite.__init__(self, map(Case, self.test_list))
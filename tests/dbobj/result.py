@@ -52,6 +52,12 @@ class DummyCursor:
         finally:
             del self.db.result[:count]
 
+    def fetchall(self):
+        try:
+            return self.db.result[:]
+        finally:
+            del self.db.result[:]
+
     def close(self):
         pass
 
@@ -81,6 +87,9 @@ class DummyDescriber(dbobj.DatabaseDescriberCore):
             self._connect_db()
         return DummyCursor(self)
 
+    def server_version(self):
+        return (8, 3)
+
 db = DummyDescriber()
 td = db.new_table('testtable')
 td.column('id', dbobj.SerialColumn, primary_key=True)
@@ -332,6 +341,157 @@ class Case(unittest.TestCase):
         db.rollback()
         self.assertEqual(row.textcol, 'hij')
 
+    def test_copy_rows(self):
+        rows = [(1, 'a'), (2, None), (3, 'c\td\\')]
+        db.reset()
+        curs = db.cursor()
+        self.assertEqual(dbobj.copy_rows(curs, 'testtable', ('id', 'textcol'),
+                                         iter(rows), batch_size=2), 3)
+        self.check_exec([
+            ('INSERT INTO testtable (id, textcol) VALUES (%s, %s), (%s, %s)',
+                (1, 'a', 2, None)),
+            ('INSERT INTO testtable (id, textcol) VALUES (%s, %s)',
+                (3, 'c\td\\')),
+        ])
+        # Adaptors supporting COPY
+        copied = []
+        def copy_from(f, table, columns):
+            copied.append((f.read(), table, columns))
+        curs.copy_from = copy_from
+        self.assertEqual(dbobj.copy_rows(curs, 'testtable', ('id', 'textcol'),
+                                         iter(rows)), 3)
+        self.assertEqual(copied, [
+            ('1\ta\n2\t\\N\n3\tc\\td\\\\\n', 'testtable',
+                ('id', 'textcol')),
+        ])
+
+    def test_batch_insert(self):
+        rs = self.get_rs()
+        for id, text in ((4, 'xyz'), (5, 'uvw')):
+            row = rs.new_row()
+            row.id = id
+            row.textcol = text
+            rs.append(row)
+        db.reset(result=[
+            ('xyz', None, None, None, None, 4, 0),
+            ('uvw', None, None, None, None, 5, 0),
+        ])
+        now = DateTime(2009, 8, 11, 10, 0, 0)
+        testcommon.freeze_time(now, rs.db_update)
+        self.check_exec([
+            ('INSERT INTO testtable (id,textcol,lastupt) VALUES (%s,%s,%s) , '
+             '(%s,%s,%s) RETURNING *', (4, 'xyz', now, 5, 'uvw', now)),
+        ])
+        self.assertEqual(rs.db_has_changed(), False)
+        self.assertEqual([row.is_new() for row in rs], [False] * 4)
+        self.assertEqual(rs[3].id, 5)
+        self.assertEqual(rs[3].textcol, 'uvw')
+        # Rollback returns the rows to their pre-update state
+        db.rollback()
+        self.assertEqual([row.is_new() for row in rs], 
+                         [False, False, True, True])
+        self.assertEqual(rs.db_has_changed(), True)
+
+    def test_batch_update(self):
+        rs = self.get_rs()
+        rs[0].textcol = 'lmn'
+        rs[1].textcol = 'opq'
+        now = DateTime(2009, 8, 11, 10, 0, 0)
+        # Rows are returned keyed by their original primary key, in any order
+        db.reset(result=[
+            (2, 'opq', -2, False, DateTime(2005,2,2), now, 2, 0),
+            (0, 'lmn', -1, True, DateTime(2003,1,1), now, 0, 0),
+        ])
+        DummyCursor.description = [('_key_id',)] + DummyCursor.description
+        DummyCursor.rowcount = 2
+        try:
+            testcommon.freeze_time(now, rs.db_update)
+        finally:
+            del DummyCursor.description[0]
+            DummyCursor.rowcount = 1
+        self.check_exec([
+            ('UPDATE testtable SET textcol=_batch.textcol, '
+             'lastupt=_batch.lastupt FROM (VALUES '
+             '(%s::TEXT,%s::TIMESTAMP,%s::INTEGER) , (%s,%s,%s) ) AS _batch '
+             '(textcol,lastupt,_key_id) WHERE testtable.id=_batch._key_id '
+             'RETURNING _batch._key_id, testtable.*', 
+                ('lmn', now, 0, 'opq', now, 2)),
+        ])
+        self.assertEqual(rs.db_has_changed(), False)
+        self.assertEqual(rs[0].textcol, 'lmn')
+        self.assertEqual(rs[0].lastupt, now)
+        self.assertEqual(rs[1].textcol, 'opq')
+        db.rollback()
+        self.assertEqual(rs.db_has_changed(), True)
+        self.assertEqual(rs[0].textcol, 'lmn')
+        self.assertEqual(rs[0].lastupt, None)
+
+    def test_batch_update_deleted(self):
+        rs = self.get_rs()
+        rs[0].textcol = 'lmn'
+        rs[1].textcol = 'opq'
+        db.reset(result=[])     # DummyCursor.rowcount is 1
+        self.assertRaises(dbobj.RecordDeleted, rs.db_update)
+        self.assertEqual(rs.db_has_changed(), True)
+
+    def test_batch_update_repeated(self):
+        now = DateTime(2009, 8, 11, 10, 0, 0)
+        # A row listed twice is written once
+        rs = self.get_rs()
+        rs[0].textcol = 'lmn'
+        rs[1].textcol = 'opq'
+        db.reset()
+        DummyCursor.rowcount = 2
+        try:
+            testcommon.freeze_time(now, db.update_rows,
+                                   [rs[0], rs[1], rs[0]], refetch=False)
+        finally:
+            DummyCursor.rowcount = 1
+        self.check_exec([
+            ('UPDATE testtable SET textcol=_batch.textcol, '
+             'lastupt=_batch.lastupt FROM (VALUES '
+             '(%s::TEXT,%s::TIMESTAMP,%s::INTEGER) , (%s,%s,%s) ) AS _batch '
+             '(textcol,lastupt,_key_id) WHERE testtable.id=_batch._key_id', 
+                ('lmn', now, 0, 'opq', now, 2)),
+        ])
+        # Two rows with the same primary key are written in turn
+        rs = self.get_rs()
+        other_rs = self.get_rs()
+        rs[0].textcol = 'lmn'
+        other_rs[0].intcol = 5
+        db.reset()
+        testcommon.freeze_time(now, db.update_rows, [rs[0], other_rs[0]],
+                               refetch=False)
+        self.check_exec([
+            ('UPDATE testtable SET textcol=%s, lastupt=%s WHERE id=%s',
+                ('lmn', now, 0)),
+            ('UPDATE testtable SET intcol=%s, lastupt=%s WHERE id=%s',
+                (5, now, 0)),
+        ])
+
+    def test_batch_order(self):
+        # Writes to different tables are made in the order given
+        other_td = db.new_table('othertable')
+        other_td.column('id', dbobj.SerialColumn, primary_key=True)
+        other_td.column('textcol', dbobj.StringColumn)
+        rows = []
+        for table_desc, text in ((td, 'a'), (other_td, 'b'), (td, 'c')):
+            row = table_desc.get_row()
+            row.id = len(rows) + 10
+            row.textcol = text
+            rows.append(row)
+        now = DateTime(2009, 8, 11, 10, 0, 0)
+        db.reset()
+        testcommon.freeze_time(now, db.update_rows, rows, refetch=False)
+        self.check_exec([
+            ('INSERT INTO testtable (id,textcol,lastupt) VALUES (%s,%s,%s)',
+                (10, 'a', now)),
+            ('INSERT INTO othertable (id,textcol) VALUES (%s,%s)',
+                (11, 'b')),
+            ('INSERT INTO testtable (id,textcol,lastupt) VALUES (%s,%s,%s)',
+                (12, 'c', now)),
+        ])
+
 class Suite(unittest.TestSuite):
     test_list = (
         'test_null_result',
@@ -342,6 +502,12 @@ class Suite(unittest.TestSuite):
         'test_remove',
         'test_update',
         'test_insert',
+        'test_copy_rows',
+        'test_batch_insert',
+        'test_batch_update',
+        'test_batch_update_deleted',
+        'test_batch_update_repeated',
+        'test_batch_order',
     )
     def __init__(self):
         unittest.TestSuite.__init__(self, map(Case, self.test_list))
@@ -0,0 +1,113 @@
+#
+#   The contents of this file are subject to the HACOS License Version 1.2
+#   (the "License"); you may not use this file except in compliance with
+#   the License.  Software distributed under the License is distributed
+#   on an "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, either express or
+#   implied. See the LICENSE file for the specific language governing
+#   rights and limitations under the License.  The Original Software
+#   is "NetEpi Collection". The Initial Developer of the Original
+#   Software is the Health Administration Corporation, incorporated in
+#   the State of New South Wales, Australia.
+#
+#   Copyright (C) 2004-2011 Health Administration Corporation, Australian
+#   Government Department of Health and Ageing, and others.
+#   All Rights Reserved.
+#
+#   Contributors: See the CONTRIBUTORS file for details of contributions.
+#
+import os
+import csv
+import gzip
+import shutil
+import tempfile
+import unittest
+
+import testcommon
+
+import config
+from casemgr import exportjob
+
+
+class DummyExportSelect:
+    """
+    Stands in for ExportSelect: parts are the labels, then one row per
+    part, failing at part /fail/.
+    """
+    def __init__(self, count):
+        self.count = count
+        self.fail = None
+
+    def filename(self):
+        return 'test.csv'
+
+    def export_parts(self):
+        def part(n):
+            def rows():
+                if n == self.fail:
+                    raise ValueError('part %d failed' % n)
+                return [(n, 'row %d' % n)]
+            return rows
+        parts = [lambda: [('id', 'label')]]
+        for n in range(1, self.count):
+            parts.append(part(n))
+        return parts
+
+
+class ExportJobTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved_spool_dir = config.export_spool_dir
+        config.export_spool_dir = tempfile.mkdtemp()
+        self.credentials = testcommon.DummyCredentials()
+
+    def tearDown(self):
+        shutil.rmtree(config.export_spool_dir, True)
+        config.export_spool_dir = self.saved_spool_dir
+
+    def read_job(self, job):
+        # Concatenated gzip members
+        data = ''.join([gzip.open(fn).read() for fn in job.part_filenames()])
+        return list(csv.reader(data.splitlines()))
+
+    def runTest(self):
+        exportsel = DummyExportSelect(4)
+        exportsel.fail = 2
+        job = exportjob.new_job(self.credentials, exportsel)
+        self.assertEqual(job.part_count, 4)
+        self.assertEqual(job.filename, 'test.csv.gz')
+        self.assertEqual(job.status(), 'interrupted')
+        job.run()
+        self.assertEqual(job.status(), 'failed')
+        self.assertEqual(job.error(), 'part 2 failed')
+        self.assertEqual(job.parts_done(), 2)
+        # Resume from the failed part
+        exportsel.fail = None
+        exportjob._dump(job._filename('export'), exportsel)
+        job.run()
+        self.assertEqual(job.status(), 'done')
+        self.assertEqual(self.read_job(job), [
+            ['id', 'label'],
+            ['1', 'row 1'],
+            ['2', 'row 2'],
+            ['3', 'row 3'],
+        ])
+        # Only visible to the owner
+        jobs = exportjob.user_jobs(self.credentials)
+        self.assertEqual([j.job_id for j in jobs], [job.job_id])
+        other = testcommon.DummyCredentials(user_id=2)
+        self.assertEqual(exportjob.user_jobs(other), [])
+        self.assertRaises(exportjob.ExportJobError,
+                          exportjob.user_job, other, job.job_id)
+        self.assertRaises(exportjob.ExportJobError,
+                          exportjob.ExportJob, '../' + job.job_id)
+        job.delete()
+        self.assertEqual(exportjob.user_jobs(self.credentials), [])
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(ExportJobTest())
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -65,11 +65,35 @@ class FormTest(unittest.TestCase):
         question = form.children[1]
         self.assertEqual(question.text, 'A form question')
 
+    def validation_plan(self):
+        class NS: pass
+        form = form_ui.Form('A test form')
+        section = form_ui.Section('A section')
+        form.append(section)
+        section.question('Q1', inputs=[
+            form_ui.inputs.TextInput('a', maxsize=3),
+            form_ui.inputs.IntInput('b', maximum=10),
+        ])
+        form.question('Q2', input=form_ui.inputs.TextInput('c', required=True))
+        ns = NS()
+        ns.a, ns.b, ns.c = 'abcd', 11, None
+        tree_errors = form.validate(ns)
+        self.assertEqual(len(tree_errors), 3)
+        form.update_validation()
+        self.assertEqual([input.column for input in form.validation_plan],
+                         ['a', 'b', 'c'])
+        plan_errors = form.validate(ns)
+        self.assertEqual(plan_errors.in_order, tree_errors.in_order)
+        self.assertEqual(plan_errors.by_input, tree_errors.by_input)
+        ns.a, ns.b, ns.c = 'abc', 10, 'x'
+        self.assertEqual(len(form.validate(ns)), 0)
+
 
 class FormSuite(unittest.TestSuite):
     test_list = (
         'minimal_form',
         'form_with_section_and_questions',
+        'validation_plan',
     )
 
     def __init__(self):
@@ -142,10 +142,37 @@ class FormLibXMLDBCase(_FormLibTests, testcommon.DBTestCase):
         self.formlib = form_ui.FormLibXMLDB(self.db, 'form_defs')
 
 
+class FormLibXMLDBCacheCase(FormLibXMLDBCase):
+
+    def setUp(self):
+        FormLibXMLDBCase.setUp(self)
+        os.mkdir(scratchdir)
+        self.formlib.cache_dir = scratchdir
+
+    def tearDown(self):
+        shutil.rmtree(scratchdir)
+        FormLibXMLDBCase.tearDown(self)
+
+    def runTest(self):
+        FormLibXMLDBCase.runTest(self)
+        # Only the remaining form should be cached
+        cached = os.listdir(scratchdir)
+        self.assertEqual(len(cached), 1)
+        self.failUnless(cached[0].startswith('formcache1-altform-1-'))
+        # And a fresh library should load an equal form from the cache
+        form = self.formlib.load('altform', 1)
+        formlib = form_ui.FormLibXMLDB(self.db, 'form_defs', scratchdir)
+        loadedform = formlib.load('altform', 1)
+        self.failIf(loadedform is form)
+        self.assertEqual(loadedform, form)
+        self.assertEqual(loadedform.table, 'form_altform_00001')
+
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(FormLibPyFilesCase())
     suite.addTest(FormLibXMLDBCase())
+    suite.addTest(FormLibXMLDBCacheCase())
     return suite
 
 if __name__ == '__main__':
@@ -0,0 +1,50 @@
+#
+#   The contents of this file are subject to the HACOS License Version 1.2
+#   (the "License"); you may not use this file except in compliance with
+#   the License.  Software distributed under the License is distributed
+#   on an "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, either express or
+#   implied. See the LICENSE file for the specific language governing
+#   rights and limitations under the License.  The Original Software
+#   is "NetEpi Collection". The Initial Developer of the Original
+#   Software is the Health Administration Corporation, incorporated in
+#   the State of New South Wales, Australia.
+#
+#   Copyright (C) 2004-2011 Health Administration Corporation, Australian
+#   Government Department of Health and Ageing, and others.
+#   All Rights Reserved.
+#
+#   Contributors: See the CONTRIBUTORS file for details of contributions.
+#
+import unittest
+from cocklebur.lrucache import LRUCache
+
+class Case(unittest.TestCase):
+    def runTest(self):
+        cache = LRUCache(3)
+        cache['a'] = 1
+        cache['b'] = 2
+        cache['c'] = 3
+        self.assertEqual(cache.keys(), ['c', 'b', 'a'])
+        self.assertEqual(cache['a'], 1)
+        self.assertEqual(cache.keys(), ['a', 'c', 'b'])
+        cache['d'] = 4                  # discards 'b'
+        self.assertEqual(len(cache), 3)
+        self.failIf('b' in cache)
+        self.assertRaises(KeyError, cache.__getitem__, 'b')
+        self.assertEqual(cache.get('b', 9), 9)
+        self.assertEqual(cache.keys(), ['d', 'a', 'c'])
+        cache['c'] = 5                  # replace makes most recent
+        self.assertEqual(cache.keys(), ['c', 'd', 'a'])
+        self.assertEqual(cache['c'], 5)
+        del cache['d']
+        self.assertEqual(cache.keys(), ['c', 'a'])
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.keys(), [])
+
+def suite():
+    return Case()
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,230 @@
+#
+#   The contents of this file are subject to the HACOS License Version 1.2
+#   (the "License"); you may not use this file except in compliance with
+#   the License.  Software distributed under the License is distributed
+#   on an "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, either express or
+#   implied. See the LICENSE file for the specific language governing
+#   rights and limitations under the License.  The Original Software
+#   is "NetEpi Collection". The Initial Developer of the Original
+#   Software is the Health Administration Corporation, incorporated in
+#   the State of New South Wales, Australia.
+#
+#   Copyright (C) 2004-2011 Health Administration Corporation, Australian
+#   Government Department of Health and Ageing, and others.
+#   All Rights Reserved.
+#
+#   Contributors: See the CONTRIBUTORS file for details of contributions.
+#
+
+import unittest
+
+from cocklebur import dbobj
+
+import testcommon
+
+from casemgr import paged_search, resultpersons
+
+
+class Prefs:
+
+    def __init__(self, results_per_page):
+        self.results_per_page = results_per_page
+
+    def get(self, name):
+        return getattr(self, name)
+
+
+class KeysetSearch(paged_search.SortablePagedSearch):
+    keyset = True
+
+
+class Case(testcommon.DBTestCase):
+
+    def setUp(self):
+        td = self.new_table('events')
+        td.column('event_id', dbobj.SerialColumn, primary_key=True)
+        td.column('event_date', dbobj.DateColumn)
+        td.column('event_type', dbobj.StringColumn)
+        td.create()
+        dates = ['2010-01-0%d' % (n % 4 + 1) for n in range(13)]
+        dates[3] = dates[8] = None
+        for n, date in enumerate(dates):
+            row = self.db.new_row('events')
+            row.event_date = date
+            row.event_type = 'type%d' % (n % 3)
+            row.db_update(refetch=False)
+
+    def test_keyset_order(self):
+        td = self.db.get_table('events')
+        self.assertEqual(paged_search.keyset_order(td, 'event_date'),
+                         [('events.event_date', False),
+                          ('events.event_id', False)])
+        self.assertEqual(paged_search.keyset_order(td, 
+                                'events.event_type DESC, event_id'),
+                         [('events.event_type', True),
+                          ('events.event_id', False)])
+        self.assertEqual(paged_search.keyset_order(td, 'users.username'),
+                         None)
+        self.assertEqual(paged_search.keyset_order(td, 'lower(event_type)'),
+                         None)
+        self.assertEqual(paged_search.keyset_order(td, 'nosuchcol'), None)
+
+    def _pages(self, search):
+        pages = []
+        search.reset()
+        while True:
+            pages.append(search.page_pkeys())
+            if not search.has_next():
+                break
+            search.next()
+        return pages
+
+    def _test(self, order_by):
+        query = self.db.query('events', order_by=order_by)
+        classic = paged_search.SortablePagedSearch(self.db, Prefs(3), query)
+        keyset = KeysetSearch(self.db, Prefs(3), query.copy())
+        expect = self._pages(classic)
+        self.assertEqual(self._pages(keyset), expect)
+        self.assertEqual(keyset.pkeys, None)
+        self.assertEqual(keyset.result_count(), 13)
+        # Jump ahead, then back
+        keyset.reset()
+        keyset.page = 4
+        self.assertEqual(keyset.page_pkeys(), expect[3])
+        keyset.page = 2
+        self.assertEqual(keyset.page_pkeys(), expect[1])
+
+    def test_keyset(self):
+        self._test('event_date')
+        self._test('event_date DESC')
+        self._test('event_type DESC,event_date')
+
+    def test_fallback(self):
+        query = self.db.query('events', order_by='lower(event_type)')
+        search = KeysetSearch(self.db, Prefs(3), query)
+        self.assertEqual(len(search.pkeys), 13)
+        self.assertEqual(search.keyset_pkeys, None)
+
+
+class SearchOps:
+
+    def __init__(self, persons_per_page):
+        self.prefs = Prefs(persons_per_page)
+        self.prefs.persons_per_page = persons_per_page
+
+
+class ClassicResultPersons(resultpersons.ResultPersons):
+    keyset = False
+
+
+class PersonsCase(testcommon.DBTestCase):
+
+    def setUp(self):
+        td = self.new_table('persons')
+        td.column('person_id', dbobj.SerialColumn, primary_key=True)
+        td.column('surname', dbobj.StringColumn)
+        td.create()
+        td = self.new_table('cases')
+        td.column('case_id', dbobj.SerialColumn, primary_key=True)
+        td.column('person_id', dbobj.ReferenceColumn, references='persons')
+        td.column('notification_datetime', dbobj.DatetimeColumn)
+        td.create()
+        surnames = ['S%02d' % (n * 7 % 11) for n in range(11)]
+        surnames[2] = None
+        for surname in surnames:
+            row = self.db.new_row('persons')
+            row.surname = surname
+            row.db_update(refetch=False)
+        # Persons 3 and 8 have two cases, person 5 has none
+        person_ids = [1, 2, 3, 4, 6, 7, 8, 9, 10, 11, 3, 8]
+        for n, person_id in enumerate(person_ids):
+            row = self.db.new_row('cases')
+            row.person_id = person_id
+            row.notification_datetime = '2010-01-%02d 12:00' % (20 - n)
+            row.db_update(refetch=False)
+
+    def _query(self, order_by):
+        query = self.db.query('persons', 
+                              order_by=order_by + ['notification_datetime'])
+        query.join('JOIN cases USING (person_id)')
+        return query
+
+    def _pages(self, result):
+        pages = []
+        result.page = 1
+        while True:
+            pages.append(result.page_pkeys())
+            if not result.has_next():
+                break
+            result.next()
+        return pages
+
+    def _test(self, order_by):
+        classic = ClassicResultPersons(SearchOps(3), self._query(order_by),
+                                       person_order=order_by)
+        keyset = resultpersons.ResultPersons(SearchOps(3),
+                                             self._query(order_by),
+                                             person_order=order_by)
+        self.assertEqual(keyset.pkeys, None)
+        self.assertEqual(len(keyset), 10)
+        expect = self._pages(classic)
+        self.assertEqual(self._pages(keyset), expect)
+        keyset.page = 2
+        self.assertEqual(keyset.page_pkeys(), expect[1])
+        classic.select_all()
+        keyset.select_all()
+        self.assertEqual(keyset.selected, classic.selected)
+        self.assertEqual(keyset.get_selected(), classic.get_selected())
+        keyset.select([12, 3, 11])
+        classic.select([12, 3, 11])
+        self.assertEqual(keyset.get_selected(), classic.get_selected())
+
+    def test_keyset(self):
+        self._test(['surname'])
+        self._test(['surname DESC'])
+
+    def test_single_case(self):
+        query = self._query(['surname'])
+        query.where('case_id = 1')
+        result = resultpersons.ResultPersons(SearchOps(3), query,
+                                             person_order=['surname'])
+        self.assertEqual(result.single_case(), 1)
+        query = self._query(['surname'])
+        query.where('person_id = 3')
+        result = resultpersons.ResultPersons(SearchOps(3), query,
+                                             person_order=['surname'])
+        self.assertEqual(result.single_case(), None)
+        query = self._query(['surname'])
+        query.where('person_id = 5')
+        result = resultpersons.ResultPersons(SearchOps(3), query,
+                                             person_order=['surname'])
+        self.assertEqual(len(result), 0)
+
+    def test_fallback(self):
+        result = resultpersons.ResultPersons(SearchOps(3), 
+                                             self._query(['case_id']),
+                                             person_order=['case_id'])
+        self.assertEqual(len(result.pkeys), 10)
+        self.assertEqual(result.keyset_pkeys, None)
+
+
+class Suite(unittest.TestSuite):
+    test_list = (
+        'test_keyset_order',
+        'test_keyset',
+        'test_fallback',
+    )
+    persons_test_list = (
+        'test_keyset',
+        'test_single_case',
+        'test_fallback',
+    )
+    def __init__(self):
+        unittest.TestSuite.__init__(self, map(Case, self.test_list))
+        self.addTests(map(PersonsCase, self.persons_test_list))
+
+def suite():
+    return Suite()
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
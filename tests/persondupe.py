@@ -15,16 +15,23 @@
 #
 #   Contributors: See the CONTRIBUTORS file for details of contributions.
 #
+import os
+import sys
+import stat
+import time
+import shutil
+import tempfile
 import unittest
+from cStringIO import StringIO
 from mx.DateTime import DateTime
 
 import testcommon
 
-from casemgr import persondupe, persondupecfg
+from casemgr import persondupe, persondupecfg, persondupeindex
 
 
 class NGramWrapper(persondupe.NGram):
-    ngram_map = {}
+    index = persondupe.NGramIndex()
 
     def __init__(self, *values):
         self.fields = []
@@ -65,6 +72,32 @@ class NGramTest(unittest.TestCase):
         self.assertAlmostEqual(a.match(c), 0.67, 2)
         self.assertAlmostEqual(a.match(d), 0.00, 2)
 
+class StopGramIndex(persondupe.NGramIndex):
+    MIN_STOPGRAM_POSTINGS = 1
+
+
+class StopGramTest(unittest.TestCase):
+    names = [
+        ('Smith', 'John'), ('Smithe', 'John'), ('Smith', 'Jon'),
+        ('Smithson', 'Jane'), ('Johnson', 'Jane'), ('Jackson', 'John'),
+        ('Jones', 'Jo'), ('Li', 'Jo'), ('Lim', 'Jo'), ('Lee', 'Jo'),
+        ('Mason', 'Sam'), ('Samson', 'Mason'), ('Smith', 'Sam'),
+    ]
+
+    def matches(self, index):
+        class Wrapper(NGramWrapper):
+            pass
+        Wrapper.index = index
+        ngrams = [Wrapper(*name) for name in self.names]
+        index.scan()
+        return [ng.matches for ng in ngrams]
+
+    def runTest(self):
+        # Capping common n-grams must not change the matches found
+        self.assertEqual(self.matches(StopGramIndex(0.2)), 
+                         self.matches(persondupe.NGramIndex()))
+
+
 class Person:
     id = 0
     def __init__(self, surname, given_names, sex=None, DOB=None, DOB_prec=0,
@@ -113,11 +146,14 @@ class MatchPersons(persondupe.MatchPersons):
 
 
 class PersonDupeTest(unittest.TestCase):
+    jobs = 1
+    index_dir = None
+
     def runTest(self):
         real_dupe_lock = persondupe.dupe_lock
         persondupe.dupe_lock = lambda a, b: None
         try:
-            mp = MatchPersons(None)
+            mp = MatchPersons(None, jobs=self.jobs, index_dir=self.index_dir)
         finally:
             persondupe.dupe_lock = real_dupe_lock
         likely = [(pair.low_person_id, pair.high_person_id) 
@@ -128,12 +164,118 @@ class PersonDupeTest(unittest.TestCase):
             (5, 6),
             (1, 2),
         ])
-        
+
+
+class ParallelPersonDupeTest(PersonDupeTest):
+    jobs = 3
+
+
+class FailingMatchPersons(MatchPersons):
+    """
+    The first worker to start fails, the rest would run for a minute
+    """
+    def _compare_worker(self, pairs, wfd):
+        try:
+            os.close(os.open(self.marker, os.O_CREAT|os.O_EXCL))
+        except OSError:
+            time.sleep(60)
+        os._exit(1)
+
+
+class FailedWorkerPersonDupeTest(unittest.TestCase):
+    def runTest(self):
+        tmpdir = tempfile.mkdtemp()
+        real_dupe_lock = persondupe.dupe_lock
+        persondupe.dupe_lock = lambda a, b: None
+        try:
+            FailingMatchPersons.marker = os.path.join(tmpdir, 'failed')
+            t0 = time.time()
+            self.assertRaises(OSError, FailingMatchPersons, None, jobs=3)
+            self.failUnless(time.time() - t0 < 30)
+            # No workers left running or unreaped
+            self.assertRaises(OSError, os.waitpid, -1, os.WNOHANG)
+        finally:
+            persondupe.dupe_lock = real_dupe_lock
+            shutil.rmtree(tmpdir)
+
+
+class UnwritableIndexPersonDupeTest(PersonDupeTest):
+    # Failing to write the index is reported, but the scan completes
+    index_dir = '/nonexistent/dupeindex'
+
+    def runTest(self):
+        real_stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            PersonDupeTest.runTest(self)
+            self.failUnless('not indexed' in sys.stderr.getvalue())
+        finally:
+            sys.stderr = real_stderr
+
+
+class PersonDupeIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.index_dir)
+
+    def get_index(self, persons):
+        matchers = persondupe.get_matchers(persondupecfg.new_persondupecfg())
+        records = [persondupe.Record(p, matchers) for p in persons]
+        for record in records:
+            record.prescan()
+        index = persondupeindex.PersonDupeIndex(self.index_dir, matchers)
+        return index, records
+
+    def runTest(self):
+        self.check_index()
+        # Most n-grams become stop-grams
+        real_min = persondupe.NGramIndex.MIN_STOPGRAM_POSTINGS
+        persondupe.NGramIndex.MIN_STOPGRAM_POSTINGS = 1
+        try:
+            self.check_index()
+        finally:
+            persondupe.NGramIndex.MIN_STOPGRAM_POSTINGS = real_min
+
+    def check_index(self):
+        persons = MatchPersons.test_records
+        # Full scan
+        index, records = self.get_index(persons)
+        likely = {}
+        for record in records:
+            likely[record.key] = set([other.key for other in record.likely])
+        index.build(records, persondupe.uncertain)
+        # Updated only scan - candidates should include all likely matches
+        for person in persons:
+            index, records = self.get_index([person])
+            self.failUnless(index.load())
+            candidates = index.candidates(records, persondupe.uncertain)
+            self.failUnless(likely[person.person_id].issubset(candidates))
+            self.failIf(person.person_id in candidates)
+            index.update(records)
+        index, records = self.get_index([])
+        self.failUnless(index.load())
+        self.assertEqual(len(index.delta), len(persons))
+        filenames = os.listdir(self.index_dir)
+        filenames.sort()
+        self.assertEqual(filenames,
+                         [os.path.basename(index.basename) + ext
+                          for ext in ('.delta', '.dir', '.post')])
+        for fn in filenames:
+            mode = os.stat(os.path.join(self.index_dir, fn)).st_mode
+            self.assertEqual(stat.S_IMODE(mode), 0644)
+
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(NGramTest())
+    suite.addTest(StopGramTest())
     suite.addTest(PersonDupeTest())
+    suite.addTest(ParallelPersonDupeTest())
+    suite.addTest(FailedWorkerPersonDupeTest())
+    suite.addTest(UnwritableIndexPersonDupeTest())
+    suite.addTest(PersonDupeIndexTest())
     return suite
 
 if __name__ == '__main__':
@@ -0,0 +1,59 @@
+#
+#   The contents of this file are subject to the HACOS License Version 1.2
+#   (the "License"); you may not use this file except in compliance with
+#   the License.  Software distributed under the License is distributed
+#   on an "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, either express or
+#   implied. See the LICENSE file for the specific language governing
+#   rights and limitations under the License.  The Original Software
+#   is "NetEpi Collection". The Initial Developer of the Original
+#   Software is the Health Administration Corporation, incorporated in
+#   the State of New South Wales, Australia.
+#
+#   Copyright (C) 2004-2011 Health Administration Corporation, Australian
+#   Government Department of Health and Ageing, and others.
+#   All Rights Reserved.
+#
+#   Contributors: See the CONTRIBUTORS file for details of contributions.
+#
+import unittest
+from casemgr import phonetic_encode
+
+class Case(unittest.TestCase):
+    encodings = [
+        # name, soundex, mod_soundex, phonex, nysiis, dmetaphone
+        ('peter', 'p360', 'p690', 'b360', 'pata', 'ptr'),
+        ('christen', 'c623', 'c936', 'c623', 'chra', 'krst'),
+        ('nielsen', 'n425', 'n738', 'n250', 'nals', 'nlsn'),
+        ('stephen', 's315', 's618', 's315', 'staf', 'stfn'),
+        ('churches', 'c622', 'c930', 'c200', 'carc', 'xrxs'),
+        ('xiong', 'x520', 'x840', 'x500', 'xang', 'snk'),
+        ('ng', 'n200', 'n400', 'n000', 'ng', 'nk'),
+        ('foccachio', 'f220', 'f300', 'f200', 'faca', 'fkx'),
+        ('van de hooch', 'v532', 'v863', 'f532', 'vand', 'fntk'),
+        ('von der felde', 'v536', 'v869', 'f531', 'vand', 'fntr'),
+        ('oihcca', 'o200', 'o300', 'a200', 'oc', 'ak'),
+        ('michael', 'm240', 'm370', 'm240', 'maca', 'mkl'),
+        ('caesar', 'c260', 'c390', 'c260', 'casa', 'ssr'),
+        ('schmidt', 's253', 's386', 's530', 'snad', 'xmt'),
+        ('edgar', 'e326', 'e649', 'a326', 'egar', 'atkr'),
+        ('ghislane', 'g245', 'g378', 'g245', 'gasl', 'jln'),
+        ('gallegos', 'g422', 'g743', 'g420', 'gala', 'klks'),
+        ('mcdonald', 'm235', 'm368', 'm235', 'mcda', 'mktn'),
+        ('thomas', 't520', 't830', 't500', 'tan', 'tms'),
+        ('jose', 'j200', 'j300', 'g200', 'jas', 'hs'),
+        ('', '0000', '0000', '0000', '', ''),
+    ]
+    encoders = 'soundex', 'mod_soundex', 'phonex', 'nysiis', 'dmetaphone'
+
+    def runTest(self):
+        for expect in self.encodings:
+            name = expect[0]
+            for encoder, code in zip(self.encoders, expect[1:]):
+                self.assertEqual(getattr(phonetic_encode, encoder)(name), code,
+                                 '%s(%r)' % (encoder, name))
+
+def suite():
+    return Case()
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
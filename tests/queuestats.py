@@ -0,0 +1,116 @@
+#
+#   The contents of this file are subject to the HACOS License Version 1.2
+#   (the "License"); you may not use this file except in compliance with
+#   the License.  Software distributed under the License is distributed
+#   on an "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, either express or
+#   implied. See the LICENSE file for the specific language governing
+#   rights and limitations under the License.  The Original Software
+#   is "NetEpi Collection". The Initial Developer of the Original
+#   Software is the Health Administration Corporation, incorporated in
+#   the State of New South Wales, Australia.
+#
+#   Copyright (C) 2004-2011 Health Administration Corporation, Australian
+#   Government Department of Health and Ageing, and others.
+#   All Rights Reserved.
+#
+#   Contributors: See the CONTRIBUTORS file for details of contributions.
+#
+
+import unittest
+
+from cocklebur import dbobj
+
+import testcommon
+
+from casemgr import tasks
+
+#dbobj.execute_debug(1)
+
+
+class Case(testcommon.DBTestCase):
+
+    def setUp(self):
+        td = self.new_table('workqueues')
+        td.column('queue_id', dbobj.SerialColumn, primary_key=True)
+        td.create()
+
+        td = self.new_table('tasks')
+        td.column('task_id', dbobj.SerialColumn, primary_key=True)
+        td.column('queue_id', dbobj.ReferenceColumn, references = 'workqueues')
+        td.column('due_date', dbobj.DatetimeColumn)
+        td.column('completed_date', dbobj.DatetimeColumn)
+        td.column('locked_by_id', dbobj.IntColumn)
+        td.create()
+
+        curs = self.db.cursor()
+        for queue_id in (1, 2, 3):
+            dbobj.execute(curs, 'INSERT INTO workqueues VALUES (%s)',
+                          (queue_id,))
+        # Queue 1: overdue, locked and not yet due, completed
+        self.add_task(1, due_date='2000-01-01')
+        self.add_task(1, due_date='2100-01-01', locked_by_id=1)
+        self.add_task(1, due_date='2000-01-01', completed_date='2000-01-02')
+        # Queue 2: no due date
+        self.add_task(2)
+        # Queue 3: no tasks
+
+        self.queue_counts = tasks.QueueCounts()
+
+    def add_task(self, queue_id, **kwargs):
+        row = self.db.new_row('tasks')
+        row.queue_id = queue_id
+        for name, value in kwargs.items():
+            setattr(row, name, value)
+        row.db_update(refetch=False)
+
+    def runTest(self):
+        #                   total active overdue completed locked
+        self.assertEqual(self.queue_counts.get(1), (3, 2, 1, 1, 1))
+        self.assertEqual(self.queue_counts.get(2), (1, 1, 0, 0, 0))
+        self.assertEqual(self.queue_counts.get(3), (0, 0, 0, 0, 0))
+        self.assertEqual(self.queue_counts.get(None), (4, 3, 1, 1, 1))
+
+    def test_notification(self):
+        qc = self.queue_counts
+        self.assertEqual(qc.get(1), (3, 2, 1, 1, 1))
+        self.assertEqual(qc.get(2), (1, 1, 0, 0, 0))
+        self.assertEqual(qc.get(None), (4, 3, 1, 1, 1))
+        # Counts are cached until notified
+        self.add_task(1)
+        self.add_task(2)
+        self.assertEqual(qc.get(1), (3, 2, 1, 1, 1))
+        self.assertEqual(qc.get(2), (1, 1, 0, 0, 0))
+        self.assertEqual(qc.get(None), (4, 3, 1, 1, 1))
+        # Notification of queue 2 also discards the counts of all queues
+        qc.notification('2')
+        self.assertEqual(qc.get(1), (3, 2, 1, 1, 1))
+        self.assertEqual(qc.get(2), (2, 2, 0, 0, 0))
+        self.assertEqual(qc.get(None), (6, 5, 1, 1, 1))
+        qc.notification('1')
+        self.assertEqual(qc.get(1), (4, 3, 1, 1, 1))
+        # Counts loaded within settle_time of a notification are not kept
+        self.add_task(1, locked_by_id=1)
+        self.assertEqual(qc.get(1), (5, 4, 1, 1, 2))
+        # But are once it has passed
+        qc.settle_time = -1
+        self.assertEqual(qc.get(1), (5, 4, 1, 1, 2))
+        self.add_task(1)
+        self.assertEqual(qc.get(1), (5, 4, 1, 1, 2))
+        qc.notification('None')
+        self.assertEqual(qc.get(1), (5, 4, 1, 1, 2))
+        self.assertEqual(qc.get(None), (8, 7, 1, 1, 2))
+
+
+class Suite(unittest.TestSuite):
+    test_list = (
+        'runTest',
+        'test_notification',
+    )
+    def __init__(self):
+        unittest.TestSuite.__init__(self, map(Case, self.test_list))
+
+def suite():
+    return Suite()
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -16,7 +16,10 @@
 #   Contributors: See the CONTRIBUTORS file for details of contributions.
 #
 
-from casemgr import reports, messages
+import unittest
+
+from casemgr import globals, reports, messages, cached
+from casemgr.reports import crosstab as crosstab_mod
 
 from tests.reports import common
 from tests import testcommon
@@ -168,3 +171,94 @@ class CrosstabReportTests(common.ReportTest):
                 page.append(row)
             pages.append(page)
         self.assertEqual(pages, desc_expect)
+
+
+class CrosstabCubeTests(unittest.TestCase):
+
+    rows = [
+        (1, 'confirmed', 'M', 'True'),
+        (2, 'confirmed', 'F', 'True'),
+        (3, 'suspect', 'M', 'False'),
+        (3, 'suspect', 'M', 'True'),
+        (4, 'confirmed', 'M', 'True'),
+    ]
+    counts = [
+        (2, 'confirmed', 'M', 'True'),
+        (1, 'confirmed', 'F', 'True'),
+        (1, 'suspect', 'M', 'False'),
+        (1, 'suspect', 'M', 'True'),
+    ]
+
+    def test_cube(self):
+        TOTAL = crosstab_mod.TOTAL
+        cube = crosstab_mod.CrosstabCube(self.counts, True)
+        tally = cube.tally
+        self.assertEqual(tally[('confirmed', 'M', 'True')], 2)
+        self.assertEqual(tally[('confirmed', TOTAL, 'True')], 3)
+        self.assertEqual(tally[(TOTAL, 'M', TOTAL)], 4)
+        self.assertEqual(tally[(TOTAL, TOTAL, TOTAL)], 5)
+        self.assertEqual(cube.cells, None)
+        cube.load_cells(self.rows)
+        self.assertEqual(cube.case_ids('confirmed', 'M', 'True'), [1, 4])
+        self.assertEqual(cube.case_ids('suspect', TOTAL, TOTAL), [3])
+        self.assertEqual(cube.case_ids(TOTAL, TOTAL, TOTAL), [1, 2, 3, 4])
+        cube = crosstab_mod.CrosstabCube([(2, 'confirmed', 'M'),
+                                          (1, 'confirmed', 'F'),
+                                          (2, 'suspect', 'M')], False)
+        self.assertEqual(cube.tally[('suspect', 'M', TOTAL)], 2)
+        cube.load_cells([row[:3] for row in self.rows])
+        self.assertEqual(cube.case_ids(TOTAL, 'M', TOTAL), [1, 3, 4])
+
+    def test_cache(self):
+        cache = crosstab_mod.CubeCache(2)
+        # Dummy notification client - caching disabled
+        cache.put((1, 'a', ()), crosstab_mod.CrosstabCube(self.counts, True))
+        self.assertEqual(cache.get((1, 'a', ())), None)
+        cache.enabled = True
+        cube = crosstab_mod.CrosstabCube(self.counts, True)
+        cache.put((1, 'a', ()), cube)
+        cache.put((2, 'a', ()), cube)
+        self.failUnless(cache.get((1, 'a', ())) is cube)
+        cache.notification('1')
+        self.assertEqual(cache.get((1, 'a', ())), None)
+        self.failUnless(cache.get((2, 'a', ())) is cube)
+        # Loaded before the change settled
+        cache.put((1, 'a', ()), cube)
+        self.assertEqual(cache.get((1, 'a', ())), None)
+        cache.notification()
+        self.assertEqual(cache.get((2, 'a', ())), None)
+
+    def test_commit_notify(self):
+        # casedata notifications are sent again when the change commits
+        sent = []
+        pending = []
+        class Notify:
+            def notify(self, *event):
+                sent.append(event)
+        class DB:
+            def add_pending(self, obj):
+                pending.append(obj)
+        saved_notify = globals.notify
+        saved_db = getattr(globals, 'db', None)
+        globals.notify = Notify()
+        globals.db = DB()
+        try:
+            commit_notify = cached.CommitNotify()
+            commit_notify.notify('casedata', 1)
+            commit_notify.notify('casedata', 1)
+            self.assertEqual(sent, [('casedata', 1), ('casedata', 1)])
+            self.failUnless(pending[0] is commit_notify)
+            commit_notify.db_commit()
+            self.assertEqual(sent, [('casedata', 1)] * 3)
+            commit_notify.db_commit()
+            self.assertEqual(len(sent), 3)
+            commit_notify.notify('casedata', 2)
+            commit_notify.db_rollback()
+            commit_notify.db_commit()
+            self.assertEqual(sent[3:], [('casedata', 2)])
+        finally:
+            globals.notify = saved_notify
+            if saved_db is None:
+                del globals.db
+            else:
+                globals.db = saved_db
@@ -22,6 +22,7 @@ from cocklebur import dbobj
 
 import testcommon
 
+import config
 from casemgr import caseaccess
 
 #dbobj.execute_debug(1)
@@ -29,7 +30,7 @@ from casemgr import caseaccess
 
 class Cred:
 
-    def __init__(self, unit_id):
+    def __init__(self, unit_id, user_id=0, rights=()):
         class _Unit:
             def __init__(self, unit_id):
                 self.unit_id = unit_id
@@ -38,15 +39,17 @@ class Cred:
                 self.user_id = user_id
         if unit_id:
             self.unit = _Unit(unit_id)
-            self.rights = ()
+            self.rights = rights
         else:
             self.rights = ('ACCESSALL',)
-        self.user = _User(0)
+        self.user = _User(user_id)
 
 
 class Case(testcommon.DBTestCase):
 
     def setUp(self):
+        self.saved_case_visibility = config.case_visibility
+
         td = self.new_table('cases')
         td.column('case_id', dbobj.SerialColumn, primary_key=True)
         td.column('syndrome_id', dbobj.IntColumn)
@@ -76,6 +79,23 @@ class Case(testcommon.DBTestCase):
         td.column('queue_id', dbobj.ReferenceColumn, references = 'workqueues')
         td.create()
 
+        td = self.new_table('unit_groups')
+        td.column('unit_id', dbobj.IntColumn)
+        td.column('group_id', dbobj.IntColumn)
+        td.create()
+
+        td = self.new_table('group_syndromes')
+        td.column('syndrome_id', dbobj.IntColumn)
+        td.column('group_id', dbobj.IntColumn)
+        td.create()
+
+        td = self.new_table('case_visibility')
+        td.column('unit_id', dbobj.IntColumn)
+        td.column('user_id', dbobj.IntColumn)
+        td.column('case_id', dbobj.ReferenceColumn, references = 'cases')
+        td.column('via_task', dbobj.BooleanColumn)
+        td.create()
+
         curs = self.db.cursor()
         # Case 1, syndrome 1, unit 1 & 3
         dbobj.execute(curs, 'INSERT INTO cases VALUES (1, 1, false)')
@@ -90,21 +110,61 @@ class Case(testcommon.DBTestCase):
         dbobj.execute(curs, 'INSERT INTO cases VALUES (5, 2, false)')
         dbobj.execute(curs, 'INSERT INTO case_acl VALUES (5, 1)')
 
-    # XXX Need to test access via tasks
+        # Case 6, syndrome 2, no unit, tasks in the queue of unit 2, and
+        # in a shared queue with user 7 as a member
+        dbobj.execute(curs, 'INSERT INTO cases VALUES (6, 2, false)')
+        dbobj.execute(curs, 'INSERT INTO workqueues VALUES (1, 2, NULL)')
+        dbobj.execute(curs, 'INSERT INTO workqueues VALUES (2, NULL, NULL)')
+        dbobj.execute(curs, 'INSERT INTO workqueue_members'
+                            ' VALUES (2, NULL, 7)')
+        dbobj.execute(curs, 'INSERT INTO tasks VALUES (1, 6, 1)')
+        dbobj.execute(curs, 'INSERT INTO tasks VALUES (2, 6, 2)')
+
+        # Unit 3 has syndrome 2 (group 1)
+        dbobj.execute(curs, 'INSERT INTO unit_groups VALUES (3, 1)')
+        dbobj.execute(curs, 'INSERT INTO group_syndromes VALUES (2, 1)')
+
+    def tearDown(self):
+        config.case_visibility = self.saved_case_visibility
+        testcommon.DBTestCase.tearDown(self)
+
+    def _test(self, cred, expect):
+        query = self.db.query('cases', order_by='case_id')
+        caseaccess.acl_query(query, cred)
+        self.assertEqual(query.fetchcols('case_id'), expect)
+
+    def _test_all(self):
+        self._test(Cred(None), [1, 4, 5, 6])
+        self._test(Cred(1),    [1, 5])
+        self._test(Cred(2),    [6])
+        self._test(Cred(3),    [1])
+        self._test(Cred(4, 7), [6])
+        self._test(Cred(3, rights=('ACCESSSYND',)), [5, 6])
+
     def runTest(self):
-        def _test(cred, expect):
-            query = self.db.query('cases')
-            caseaccess.acl_query(query, cred)
-            self.assertEqual(query.fetchcols('case_id'), expect)
+        config.case_visibility = False
+        self._test_all()
 
-        _test(Cred(None), [1, 4, 5])
-        _test(Cred(1),    [1, 5])
-        _test(Cred(2),    [])
+    def test_visibility(self):
+        config.case_visibility = True
+        caseaccess.rebuild(self.db)
+        self._test_all()
+        curs = self.db.cursor()
+        dbobj.execute(curs, 'DELETE FROM case_acl WHERE unit_id = 3')
+        dbobj.execute(curs, 'INSERT INTO case_acl VALUES (4, 2)')
+        caseaccess.refresh_cases(self.db, [1, 4])
+        self._test(Cred(3), [])
+        self._test(Cred(2), [4, 6])
+        dbobj.execute(curs, 'DELETE FROM workqueue_members')
+        caseaccess.refresh_queue(self.db, 2)
+        self._test(Cred(4, 7), [])
+        self._test(Cred(2), [4, 6])
 
 
 class Suite(unittest.TestSuite):
     test_list = (
         'runTest',
+        'test_visibility',
     )
     def __init__(self):
         unittest.TestSuite.__init__(self, map(Case, self.test_list))
@@ -114,4 +174,3 @@ def suite():
 
 if __name__ == '__main__':
     unittest.main(defaultTest='suite')
-
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+#
+#   The contents of this file are subject to the HACOS License Version 1.2
+#   (the "License"); you may not use this file except in compliance with
+#   the License.  Software distributed under the License is distributed
+#   on an "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, either express or
+#   implied. See the LICENSE file for the specific language governing
+#   rights and limitations under the License.  The Original Software
+#   is "NetEpi Collection". The Initial Developer of the Original
+#   Software is the Health Administration Corporation, incorporated in
+#   the State of New South Wales, Australia.
+#
+#   Copyright (C) 2004-2011 Health Administration Corporation, Australian
+#   Government Department of Health and Ageing, and others.
+#   All Rights Reserved.
+#
+#   Contributors: See the CONTRIBUTORS file for details of contributions.
+#
+
+
+"""
+Benchmark of case access tests (caseaccess.acl_query), comparing the
+subselects over case_acl, tasks and work queues with the case_visibility
+table.
+
+Run against an application database. By default, the unit granted
+access to the most cases (and the first of its users) is used. Each
+query (a count of matching cases, and the first page of a case search)
+is run --repeat times with each method, and the best time in
+milliseconds reported.
+"""
+
+import sys
+import os
+import time
+import optparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import config
+from cocklebur import dbobj
+from casemgr import caseaccess
+from casemgr.schema import schema
+
+
+class Credentials:
+
+    def __init__(self, unit_id, user_id, rights):
+        self.unit = Unit(unit_id)
+        self.user = User(user_id)
+        self.rights = rights
+
+class Unit:
+    def __init__(self, unit_id):
+        self.unit_id = unit_id
+
+class User:
+    def __init__(self, user_id):
+        self.user_id = user_id
+
+
+def broadest_unit(db):
+    curs = db.cursor()
+    try:
+        dbobj.execute(curs, 'SELECT unit_id FROM case_visibility'
+                            ' WHERE unit_id IS NOT NULL'
+                            ' GROUP BY unit_id ORDER BY count(*) DESC LIMIT 1')
+        row = curs.fetchone()
+        if row is None:
+            sys.exit('No unit has access to any cases')
+        unit_id = row[0]
+        dbobj.execute(curs, 'SELECT min(user_id) FROM unit_users'
+                            ' WHERE unit_id = %s', (unit_id,))
+        user_id = curs.fetchone()[0]
+    finally:
+        curs.close()
+    return unit_id, user_id
+
+
+def best_time(query, columns, repeat):
+    best = None
+    for n in xrange(repeat):
+        st = time.time()
+        query.fetchcols(columns)
+        el = time.time() - st
+        if best is None or el < best:
+            best = el
+    return best * 1000
+
+
+def main():
+    optp = optparse.OptionParser(usage='%prog [options] <dsn>')
+    optp.add_option('--unit-id', type='int',
+                    help='unit to test (default: broadest access)')
+    optp.add_option('--user-id', type='int',
+                    help='user to test (default: first user of the unit)')
+    optp.add_option('--accesssynd', action='store_true',
+                    help='test with the ACCESSSYND right')
+    optp.add_option('--repeat', type='int', default=5,
+                    help='runs of each query (default %default)')
+    options, args = optp.parse_args()
+    if len(args) != 1:
+        optp.error('DSN required')
+    db = schema.define_db(dbobj.DSN(args[0]))
+    unit_id, user_id = options.unit_id, options.user_id
+    if unit_id is None:
+        unit_id, user_id = broadest_unit(db)
+    rights = []
+    if options.accesssynd:
+        rights.append('ACCESSSYND')
+    cred = Credentials(unit_id, user_id, rights)
+    print 'unit_id %s, user_id %s' % (unit_id, user_id)
+    print '%-16s %12s %12s' % ('', 'count', 'search')
+    try:
+        for case_visibility in (False, True):
+            config.case_visibility = case_visibility
+            query = db.query('cases')
+            caseaccess.acl_query(query, cred)
+            count = best_time(query, 'count(*)', options.repeat)
+            query = db.query('cases', order_by='case_id', limit=100)
+            query.join('JOIN persons USING (person_id)')
+            caseaccess.acl_query(query, cred)
+            search = best_time(query, ('case_id', 'surname'), options.repeat)
+            if case_visibility:
+                label = 'case_visibility'
+            else:
+                label = 'subselects'
+            print '%-16s %12.2f %12.2f' % (label, count, search)
+    finally:
+        db.rollback()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+#
+#   The contents of this file are subject to the HACOS License Version 1.2
+#   (the "License"); you may not use this file except in compliance with
+#   the License.  Software distributed under the License is distributed
+#   on an "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, either express or
+#   implied. See the LICENSE file for the specific language governing
+#   rights and limitations under the License.  The Original Software
+#   is "NetEpi Collection". The Initial Developer of the Original
+#   Software is the Health Administration Corporation, incorporated in
+#   the State of New South Wales, Australia.
+#
+#   Copyright (C) 2004-2011 Health Administration Corporation, Australian
+#   Government Department of Health and Ageing, and others.
+#   All Rights Reserved.
+#
+#   Contributors: See the CONTRIBUTORS file for details of contributions.
+#
+
+"""
+Regression benchmark of the epicurve date binning, comparing the
+vectorised (NumPy) binning in casemgr.reports.epicurve.EpiCurve with
+the original per-date loop, and checking the bins are identical.
+
+Synthetic event timestamps are spread (with a seasonal peak) over
+several years, with some missing, and stratified by a random category,
+then loaded into a date column as Query.fetchcols_columnar() would.
+"""
+
+import sys
+import os
+import time
+import random
+import optparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mx import DateTime
+
+# The real casemgr.globals connects to the application database, which
+# isn't needed here (as in tests/testcommon.py)
+from casemgr.notification.client import dummy_notification_client
+class DummyGlobals(object):
+    notify = dummy_notification_client()
+    class Error(Exception): pass
+import casemgr
+sys.modules['casemgr.globals'] = casemgr.globals = DummyGlobals()
+
+from cocklebur.dbobj.columnar import ResultColumn
+from casemgr.reports import epicurve
+
+def loop_date_bin(ec, dates):
+    # The original implementation
+    bins = epicurve.numpy.zeros(ec.n_bins)
+    for date in dates:
+        if date is not None:
+            bin = int((date - ec.first) / ec.bin_span)
+            bins[bin] += 1
+    return bins
+
+def loop_strata_date_bin(ec, dates, *condcols):
+    cols = [cc.data for cc in condcols]
+    rows = zip(*cols)
+    strata_bins = {}
+    for c in set(rows):
+        strata_bins[c] = epicurve.numpy.zeros(ec.n_bins)
+    for d, c in zip(dates, rows):
+        if d is not None:
+            bin = int((d - ec.first) / ec.bin_span)
+            strata_bins[c][bin] += 1
+    return strata_bins
+
+def make_dates(count, years, missing):
+    start = DateTime.DateTime(2005, 1, 1)
+    dates = []
+    for n in xrange(count):
+        if random.random() < missing:
+            dates.append(None)
+        else:
+            # Winter peak
+            day = random.gauss(0.5, 0.15) % 1.0 + random.randrange(years)
+            dates.append(start + day * 365.25)
+    return dates
+
+def timeit(fn, *args):
+    st = time.time()
+    result = fn(*args)
+    return time.time() - st, result
+
+def main():
+    optp = optparse.OptionParser(usage='%prog [options]')
+    optp.add_option('-n', '--count', type='int', default=1000000,
+                    help='number of dates (default %default)')
+    optp.add_option('--years', type='int', default=5,
+                    help='years spanned by the dates (default %default)')
+    optp.add_option('--days', type='int', default=7,
+                    help='days per bin (default %default)')
+    optp.add_option('--strata', type='int', default=6,
+                    help='number of strata (default %default)')
+    options, args = optp.parse_args()
+
+    print 'Generating %d dates ...' % options.count
+    dates = make_dates(options.count, options.years, 0.02)
+    column = ResultColumn('onset_datetime')
+    column.extend(dates)
+    strata = [str(random.randrange(options.strata)) for d in dates]
+
+    ec = epicurve.EpiCurve()
+    ec.set_dates(column)
+    ec.set_stack(strata, None)
+    ec.set_n_days(options.days)
+    print '%d bins of %d days' % (ec.n_bins, options.days)
+
+    loop_el, loop_bins = timeit(loop_date_bin, ec, dates)
+    vec_el, vec_bins = timeit(ec.date_bin, column)
+    assert (loop_bins == vec_bins).all(), 'date_bin results differ'
+    print 'date_bin:        loop %7.3fs, numpy %7.3fs (%.0fx)' % \
+        (loop_el, vec_el, loop_el / vec_el)
+
+    loop_el, loop_bins = timeit(loop_strata_date_bin, ec, dates, ec.stack)
+    vec_el, vec_bins = timeit(ec.strata_date_bin, column, ec.stack)
+    assert sorted(loop_bins) == sorted(vec_bins), 'strata differ'
+    for key, bins in loop_bins.iteritems():
+        assert (vec_bins[key] == bins).all(), 'strata_date_bin results differ'
+    print 'strata_date_bin: loop %7.3fs, numpy %7.3fs (%.0fx)' % \
+        (loop_el, vec_el, loop_el / vec_el)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/python
+#
+#   The contents of this file are subject to the HACOS License Version 1.2
+#   (the "License"); you may not use this file except in compliance with
+#   the License.  Software distributed under the License is distributed
+#   on an "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, either express or
+#   implied. See the LICENSE file for the specific language governing
+#   rights and limitations under the License.  The Original Software
+#   is "NetEpi Collection". The Initial Developer of the Original
+#   Software is the Health Administration Corporation, incorporated in
+#   the State of New South Wales, Australia.
+#
+#   Copyright (C) 2004-2011 Health Administration Corporation, Australian
+#   Government Department of Health and Ageing, and others.
+#   All Rights Reserved.
+#
+#   Contributors: See the CONTRIBUTORS file for details of contributions.
+#
+
+"""
+Micro-benchmark of the phonetic name encoders, with and without the
+LRU memo used by casemgr.fuzzyperson.
+
+Names are read from a CSV file with "given_name" and "surname" columns
+(by default, the load test data), and encoded repeatedly in random order,
+approximating the repetition seen when encoding a persons table.
+"""
+
+import sys
+import os
+import csv
+import gzip
+import time
+import random
+import optparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from casemgr import phonetic_encode
+from cocklebur.lrucache import LRUCache
+
+encoders = 'soundex', 'mod_soundex', 'phonex', 'nysiis', 'dmetaphone'
+
+def load_words(filename):
+    if filename.endswith('.gz'):
+        f = gzip.open(filename)
+    else:
+        f = open(filename)
+    try:
+        reader = csv.reader(f, skipinitialspace=True)
+        header = reader.next()
+        cols = [header.index(n) for n in ('given_name', 'surname')]
+        words = []
+        for row in reader:
+            for col in cols:
+                words.extend(row[col].lower().split())
+        return words
+    finally:
+        f.close()
+
+def timeit(fn, words):
+    st = time.time()
+    for word in words:
+        fn(word)
+    return time.time() - st
+
+def memoised(fn, size):
+    cache = LRUCache(size)
+    def encode(word):
+        try:
+            return cache[word]
+        except KeyError:
+            code = cache[word] = fn(word)
+            return code
+    return encode
+
+def main():
+    default_data = os.path.join(os.path.dirname(__file__), 
+                                '..', 'load', 'testdata.csv.gz')
+    optp = optparse.OptionParser(usage='%prog [options] [names.csv]')
+    optp.add_option('-n', '--count', type='int', default=200000,
+            help='number of words to encode (default %default)')
+    optp.add_option('-s', '--size', type='int', default=50000,
+            help='memo size (default %default)')
+    options, args = optp.parse_args()
+    if args:
+        filename = args[0]
+    else:
+        filename = default_data
+    words = load_words(filename)
+    random.seed(0)
+    sample = [random.choice(words) for i in xrange(options.count)]
+    print '%d words (%d distinct)' % (len(sample), len(set(sample)))
+    print '%-12s %10s %10s %8s' % ('encoder', 'plain', 'memoised', 'speedup')
+    for name in encoders:
+        fn = getattr(phonetic_encode, name)
+        plain = timeit(fn, sample)
+        memo = timeit(memoised(fn, options.size), sample)
+        print '%-12s %9.3fs %9.3fs %7.1fx' % (name, plain, memo, plain / memo)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/python
+#
+#   The contents of this file are subject to the HACOS License Version 1.2
+#   (the "License"); you may not use this file except in compliance with
+#   the License.  Software distributed under the License is distributed
+#   on an "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, either express or
+#   implied. See the LICENSE file for the specific language governing
+#   rights and limitations under the License.  The Original Software
+#   is "NetEpi Collection". The Initial Developer of the Original
+#   Software is the Health Administration Corporation, incorporated in
+#   the State of New South Wales, Australia.
+#
+#   Copyright (C) 2004-2011 Health Administration Corporation, Australian
+#   Government Department of Health and Ageing, and others.
+#   All Rights Reserved.
+#
+#   Contributors: See the CONTRIBUTORS file for details of contributions.
+#
+
+"""
+Load benchmark of the preforking worker supervisor (cocklebur.prefork),
+showing request latency while workers are being recycled.
+
+A pool of workers accepts connections on a shared listening socket (as
+FastCGI workers do), performs a fixed amount of work per request, and
+retires after a (small) number of requests. In "cold" mode, each
+worker pays the application start-up cost (imports, describer load,
+cache warming - simulated with --startup) when it starts, as a restarted
+application process does. In "warm" mode, the start-up cost is paid
+once by the supervisor before forking. Concurrent clients measure the
+latency of each request.
+"""
+
+import sys
+import os
+import time
+import signal
+import socket
+import threading
+import optparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from cocklebur import prefork
+
+def busy(secs):
+    end = time.time() + secs
+    while time.time() < end:
+        pass
+
+def make_worker(listener, options, cold):
+    def serve():
+        if cold:
+            busy(options.startup)
+        for n in xrange(prefork.jitter(options.max_requests)):
+            conn, addr = listener.accept()
+            try:
+                conn.recv(100)
+                busy(options.work)
+                conn.sendall('ok\n')
+            finally:
+                conn.close()
+    return serve
+
+def start_server(options, cold):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(128)
+    addr = listener.getsockname()
+    pid = os.fork()
+    if pid:
+        listener.close()
+        return pid, addr
+    try:
+        if not cold:
+            busy(options.startup)
+        serve = make_worker(listener, options, cold)
+        prefork.Supervisor(options.workers, serve).run()
+    finally:
+        os._exit(0)
+
+def client(addr, deadline, latencies):
+    while time.time() < deadline:
+        st = time.time()
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            s.connect(addr)
+            s.sendall('req\n')
+            s.recv(100)
+        finally:
+            s.close()
+        latencies.append((st, time.time() - st))
+
+def percentile(values, pc):
+    values = sorted(values)
+    rank = int(len(values) * pc / 100.0 + 0.5)
+    return values[max(0, min(rank, len(values)) - 1)]
+
+def run(options, cold):
+    pid, addr = start_server(options, cold)
+    try:
+        # Allow the initial workers to start
+        time.sleep(options.startup + 0.5)
+        latencies = []
+        deadline = time.time() + options.duration
+        threads = [threading.Thread(target=client, 
+                                    args=(addr, deadline, latencies))
+                   for i in range(options.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+    values = [el for st, el in latencies]
+    # Worst one second window
+    windows = {}
+    for st, el in latencies:
+        windows.setdefault(int(st), []).append(el)
+    worst = max([percentile(v, 95) for v in windows.values()])
+    print '%-5s %7d %8.1f %8.1f %8.1f %8.1f %12.1f' % (
+            cold and 'cold' or 'warm', len(values),
+            len(values) / float(options.duration),
+            percentile(values, 50) * 1000, 
+            percentile(values, 95) * 1000,
+            percentile(values, 99) * 1000,
+            worst * 1000)
+
+def main():
+    optp = optparse.OptionParser(usage='%prog [options]')
+    optp.add_option('-w', '--workers', type='int', default=4,
+            help='worker processes (default %default)')
+    optp.add_option('-c', '--clients', type='int', default=4,
+            help='concurrent clients (default %default)')
+    optp.add_option('-r', '--max-requests', type='int', default=200,
+            help='requests before a worker retires (default %default)')
+    optp.add_option('-s', '--startup', type='float', default=0.5,
+            help='application start-up cost, seconds (default %default)')
+    optp.add_option('-t', '--work', type='float', default=0.005,
+            help='work per request, seconds (default %default)')
+    optp.add_option('-d', '--duration', type='float', default=10,
+            help='seconds of load per mode (default %default)')
+    options, args = optp.parse_args()
+    if args:
+        optp.error('no arguments expected')
+    print ('%d workers, %d clients, recycle every ~%d requests, '
+           '%.2fs start-up, %.1fms per request' %
+           (options.workers, options.clients, options.max_requests,
+            options.startup, options.work * 1000))
+    print '%-5s %7s %8s %8s %8s %8s %12s' % ('mode', 'reqs', 'req/s', 
+            'p50 ms', 'p95 ms', 'p99 ms', 'worst1s p95')
+    run(options, cold=True)
+    run(options, cold=False)
+
+if __name__ == '__main__':
+    main()
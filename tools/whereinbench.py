@@ -0,0 +1,105 @@
+#!/usr/bin/python
+#
+#   The contents of this file are subject to the HACOS License Version 1.2
+#   (the "License"); you may not use this file except in compliance with
+#   the License.  Software distributed under the License is distributed
+#   on an "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, either express or
+#   implied. See the LICENSE file for the specific language governing
+#   rights and limitations under the License.  The Original Software
+#   is "NetEpi Collection". The Initial Developer of the Original
+#   Software is the Health Administration Corporation, incorporated in
+#   the State of New South Wales, Australia.
+#
+#   Copyright (C) 2004-2011 Health Administration Corporation, Australian
+#   Government Department of Health and Ageing, and others.
+#   All Rights Reserved.
+#
+#   Contributors: See the CONTRIBUTORS file for details of contributions.
+#
+
+"""
+Benchmark of large "IN" tests (Query.where_in), comparing a parameter
+per value ("col IN (%s,%s,...)") with a single array parameter ("col =
+ANY (%s::int[])", used above the where_in_array threshold).
+
+A scratch table of integer keys is created in the given database
+(in a transaction that is rolled back), and queries selecting
+increasing numbers of random keys are timed. "plan" is the time to
+EXPLAIN the query (client-side parameter interpolation, sending, parsing
+and planning), and "exec" the time to run it and fetch the rows. Times
+are the best of --repeat runs, in milliseconds.
+"""
+
+import sys
+import os
+import time
+import random
+import optparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from cocklebur import dbobj
+from cocklebur.dbobj import query_builder
+
+def best_time(db, cmd, args, repeat):
+    best = None
+    for n in xrange(repeat):
+        curs = db.cursor()
+        try:
+            st = time.time()
+            dbobj.execute(curs, cmd, args)
+            curs.fetchall()
+            el = time.time() - st
+        finally:
+            curs.close()
+        if best is None or el < best:
+            best = el
+    return best * 1000
+
+def main():
+    optp = optparse.OptionParser(usage='%prog [options] <dsn>')
+    optp.add_option('--rows', type='int', default=200000,
+                    help='rows in scratch table (default %default)')
+    optp.add_option('--repeat', type='int', default=5,
+                    help='runs of each query (default %default)')
+    optp.add_option('--sizes', default='10,100,1000,10000,50000',
+                    help='numbers of values to test (default %default)')
+    options, args = optp.parse_args()
+    if len(args) != 1:
+        optp.error('DSN required')
+    db = dbobj.DatabaseDescriber(dbobj.DSN(args[0]))
+    if not db.array_params():
+        sys.exit('Array parameters need PostgreSQL 8.2 or later')
+    td = db.new_table('wib_test')
+    td.column('wib_id', dbobj.SerialColumn, primary_key=True)
+    td.column('label', dbobj.StringColumn)
+    td.create()
+    try:
+        curs = db.cursor()
+        try:
+            dbobj.execute(curs, 'INSERT INTO wib_test (label)'
+                                ' SELECT \'x\' || n'
+                                ' FROM generate_series(1, %s) AS n',
+                          (options.rows,))
+            dbobj.execute(curs, 'ANALYZE wib_test')
+        finally:
+            curs.close()
+        print '%7s %12s %12s %12s %12s' % ('values', 'IN plan', 'IN exec',
+                                           'ANY plan', 'ANY exec')
+        for size in map(int, options.sizes.split(',')):
+            values = random.sample(xrange(1, options.rows + 1), size)
+            results = []
+            for threshold in (0, 1):
+                query_builder.where_in_array(threshold)
+                query = db.query('wib_test')
+                query.where_in('wib_id', values)
+                cmd, args = query.build_expr(['wib_id'])
+                results.append(best_time(db, 'EXPLAIN ' + cmd, args,
+                                         options.repeat))
+                results.append(best_time(db, cmd, args, options.repeat))
+            print '%7d %12.2f %12.2f %12.2f %12.2f' % ((size,) + tuple(results))
+    finally:
+        db.rollback()
+
+if __name__ == '__main__':
+    main()